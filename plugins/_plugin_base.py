@@ -26,7 +26,7 @@ from _stdlib import (
     Logger,
     Moderating,
     control_ratelimit,
-    gen_reddit_instance,
+    thread_reddit,
 )
 
 sys.stderr = sys.stdout  # just to keep stderr clean for main.py
@@ -42,7 +42,7 @@ moderating = Moderating()
 
 def main(type_: str, **kwargs):
     reddit = (
-        gen_reddit_instance()
+        thread_reddit()
     )  # if you don't plan to use mod privleges pass an _stdlib.Secrets instance to another reddit account.
     #    if you don't plan to use praw at all remove the call to this function.
 
@@ -80,7 +80,7 @@ def main(type_: str, **kwargs):
 #
 # > # type: "on_invite"
 # > def main(_, **kwargs):
-# >     reddit = gen_reddit_instance()
+# >     reddit = thread_reddit()
 # >     sub = reddit.subreddit(str(kwargs["subreddit"]))
 # >
 # >     for post in sub.hot(limit=100):
@@ -88,4 +88,7 @@ def main(type_: str, **kwargs):
 #
 # This will not interfere with the original reddit instance.
 #
+# `thread_reddit` gives every thread its own instance and keeps it for the next event, all instances share one token and
+# one connection pool. Only use `gen_reddit_instance` for an instance that is handed to another thread.
+#
 # -=======================================================================================================================================-
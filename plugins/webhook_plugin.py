@@ -4,9 +4,13 @@
 
 import json
 import os
+import random
+import sqlite3
 import sys
+import threading
+import time
 from pathlib import Path as p
-from typing import Dict
+from typing import Any, Callable, Dict, List, Mapping, Tuple
 
 import requests
 
@@ -20,6 +24,8 @@ ABSDIR = p(os.path.dirname(ABSPATH))
 
 sys.path.append(str(ABSDIR.joinpath("../src")))
 
+outbox_path = str(ABSDIR.joinpath("../cache/webhook.outbox.sqlite3"))
+
 ##############################
 # ======== INSTACES ======== #
 ##############################
@@ -30,41 +36,362 @@ sys.stderr = sys.stdout  # just to keep stderr clean for main.py
 logger = Logger(str(ABSDIR.joinpath("../logs/webhook.log")), "WebhookPlugin")
 configs = Configs(str(ABSDIR.joinpath("../config/plugins/webhook.json")))
 
+MAX_EMBEDS = 10  # * discord's limits for one message
+MAX_CONTENT = 2000
+CLAIM_LIMIT = 50  # * messages taken out of the outbox per delivery round
+LEASE = 60.0  # * seconds a claimed message is hidden from other processes
+# * seconds, picks up messages spooled by other processes or a previous run
+IDLE_POLL = 5.0
+# * seconds before the first retry after an error, doubled every time
+RETRY_BACKOFF = 2.0
+MAX_RETRY_BACKOFF = 300.0
+REQUEST_TIMEOUT = 30.0
+
+# ? one keep-alive connection for every delivery instead of a new TLS handshake per event
+session = requests.Session()
+
+#############################
+# ======== CLASSES ======== #
+#############################
+
+
+class Outbox:
+    """Messages waiting to be posted to the webhook, spooled to disk so they survive restarts.
+
+    Backed by SQLite in WAL mode like `Banned`, main.py and the submission workers all load
+    this plugin and share the same outbox. A delivery round claims the messages it sends for
+    `LEASE` seconds, so two processes never post the same message, and a message claimed by a
+    process that died is sent again once its lease expired.
+    """
+
+    def __init__(self, path: str = outbox_path):
+        self.path = path
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        connection: "sqlite3.Connection | None" = getattr(
+            self._local, "connection", None
+        )
+        if connection is None:
+            # ? isolation_level=None disables implicit transactions, claims use BEGIN IMMEDIATE
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS outbox ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "message TEXT NOT NULL, "
+                "queued_at REAL NOT NULL, "
+                "due_at REAL NOT NULL, "
+                "attempts INTEGER NOT NULL DEFAULT 0)"
+            )
+            self._local.connection = connection
+        return connection
+
+    def __len__(self) -> int:
+        return self._connection().execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+    def put(self, message: dict):
+        now = time.time()
+        self._connection().execute(
+            "INSERT INTO outbox (message, queued_at, due_at) VALUES (?, ?, ?)",
+            (json.dumps(message), now, now),
+        )
+
+    def next_due(self) -> "float | None":
+        """When the next message can be sent, `None` if the outbox is empty.
+
+        Returns:
+            float | None: Unix time.
+        """
+        return (
+            self._connection().execute("SELECT MIN(due_at) FROM outbox").fetchone()[0]
+        )
+
+    def claim(self, limit: int = CLAIM_LIMIT) -> List[Tuple[int, int, dict]]:
+        """Take the oldest messages that are due and hide them from others for `LEASE` seconds.
+
+        Args:
+            limit (int, optional): Defaults to CLAIM_LIMIT.
+
+        Returns:
+            List[Tuple[int, int, dict]]: (id, attempts, message), oldest first.
+        """
+        now = time.time()
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            rows = connection.execute(
+                "SELECT id, attempts, message FROM outbox WHERE due_at <= ? "
+                "ORDER BY id LIMIT ?",
+                (now, limit),
+            ).fetchall()
+            connection.executemany(
+                "UPDATE outbox SET due_at = ? WHERE id = ?",
+                ((now + LEASE, x[0]) for x in rows),
+            )
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+        return [(id_, attempts, json.loads(message)) for id_, attempts, message in rows]
+
+    def ack(self, ids: List[int]):
+        """Remove messages for good, once they were delivered or rejected.
+
+        Args:
+            ids (List[int])
+        """
+        self._connection().executemany(
+            "DELETE FROM outbox WHERE id = ?", ((x,) for x in ids)
+        )
+
+    def retry(self, ids: List[int], delay: float):
+        """Hand claimed messages back, they are sent again in `delay` seconds.
+
+        Args:
+            ids (List[int])
+            delay (float)
+        """
+        self._connection().executemany(
+            "UPDATE outbox SET due_at = ?, attempts = attempts + 1 WHERE id = ?",
+            ((time.time() + delay, x) for x in ids),
+        )
+
+
 ###############################
 # ======== FUNCTIONS ======== #
 ###############################
 
 
-def format_webhook(webhook: Dict[str, "str | bool | list"], **kwargs) -> dict:
-    """Format every string inside a webhook dict.
+def _compile(node: Any) -> Callable[[Mapping[str, Any]], Any]:
+    """Turn a message template into a function that builds the message.
+
+    Only the leaf strings that contain a `%` are formatted, everything else is copied as is,
+    so the values of an event can hold any character without breaking the message.
 
     Args:
-        webhook (Dict[str, "str | bool | list"]): The webhook dict.
+        node (Any): Part of a template from the config file.
 
     Returns:
-        dict: Formatted dict.
+        Callable[[Mapping[str, Any]], Any]: Takes the event's kwargs.
     """
-    # XXX: I'm so sorry
-    return json.loads(json.dumps(webhook) % kwargs)
-    # so so sorry
+    if isinstance(node, dict):
+        items = [(key, _compile(value)) for key, value in node.items()]
+        return lambda kwargs: {key: render(kwargs) for key, render in items}
+
+    if isinstance(node, (list, tuple)):
+        renders = [_compile(x) for x in node]
+        return lambda kwargs: [render(kwargs) for render in renders]
+
+    if isinstance(node, str) and "%" in node:
+        return lambda kwargs: node % kwargs
+
+    return lambda kwargs: node
+
+
+def render_message(type_: str, kwargs: Mapping[str, Any]) -> "dict | None":
+    """Build the message for an event from its template.
+
+    The templates are compiled once and again only when the config file changed.
+
+    Args:
+        type_ (str): The event type.
+        kwargs (Mapping[str, Any]): The event's kwargs.
+
+    Returns:
+        dict | None: `None` if there is no template for the event type.
+    """
+    global _templates
+
+    version, templates = _templates
+    if version != configs.version:
+        version = configs.version
+        templates = {
+            key: _compile(value)
+            for key, value in (configs.get("messages", default=None) or {}).items()
+        }
+        _templates = (version, templates)
+
+    template = templates.get(type_)
+    if template is None:
+        return None
+    return template(kwargs)
+
+
+def _can_merge(batch: dict, message: dict) -> bool:
+    # ? username, avatar_url, ... can only be merged when they are the same
+    for key in set(batch) | set(message):
+        if key not in ("content", "embeds") and batch.get(key) != message.get(key):
+            return False
+
+    embeds = len(batch.get("embeds", ())) + len(message.get("embeds", ()))
+    content = len(batch.get("content", "")) + len(message.get("content", "")) + 1
+
+    return embeds <= MAX_EMBEDS and content <= MAX_CONTENT
 
 
-def send_to_webhook(data: dict) -> int:
+def coalesce(messages: List[Tuple[int, dict]]) -> List[Tuple[List[int], dict]]:
+    """Pack queued messages into as few webhook posts as discord allows, keeping their order.
+
+    Contents are joined line by line and embeds are appended, up to `MAX_EMBEDS` embeds and
+    `MAX_CONTENT` characters per post.
+
+    Args:
+        messages (List[Tuple[int, dict]]): (id, message), oldest first.
+
+    Returns:
+        List[Tuple[List[int], dict]]: (ids of the merged messages, post).
+    """
+    batches: List[Tuple[List[int], dict]] = []
+
+    for id_, message in messages:
+        if len(batches) and _can_merge(batches[-1][1], message):
+            ids, batch = batches[-1]
+            ids.append(id_)
+
+            if message.get("content"):
+                batch["content"] = "\n".join(
+                    x for x in (batch.get("content"), message["content"]) if x
+                )
+            if message.get("embeds"):
+                batch["embeds"] = batch.get("embeds", []) + message["embeds"]
+            continue
+
+        batches.append(([id_], dict(message)))
+
+    return batches
+
+
+def _retry_after(response: requests.Response) -> float:
+    """How long discord asked us to wait, from the `Retry-After` header or the json body.
+
+    Args:
+        response (requests.Response)
+
+    Returns:
+        float: Seconds.
+    """
+    try:
+        return float(response.headers["Retry-After"])
+    except (KeyError, ValueError):
+        pass
+
+    try:
+        return float(response.json()["retry_after"])
+    except Exception:
+        return RETRY_BACKOFF
+
+
+def _backoff(attempts: int) -> float:
+    # ? full jitter, processes that failed together do not retry together
+    return random.uniform(0, min(RETRY_BACKOFF * 2**attempts, MAX_RETRY_BACKOFF))
+
+
+def send_to_webhook(data: dict) -> requests.Response:
     """Send json data to a webhook.
 
     Args:
         data (dict): Json data in a dict format.
 
     Returns:
-        int: Status code.
+        requests.Response
     """
     webhook = configs.get("webhook")
-    response = requests.post(
+    return session.post(
         webhook,
         json=data,
+        timeout=REQUEST_TIMEOUT,
     )
 
-    return response.status_code
+
+def deliver(messages: List[Tuple[int, int, dict]]):
+    """Post claimed messages, retrying them later when discord is rate limiting or failing.
+
+    Args:
+        messages (List[Tuple[int, int, dict]]): (id, attempts, message), oldest first.
+    """
+    attempts = {id_: n for id_, n, _ in messages}
+    batches = coalesce([(id_, message) for id_, _, message in messages])
+
+    for i, (ids, batch) in enumerate(batches):
+        remaining = [id_ for x, _ in batches[i:] for id_ in x]
+
+        try:
+            response = send_to_webhook(batch)
+        except requests.RequestException as e:
+            delay = _backoff(max(attempts[x] for x in ids))
+            logger.warning("Webhook failed, retrying in %ds : %s" % (delay, e))
+            outbox.retry(remaining, delay)
+            return
+
+        # ? discord answers 204, or 200 when `?wait=true` is set on the url
+        if response.status_code in (200, 204):
+            outbox.ack(ids)
+
+            # * the bucket is empty, wait instead of running into a 429
+            if response.headers.get("X-RateLimit-Remaining") == "0":
+                time.sleep(
+                    float(response.headers.get("X-RateLimit-Reset-After", 0))
+                    + random.uniform(0, 0.5)
+                )
+            continue
+
+        if response.status_code == 429:
+            delay = _retry_after(response) + random.uniform(0, 1)
+            logger.warning(
+                "Webhook is rate limited, retrying %d message(s) in %.1fs"
+                % (len(remaining), delay)
+            )
+            outbox.retry(remaining, delay)
+            return
+
+        if response.status_code >= 500:
+            delay = _backoff(max(attempts[x] for x in ids))
+            logger.warning(
+                "Webhook got status code %d, retrying in %ds"
+                % (response.status_code, delay)
+            )
+            outbox.retry(remaining, delay)
+            return
+
+        # ! any other status will never succeed, the messages are dropped
+        logger.error(
+            "Webhook got status code %d for %d message(s), dropping them : %s"
+            % (response.status_code, len(ids), response.text)
+        )
+        outbox.ack(ids)
+
+
+def _delivery_loop():
+    while 1:
+        try:
+            due = outbox.next_due()
+            wait = IDLE_POLL if due is None else due - time.time()
+
+            if wait > 0:
+                _wake.wait(min(wait, IDLE_POLL))
+                _wake.clear()
+                continue
+
+            # * let the events of a spam wave pile up and post them together
+            time.sleep(configs.get("batch_window", default=2.0))
+
+            messages = outbox.claim()
+            if len(messages):
+                deliver(messages)
+
+        except Exception as e:
+            logger.error("Webhook delivery failed : %s" % e)
+            time.sleep(IDLE_POLL)
+
+
+outbox = Outbox()
+_templates: Tuple[int, Dict[str, Callable[[Mapping[str, Any]], Any]]] = (-1, {})
+_wake = threading.Event()
+# ? started on load so messages spooled before a restart are sent without waiting for an event
+threading.Thread(target=_delivery_loop, name="Webhook delivery", daemon=True).start()
 
 
 ##########################
@@ -73,11 +400,16 @@ def send_to_webhook(data: dict) -> int:
 
 
 def main(type_: str, **kwargs):
-    message = format_webhook(configs.get("messages", type_), **kwargs)
-    response = send_to_webhook(message)
+    if not configs.get("webhook"):
+        logger.warning("No webhook is set, message for type %s is dropped" % type_)
+        return
+
+    message = render_message(type_, kwargs)
+    if message is None:
+        logger.error("No message is set for type %s" % type_)
+        return
 
-    # 204 is the default response for a discord webhook - https://developer.mozilla.org/en-US/docs/Web/HTTP/Status/204
-    if response != 204:
-        logger.error("Webhook for type %s got status code %d!" % (type_, response))
+    outbox.put(message)
+    _wake.set()
 
     return
@@ -4,9 +4,9 @@ print(
     " _   _ ____                        ____  _                       \n| | | / ___| _ __   __ _ _ __ ___ / ___|| | __ _ _   _  ___ _ __ \n| |_| \\___ \\| '_ \\ / _` | '_ ` _ \\\\___ \\| |/ _` | | | |/ _ \\ '__|\n|  _  |___) | |_) | (_| | | | | | |___) | | (_| | |_| |  __/ |   \n|_| |_|____/| .__/ \\__,_|_| |_| |_|____/|_|\\__,_|\\__, |\\___|_|   \n            |_|                                  |___/\n"
 )
 
-if sys.version_info.major != 3 or sys.version_info.minor < 6:
+if sys.version_info.major != 3 or sys.version_info.minor < 8:
     print(
-        "Please upgrade your python version to Python ≥ 3.6"
+        "Please upgrade your python version to Python ≥ 3.8"
         + "\n"
         + "Refer to https://www.python.org/downloads/"
     )
@@ -22,10 +22,9 @@ os.chdir(os.path.dirname(ABSPATH))
 
 dir_paths = ["cache", "config", "config/plugins", "data", "keys", "plugins", "logs"]
 file_paths = {
-    "cache/banned_users.cache.json": "{}",
     "cache/moderated_subreddits.cache.json": "[]",
-    "config/config.json": '{\n\t"logging": {\n\t\t"file_level": 20,\n\t\t"stdout_level": 10\n\t},\n\t"threading": {\n\t\t"max_subs_per_thread": 10\n\t},\n\t"on_invite": {\n\t\t"send_message": true,\n\t\t"message_content": {\n\t\t\t"subject": "",\n\t\t\t"message": ""\n\t\t},\n\t\t"make_announcement": false,\n\t\t"announcement_content": {\n\t\t\t"title": "",\n\t\t\t"selftext": ""\n\t\t},\n\t\t"ignore": []\n\t},\n\t"on_bad_post": {\n\t\t"remove": true,\n\t\t"remove_opts": {\n\t\t\t"spam": true\n\t\t},\n\t\t"remove_message_content": {\n\t\t\t"message": "",\n\t\t\t"type": "public"\n\t\t},\n\t\t"ban": true,\n\t\t"ban_opts": {\n\t\t\t"ban_message": "",\n\t\t\t"ban_reason": "",\n\t\t\t"duration": null,\n\t\t\t"note": ""\n\t\t}\n\t},\n\t"main.py": {\n\t\t"scripts": ["inbox.py", "submissions.py"]\n\t},\n\t"plugins": []\n}',
-    "config/plugins/webhook.json": '{\n\t"webhook": "",\n\t"messages": {\n\t\t"on_invite": {},\n\t\t"main_critical": {}\n\t}\n}',
+    "config/config.json": '{\n\t"logging": {\n\t\t"file_level": 20,\n\t\t"stdout_level": 10,\n\t\t"max_file_size": 10,\n\t\t"backup_count": 5\n\t},\n\t"threading": {\n\t\t"max_subs_per_thread": 10,\n\t\t"poll_interval": 10,\n\t\t"min_poll_interval": 2,\n\t\t"max_poll_interval": 120,\n\t\t"poll_requests_per_minute": 40,\n\t\t"adaptive_shard_size": true,\n\t\t"rebalance_threshold": 2.0,\n\t\t"max_catch_up_pages": 10\n\t},\n\t"bans": {\n\t\t"workers": 4,\n\t\t"per_minute": 30\n\t},\n\t"on_invite": {\n\t\t"send_message": true,\n\t\t"message_content": {\n\t\t\t"subject": "",\n\t\t\t"message": ""\n\t\t},\n\t\t"make_announcement": false,\n\t\t"announcement_content": {\n\t\t\t"title": "",\n\t\t\t"selftext": ""\n\t\t},\n\t\t"ignore": []\n\t},\n\t"on_bad_post": {\n\t\t"remove": true,\n\t\t"remove_opts": {\n\t\t\t"spam": true\n\t\t},\n\t\t"remove_message_content": {\n\t\t\t"message": "",\n\t\t\t"type": "public"\n\t\t},\n\t\t"ban": true,\n\t\t"ban_opts": {\n\t\t\t"ban_message": "",\n\t\t\t"ban_reason": "",\n\t\t\t"duration": null,\n\t\t\t"note": ""\n\t\t}\n\t},\n\t"main.py": {\n\t\t"scripts": ["inbox.py", "submissions.py"],\n\t\t"submission_workers": 1,\n\t\t"worker_timeout": 300,\n\t\t"max_restarts": 5\n\t},\n\t"metrics": {\n\t\t"enabled": true,\n\t\t"port": 9464\n\t},\n\t"plugins": []\n}',
+    "config/plugins/webhook.json": '{\n\t"webhook": "",\n\t"batch_window": 2,\n\t"messages": {\n\t\t"on_invite": {},\n\t\t"main_critical": {}\n\t}\n}',
     "keys/secrets.json": '{\n\t"client_id": "",\n\t"client_secret": "",\n\t"password": "",\n\t"user_agent": "",\n\t"username": ""\n}',
     "data/blacklist.json": "[]",
 }
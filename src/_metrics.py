@@ -0,0 +1,370 @@
+#############################
+# ======== IMPORTS ======== #
+#############################
+
+import glob
+import json
+import os
+import threading
+import urllib.request
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path as p
+from typing import Any, Callable, Dict, List, Tuple
+
+############################
+# ======== PATHS ========= #
+############################
+
+
+ABSPATH = os.path.abspath(__file__)
+ABSDIR = p(os.path.dirname(ABSPATH))
+
+_metrics_dir = str(ABSDIR.joinpath("../cache/metrics"))
+
+LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SCRAPE_TIMEOUT = 2.0  # * seconds main.py waits for every process it aggregates
+
+Labels = Tuple[str, ...]
+
+#############################
+# ======== CLASSES ======== #
+#############################
+
+
+class _Metric(ABC):
+    """Base of the metrics, every thread updates its own shard so the hot path takes no lock.
+
+    A shard is only written by its thread, a scrape copies every shard (a single atomic
+    `dict.copy` under the GIL) and adds them up.
+    """
+
+    type_ = "untyped"
+
+    def __init__(self, name: str, help_: str, labels: Labels = ()):
+        self.name = name
+        self.help = help_
+        self.labels = labels
+        self._local = threading.local()
+        self._shards: List[Dict[Labels, Any]] = []
+        self._shards_lock = threading.Lock()
+
+    def _shard(self) -> Dict[Labels, Any]:
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard: Dict[Labels, Any] = {}
+            with self._shards_lock:
+                self._shards.append(shard)
+            self._local.shard = shard
+            return shard
+
+    def _copies(self) -> List[Dict[Labels, Any]]:
+        with self._shards_lock:
+            shards = list(self._shards)
+        return [x.copy() for x in shards]
+
+    @abstractmethod
+    def samples(self) -> List[List[Any]]:
+        """Current values as json friendly `[label values, value]` pairs."""
+
+
+class Counter(_Metric):
+    type_ = "counter"
+
+    def inc(self, *labels: str, value: float = 1) -> None:
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + value
+
+    def samples(self) -> List[List[Any]]:
+        totals: Dict[Labels, float] = {}
+        for shard in self._copies():
+            for labels, value in shard.items():
+                totals[labels] = totals.get(labels, 0) + value
+        return [[list(k), v] for k, v in totals.items()]
+
+
+class Gauge(_Metric):
+    """A value that goes up and down, either `set` or read from callbacks at scrape time."""
+
+    type_ = "gauge"
+
+    def __init__(self, name: str, help_: str, labels: Labels = ()):
+        super().__init__(name, help_, labels)
+        self._values: Dict[Labels, float] = {}
+        self._callbacks: List[Callable[[], Dict[Labels, float]]] = []
+
+    def set(self, value: float, *labels: str) -> None:
+        self._values[labels] = value
+
+    def track(self, callback: Callable[[], "float | Dict[Labels, float]"]) -> None:
+        """Read the gauge from `callback` at every scrape, nothing is paid on the hot path.
+
+        Args:
+            callback (Callable[[], float | Dict[Labels, float]]): The value, or the value
+                of every label combination.
+        """
+
+        def values() -> Dict[Labels, float]:
+            result = callback()
+            return result if isinstance(result, dict) else {(): result}
+
+        self._callbacks.append(values)
+
+    def samples(self) -> List[List[Any]]:
+        values = self._values.copy()
+        for callback in list(self._callbacks):
+            try:
+                values.update(callback())
+            except Exception:
+                continue  # ? a failing callback must not break the whole scrape
+        return [[list(k), v] for k, v in values.items()]
+
+
+class Histogram(_Metric):
+    type_ = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help_: str,
+        labels: Labels = (),
+        buckets: Tuple[float, ...] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, help_, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labels: str) -> None:
+        shard = self._shard()
+        state = shard.get(labels)
+        if state is None:
+            # [count per bucket (the last one is +Inf), sum]
+            state = shard[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        state[0][bisect_left(self.buckets, value)] += 1
+        state[1] += value
+
+    def samples(self) -> List[List[Any]]:
+        totals: Dict[Labels, List[Any]] = {}
+        for shard in self._copies():
+            for labels, (counts, sum_) in shard.items():
+                total = totals.setdefault(labels, [[0] * len(counts), 0.0])
+                total[0] = [a + b for a, b in zip(total[0], counts)]
+                total[1] += sum_
+        return [
+            [list(k), {"buckets": list(self.buckets), "counts": v[0], "sum": v[1]}]
+            for k, v in totals.items()
+        ]
+
+
+class Metrics:
+    """The metrics of a process, served in the Prometheus text format on localhost.
+
+    Every process that calls `serve` writes its port to `cache/metrics/<process>.json`.
+    main.py serves its own metrics and those of every registered process on one endpoint,
+    each series labeled with the `process` it comes from.
+    """
+
+    def __init__(self, metrics_dir: str = _metrics_dir):
+        self.metrics_dir = metrics_dir
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+        self._server: "ThreadingHTTPServer | None" = None
+        self.process = ""
+
+    def counter(self, name: str, help_: str, labels: Labels = ()) -> Counter:
+        return self._get(Counter, name, help_, labels)  # type: ignore
+
+    def gauge(self, name: str, help_: str, labels: Labels = ()) -> Gauge:
+        return self._get(Gauge, name, help_, labels)  # type: ignore
+
+    def histogram(
+        self,
+        name: str,
+        help_: str,
+        labels: Labels = (),
+        buckets: Tuple[float, ...] = LATENCY_BUCKETS,
+    ) -> Histogram:
+        return self._get(Histogram, name, help_, labels, buckets=buckets)  # type: ignore
+
+    def _get(
+        self, class_: type, name: str, help_: str, labels: Labels, **kwargs: Any
+    ) -> _Metric:
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = class_(name, help_, labels, **kwargs)
+        return metric
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Every metric of this process in a json friendly form.
+
+        Returns:
+            Dict[str, Any]: name: {"type", "help", "labels", "samples"}
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+
+        return {
+            x.name: {
+                "type": x.type_,
+                "help": x.help,
+                "labels": list(x.labels),
+                "samples": x.samples(),
+            }
+            for x in metrics
+        }
+
+    def collect(self) -> List[Tuple[str, Dict[str, Any]]]:
+        """The snapshots of this process and of every process that registered a port.
+
+        Processes that do not answer within `SCRAPE_TIMEOUT` are left out.
+
+        Returns:
+            List[Tuple[str, Dict[str, Any]]]: (process, snapshot)
+        """
+        snapshots = [(self.process, self.snapshot())]
+
+        for path in sorted(glob.glob(os.path.join(self.metrics_dir, "*.json"))):
+            try:
+                with open(path, "rt", encoding="utf-8") as f:
+                    registration = json.load(f)
+
+                if registration["pid"] == os.getpid():
+                    continue
+
+                url = "http://127.0.0.1:%d/metrics.json" % registration["port"]
+                with urllib.request.urlopen(url, timeout=SCRAPE_TIMEOUT) as response:
+                    snapshots.append((registration["process"], json.load(response)))
+            except (OSError, ValueError, KeyError):
+                continue  # ? the process is gone or restarting
+
+        return snapshots
+
+    def serve(self, process: str, port: int = 0, aggregate: bool = False) -> int:
+        """Serve the metrics on `127.0.0.1` from a background thread.
+
+        Args:
+            process (str): Name of this process in the aggregated metrics.
+            port (int, optional): `0` picks a free port. Defaults to 0.
+            aggregate (bool, optional): Serve the metrics of every registered process
+                instead of only this one's. Defaults to False.
+
+        Returns:
+            int: The port.
+        """
+        self.process = process
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/metrics.json":
+                    body = json.dumps(metrics.snapshot()).encode("utf-8")
+                    content_type = "application/json"
+                elif self.path == "/metrics":
+                    snapshots = (
+                        metrics.collect()
+                        if aggregate
+                        else [(metrics.process, metrics.snapshot())]
+                    )
+                    body = render(snapshots).encode("utf-8")
+                    content_type = "text/plain; version=0.0.4; charset=utf-8"
+                else:
+                    self.send_error(404)
+                    return
+
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass  # * scrapes are not worth a log line
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(
+            target=self._server.serve_forever, name="Metrics", daemon=True
+        ).start()
+
+        port = self._server.server_address[1]
+
+        if not aggregate:
+            os.makedirs(self.metrics_dir, exist_ok=True)
+            path = os.path.join(self.metrics_dir, "%s.json" % process)
+            with open(path + ".tmp", "wt", encoding="utf-8") as f:
+                json.dump({"process": process, "pid": os.getpid(), "port": port}, f)
+            os.replace(path + ".tmp", path)
+
+        return port
+
+
+###############################
+# ======== FUNCTIONS ======== #
+###############################
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _series(name: str, labels: Dict[str, Any], value: float) -> str:
+    if not len(labels):
+        return "%s %r" % (name, float(value))
+    return "%s{%s} %r" % (
+        name,
+        ",".join('%s="%s"' % (k, _escape(v)) for k, v in labels.items()),
+        float(value),
+    )
+
+
+def render(snapshots: List[Tuple[str, Dict[str, Any]]]) -> str:
+    """Write snapshots in the Prometheus text format, every series labeled with its process.
+
+    Args:
+        snapshots (List[Tuple[str, Dict[str, Any]]]): (process, snapshot)
+
+    Returns:
+        str
+    """
+    families: Dict[str, Dict[str, Any]] = {}
+    lines: Dict[str, List[str]] = {}
+
+    for process, snapshot in snapshots:
+        for name, metric in snapshot.items():
+            families.setdefault(name, metric)
+            out = lines.setdefault(name, [])
+
+            for values, value in metric["samples"]:
+                labels: Dict[str, Any] = {"process": process}
+                labels.update(zip(metric["labels"], values))
+
+                if metric["type"] != "histogram":
+                    out.append(_series(name, labels, value))
+                    continue
+
+                cumulative = 0
+                for bound, count in zip(value["buckets"] + ["+Inf"], value["counts"]):
+                    cumulative += count
+                    out.append(
+                        _series(name + "_bucket", dict(labels, le=bound), cumulative)
+                    )
+                out.append(_series(name + "_sum", labels, value["sum"]))
+                out.append(_series(name + "_count", labels, cumulative))
+
+    text: List[str] = []
+    for name in sorted(families):
+        text.append("# HELP %s %s" % (name, families[name]["help"]))
+        text.append("# TYPE %s %s" % (name, families[name]["type"]))
+        text.extend(lines[name])
+
+    return "\n".join(text) + "\n"
+
+
+###############################
+# ======== INSTANCES ======== #
+###############################
+
+
+metrics = Metrics()
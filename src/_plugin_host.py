@@ -0,0 +1,63 @@
+#############################
+# ======== IMPORTS ======== #
+#############################
+
+import json
+import os
+import struct
+import sys
+import time
+
+from _plugin_loader import PluginLoader
+from _stdlib import Logger, p
+
+############################
+# ======== PATHS ========= #
+############################
+
+
+ABSPATH = os.path.abspath(__file__)
+ABSDIR = p(os.path.dirname(ABSPATH))
+
+
+###############################
+# ======== INSTANCES ======== #
+###############################
+
+
+logger = Logger(str(ABSDIR.joinpath("../logs/plugin.host.log")), "PluginHost")
+
+
+##########################
+# ======== MAIN ======== #
+##########################
+
+
+def main():
+    """Runs the isolated plugins for the event types given as arguments.
+
+    Started by `PluginLoader`, reads the events it writes to stdin until stdin is closed.
+    """
+    plugins = PluginLoader(sys.argv[1:], host=True)
+    stream = sys.stdin.buffer
+
+    while 1:
+        header = stream.read(4)
+        if len(header) < 4:
+            break
+
+        (size,) = struct.unpack(">I", header)
+        type_, args, kwargs = json.loads(stream.read(size))
+
+        plugins.on(type_, *args, **kwargs)
+
+    logger.info("The parent process is gone, finishing queued events")
+
+    while not plugins.is_idle():
+        time.sleep(0.1)
+
+    plugins.check()
+
+
+if __name__ == "__main__":
+    main()
@@ -3,13 +3,19 @@
 #############################
 
 import importlib
+import json
 import os
+import struct
 import sys
 import threading
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from subprocess import PIPE, Popen
 from types import ModuleType
-from typing import Dict, List, Tuple
+from typing import Any, Deque, Dict, List, Tuple
 
+from _metrics import metrics
 from _stdlib import Configs, Logger, p
 
 ############################
@@ -34,57 +40,415 @@ _logger = Logger(str(ABSDIR.joinpath("../logs/plugin.loader.log")), "PluginLoade
 
 _plugins = _configs.get("plugins")
 
+ON_FULL = ("drop_oldest", "drop_newest", "block")
+WATCHDOG_INTERVAL = 5.0
+HOST_QUEUE_SIZE = 1000  # * events kept while the plugin host is slow or restarting
+MAX_HOST_BACKOFF = 60.0
+
+_queue_depth = metrics.gauge(
+    "plugin_queue_depth", "Events waiting for every plugin", ("plugin",)
+)
+
 
 ###########################
 # ======== DATA ========= #
 ###########################
 
 
-class PluginLoader:
+class Plugin:
+    """A loaded plugin with its own bounded queue of events and its stats.
+
+    Options from the plugin object in `config.json`:
+        queue_size (int): How many events can wait for the plugin. Defaults to 100.
+        on_full (str): "drop_oldest", "drop_newest" or "block" (wait up to `block_timeout`
+            seconds for room, then drop the new event). Defaults to "drop_oldest".
+        block_timeout (float): Defaults to 5.
+        timeout (float): Seconds a single call may take, the plugin's events are dropped
+            while a call runs longer. Defaults to 300.
+    """
+
+    def __init__(self, module: ModuleType, options: Dict[str, Any]):
+        self.module = module
+        self.name: str = options["script"]
+        self.types: List[str] = list(options["types"])
+        self.queue_size: int = options.get("queue_size", 100)
+        self.on_full: str = options.get("on_full", "drop_oldest")
+        self.block_timeout: float = options.get("block_timeout", 5)
+        self.timeout: float = options.get("timeout", 300)
+
+        if self.on_full not in ON_FULL:
+            _logger.error(
+                "%s: unknown on_full %r, using drop_oldest" % (self.name, self.on_full)
+            )
+            self.on_full = "drop_oldest"
+
+        # ? (args, kwargs, queued at)
+        self.events: Deque[Tuple[tuple, Dict[str, Any], float]] = deque()
+        self.scheduled = False  # * if a worker is busy with this plugin or about to be
+        self.stalled = False  # * if the running call took longer than `timeout`
+        self.processed = 0
+        self.dropped = 0
+        self.failed = 0
+        self.timed_out = 0
+        self.latency = 0.0  # seconds per call, moving average
+        self.max_latency = 0.0
+        self.max_wait = 0.0  # * the longest an event waited in the queue
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": len(self.events),
+            "processed": self.processed,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "timed_out": self.timed_out,
+            "latency": self.latency,
+            "max_latency": self.max_latency,
+            "max_wait": self.max_wait,
+        }
+
+
+class PluginHost:
+    """Runs the plugins marked `isolated` in a `_plugin_host.py` process.
+
+    Every event is written to the host's stdin as a 4 byte big endian length followed by the
+    compact json of `[type, args, kwargs]`. A sender thread does the writing so `send` never
+    waits on the host, up to `HOST_QUEUE_SIZE` events wait while the host is slow or being
+    restarted, the oldest ones are dropped after that. A host that exited, or could not be
+    written to and was killed, is started again, waiting twice as long after every crash, up
+    to `MAX_HOST_BACKOFF` seconds.
+    """
+
     def __init__(self, types: List[str]):
+        self.types = types
+        self.sent = 0
+        self.dropped = 0
+        self.restarts = 0
+        self._events: Deque[bytes] = deque()
+        self._ready = threading.Condition()
+        self._process: "Popen | None" = None
+        self._started = 0.0
+        self._backoff = 0.0
+
+        threading.Thread(target=self._send_loop, name="PluginHost", daemon=True).start()
+
+    def send(self, type_: str, args: tuple, kwargs: Dict[str, Any]):
+        payload = json.dumps(
+            [type_, list(args), kwargs], separators=(",", ":"), default=str
+        ).encode("utf-8")
+
+        with self._ready:
+            if len(self._events) >= HOST_QUEUE_SIZE:
+                self._events.popleft()
+                self.dropped += 1
+
+                if self.dropped % 100 == 1:
+                    _logger.warning(
+                        "The plugin host is too busy, %d event(s) were dropped so far"
+                        % self.dropped
+                    )
+
+            self._events.append(payload)
+            self._ready.notify()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": len(self._events),
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "restarts": self.restarts,
+        }
+
+    def _send_loop(self):
+        while 1:
+            with self._ready:
+                self._ready.wait_for(lambda: len(self._events))
+                payload = self._events[0]
+
+            process = self._running_process()
+            if process is None:
+                continue  # ? could not start the host, `_running_process` already waited
+
+            try:
+                process.stdin.write(struct.pack(">I", len(payload)) + payload)  # type: ignore
+                process.stdin.flush()  # type: ignore
+            except OSError as e:
+                _logger.error(
+                    "Sending an event to the plugin host failed, restarting it: %s" % e
+                )
+                # ? a host with a broken pipe may still be alive, it is not reused
+                self._kill(process)
+                continue  # * the event is sent again to the next host, after the backoff
+
+            with self._ready:
+                if len(self._events) and self._events[0] is payload:
+                    self._events.popleft()
+                self.sent += 1
+
+    def _kill(self, process: Popen):
+        process.kill()
+        process.wait()
+        try:
+            process.stdin.close()  # type: ignore
+        except OSError:
+            pass
+
+    def _running_process(self) -> "Popen | None":
+        """The host process, started again if it is not running.
+
+        Returns:
+            Popen | None: `None` if the host could not be started, after waiting the backoff.
+        """
+        if self._process is not None:
+            if (exit_code := self._process.poll()) is None:
+                return self._process
+
+            _logger.error("The plugin host exited with code %d" % exit_code)
+            self._process = None
+
+            # * a host that ran for a while starts over with a short wait
+            if time.monotonic() - self._started > MAX_HOST_BACKOFF:
+                self._backoff = 0.0
+            self._wait_backoff()
+            self.restarts += 1
+
+        try:
+            # ? its own stderr, an inherited pipe would outlive the script that started it
+            self._process = Popen(
+                [sys.executable, str(ABSDIR.joinpath("_plugin_host.py"))] + self.types,
+                stdin=PIPE,
+                stderr=PIPE,
+            )
+        except OSError as e:
+            _logger.error("Could not start the plugin host: %s" % e)
+            self._wait_backoff()
+            return None
+
+        threading.Thread(
+            target=self._log_stderr,
+            args=(self._process,),
+            name="PluginHost stderr",
+            daemon=True,
+        ).start()
+
+        self._started = time.monotonic()
+        _logger.info("Started the plugin host for %s" % self.types)
+        return self._process
+
+    def _log_stderr(self, process: Popen):
+        for line in iter(process.stderr.readline, b""):  # type: ignore
+            _logger.error(
+                "Plugin host: %s" % line.decode("utf-8", "replace").rstrip("\n")
+            )
+
+    def _wait_backoff(self):
+        self._backoff = min(max(self._backoff * 2, 1.0), MAX_HOST_BACKOFF)
+        time.sleep(self._backoff)
+
+
+class PluginLoader:
+    """Loads the plugins listening to `types` and calls them from a fixed pool of threads.
+
+    `on` only queues the event for every plugin that listens to it. A plugin handles one event
+    at a time, so one slow plugin can't take over the whole pool, and its queue is bounded as
+    set by `on_full` (see `Plugin`). A watchdog reports calls that take longer than the
+    plugin's `timeout` and drops the plugin's events until the call returns. A thread can't be
+    stopped safely from the outside, plugins that can hang should be `isolated`.
+
+    Plugins marked `isolated` are not loaded here, their events go to a `PluginHost` process
+    instead, which loads them with `host=True`.
+    """
+
+    def __init__(
+        self, types: List[str], workers: "int | None" = None, host: bool = False
+    ):
+        self._in_host = host
         self.plugins = self._load_plugins(types)
-        self._running: List[Tuple[threading.Thread, float]] = []
+        isolated = self._isolated_types(types)
+        self.host = PluginHost(isolated) if len(isolated) and not host else None
+        self._lock = threading.Lock()
+        self._room = threading.Condition(self._lock)
+        # * thread id: (plugin, started, already reported)
+        self._running: Dict[int, Tuple[Plugin, float, bool]] = {}
+        self._pool = ThreadPoolExecutor(
+            max_workers=workers or _configs.get("plugin_workers", default=4),
+            thread_name_prefix="Plugin",
+        )
+
+        _queue_depth.track(
+            lambda: {(name,): x["queued"] for name, x in self.stats().items()}
+        )
+
+        if len(self.plugins):
+            threading.Thread(
+                target=self._watchdog, name="Watchdog", daemon=True
+            ).start()
 
     def _load(self, plugin: Dict[str, str]) -> ModuleType:
         return importlib.import_module(plugin["script"].replace(".py", ""))
 
-    def _load_plugins(self, types: List[str]) -> List[Tuple[ModuleType, List[str]]]:
+    def _load_plugins(self, types: List[str]) -> List[Plugin]:
         result = []
         for plugin in _plugins:
+            # ? the host only runs isolated plugins and everyone else only the others
+            if plugin.get("isolated", False) != self._in_host:
+                continue
+
             if any(t in plugin["types"] for t in types):
-                result.append((self._load(plugin), plugin["types"]))
+                result.append(Plugin(self._load(plugin), plugin))
 
                 _logger.debug("%s was loaded!" % plugin["script"])
         return result
 
-    def _detach(self, plugin: Tuple[ModuleType, List[str]], *args, **kwargs):
-        detached = threading.Thread(
-            target=plugin[0].main, args=args, kwargs=kwargs
-        )  # maybe use killable threads here.
-        self._running.append((detached, time.time()))
-        detached.start()
+    def _isolated_types(self, types: List[str]) -> List[str]:
+        return sorted(
+            {
+                t
+                for plugin in _plugins
+                if plugin.get("isolated", False)
+                for t in plugin["types"]
+                if t in types
+            }
+        )
 
     def on(self, type_: str, *args, **kwargs):
-        args_ = [type_] + list(args)
+        args_ = (type_,) + args
 
         for plugin in self.plugins:
-            if type_ in plugin[1]:
-                self._detach(plugin, *args_, **kwargs)
+            if type_ in plugin.types:
+                self._enqueue(plugin, args_, kwargs)
+
+        if self.host is not None and type_ in self.host.types:
+            self.host.send(type_, args, kwargs)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Queue depth, counters and latency in seconds of every plugin.
+
+        Returns:
+            Dict[str, Dict[str, Any]]: script: stats
+        """
+        with self._lock:
+            stats = {x.name: x.stats() for x in self.plugins}
+
+        if self.host is not None:
+            stats["_plugin_host.py"] = self.host.stats()
+        return stats
+
+    def is_idle(self) -> bool:
+        """If no plugin has an event waiting or running."""
+        with self._lock:
+            return not any(x.scheduled for x in self.plugins)
 
     def check(self):
-        for thr_obj in self._running.copy():
-            thread, start = thr_obj
+        """Reports calls that ran out of time and logs the stats of every plugin."""
+        self._enforce_timeouts()
 
-            if not thread.is_alive:
-                self._running.remove(thr_obj)
+        for name, stats in self.stats().items():
+            _logger.debug(
+                "%s: %s" % (name, ", ".join("%s=%g" % x for x in stats.items()))
+            )
 
-            elif start > (time.time() + 600):
-                _logger.error(
-                    "Plugin thread %s has been running for more then 10 minutes!"
-                    % thread.name
+    def _enqueue(self, plugin: Plugin, args: tuple, kwargs: Dict[str, Any]):
+        with self._lock:
+            if plugin.stalled:
+                plugin.dropped += 1
+                return
+
+            if len(plugin.events) >= plugin.queue_size and plugin.on_full == "block":
+                self._room.wait_for(
+                    lambda: len(plugin.events) < plugin.queue_size,
+                    plugin.block_timeout,
                 )
-            elif start > (time.time() + 60 * 5):
+
+            if len(plugin.events) >= plugin.queue_size:
+                plugin.dropped += 1
+
+                # ? one line per 100 drops, a spam wave would flood the log otherwise
+                if plugin.dropped % 100 == 1:
+                    _logger.warning(
+                        "%s is too busy, %d event(s) were dropped so far (%s)"
+                        % (plugin.name, plugin.dropped, plugin.on_full)
+                    )
+
+                if plugin.on_full != "drop_oldest":
+                    return
+                plugin.events.popleft()
+
+            plugin.events.append((args, kwargs, time.monotonic()))
+
+            if not plugin.scheduled:
+                plugin.scheduled = True
+                self._pool.submit(self._drain, plugin)
+
+    def _drain(self, plugin: Plugin):
+        """Handles the oldest event of a plugin, then queues the plugin again if it has more.
+
+        Going back to the pool after every event lets the other plugins take their turn.
+        """
+        with self._lock:
+            args, kwargs, queued = plugin.events.popleft()
+            self._room.notify_all()
+
+            started = time.monotonic()
+            plugin.max_wait = max(plugin.max_wait, started - queued)
+            self._running[threading.get_ident()] = (plugin, started, False)
+
+        try:
+            plugin.module.main(*args, **kwargs)
+        except BaseException as e:
+            plugin.failed += 1
+            _logger.error("%s failed: %s : %s" % (plugin.name, type(e).__name__, e))
+        finally:
+            self._finish(plugin, started)
+
+    def _finish(self, plugin: Plugin, started: float):
+        with self._lock:
+            self._running.pop(threading.get_ident(), None)
+
+            took = time.monotonic() - started
+            if plugin.stalled:
+                plugin.stalled = False
                 _logger.warning(
-                    "Plugin thread %s has been running for more then 5 minutes!"
-                    % thread.name
+                    "%s returned after %ds, handling its events again"
+                    % (plugin.name, took)
+                )
+
+            plugin.processed += 1
+            plugin.latency = (
+                took if plugin.processed == 1 else 0.8 * plugin.latency + 0.2 * took
+            )
+            plugin.max_latency = max(plugin.max_latency, took)
+
+            if len(plugin.events):
+                self._pool.submit(self._drain, plugin)
+            else:
+                plugin.scheduled = False
+
+    def _watchdog(self):
+        while 1:
+            time.sleep(WATCHDOG_INTERVAL)
+            self._enforce_timeouts()
+
+    def _enforce_timeouts(self):
+        """Stops feeding plugins whose running call took longer than their `timeout`.
+
+        The call keeps its worker until it returns, its waiting and new events are dropped
+        meanwhile so they don't pile up behind it.
+        """
+        now = time.monotonic()
+
+        with self._lock:
+            for tid, (plugin, started, reported) in list(self._running.items()):
+                if reported or now - started < plugin.timeout:
+                    continue
+
+                _logger.error(
+                    "%s has been running for more than %ds, dropping its events until it"
+                    " returns (mark it isolated to run it in the plugin host)"
+                    % (plugin.name, plugin.timeout)
                 )
+                self._running[tid] = (plugin, started, True)
+                plugin.timed_out += 1
+                plugin.stalled = True
+                plugin.dropped += len(plugin.events)
+                plugin.events.clear()
+                self._room.notify_all()
@@ -2,19 +2,55 @@
 # ======== IMPORTS ======== #
 #############################
 
+import atexit
 import inspect
 import json
 import logging
+import logging.handlers
 import os
+import sqlite3
+import struct
 import sys
+import threading
 import time
+import weakref
+import zlib
+from collections import OrderedDict, deque
 from dataclasses import dataclass
+from enum import IntEnum
 from pathlib import Path as p  # normalize paths between every OS
-from typing import Any, Dict, List, Tuple, Type
+from queue import Full, Queue
+from typing import (
+    Any,
+    Callable,
+    Deque,
+    Dict,
+    FrozenSet,
+    Hashable,
+    Iterable,
+    List,
+    Set,
+    Tuple,
+    Type,
+)
 
 import praw
 import prawcore
 
+from _metrics import metrics
+
+# ? fcntl is not available on windows, the rate limit is then only shared between threads
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # type: ignore
+
+# ? asyncprawcore is only installed for the optional asyncio runtime (async_engine.py)
+try:
+    import asyncprawcore
+except ImportError:
+    asyncprawcore = None  # type: ignore
+
 ############################
 # ======== PATHS ========= #
 ############################
@@ -29,6 +65,10 @@ _config_path = str(ABSDIR.joinpath("../config/config.json"))
 _blacklist_path = str(ABSDIR.joinpath("../data/blacklist.json"))
 _mod_cache_path = str(ABSDIR.joinpath("../cache/moderating_subreddits.cache.json"))
 _banned_cache_path = str(ABSDIR.joinpath("../cache/banned_users.cache.json"))
+_banned_db_path = str(ABSDIR.joinpath("../cache/banned_users.cache.sqlite3"))
+_ratelimit_state_path = str(ABSDIR.joinpath("../cache/ratelimit.state"))
+_worker_slices_path = str(ABSDIR.joinpath("../cache/workers.slices.json"))
+_worker_health_dir = str(ABSDIR.joinpath("../cache/workers"))
 
 with open(_secrets_path, "rt", encoding="utf-8") as f:
     _secrets = json.load(f)
@@ -46,89 +86,369 @@ class Secrets:
     password: str = _secrets["password"]
     user_agent: str = _secrets["user_agent"]
     username: str = _secrets["username"]
+    # ? optional, only set to point the bot at another api (e.g. tools/fake_reddit.py)
+    oauth_url: str = _secrets.get("oauth_url", "https://oauth.reddit.com")
+    reddit_url: str = _secrets.get("reddit_url", "https://www.reddit.com")
 
 
 @dataclass
 class PrawErrors:
-    Critical: Tuple[Type[BaseException], ...] = (
-        prawcore.exceptions.Forbidden,
-        prawcore.exceptions.NotFound,
+    Critical: Tuple[Type[BaseException], ...] = tuple(
+        getattr(module.exceptions, name)
+        for module in (prawcore, asyncprawcore)
+        if module is not None
+        for name in ("Forbidden", "NotFound")
     )
-    NonCritical: Tuple[Type[BaseException], ...] = (
-        prawcore.exceptions.ServerError,
-        prawcore.exceptions.RequestException,
+    NonCritical: Tuple[Type[BaseException], ...] = tuple(
+        getattr(module.exceptions, name)
+        for module in (prawcore, asyncprawcore)
+        if module is not None
+        for name in ("ServerError", "RequestException")
     )
     SysExit: Tuple[Type[BaseException], ...] = (BaseException,)
 
 
+_MISSING = object()
+
+
+class _FrozenDict(dict):
+    """A dict that refuses to be modified, used for shared config snapshots.
+
+    It stays a real `dict` subclass so `json.dumps` and `**kwargs` unpacking keep working.
+    """
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("config snapshots are read-only, copy them with dict() first")
+
+    __setitem__ = __delitem__ = __ior__ = _readonly  # type: ignore
+    clear = pop = popitem = setdefault = update = _readonly  # type: ignore
+
+    def __reduce__(self):
+        return (dict, (dict(self),))
+
+
+def _freeze(obj: Any) -> Any:
+    """Recursively turn parsed json into read-only containers.
+
+    Args:
+        obj (Any): Parsed json.
+
+    Returns:
+        Any: The same data with dicts as `_FrozenDict` and lists as tuples.
+    """
+    if isinstance(obj, dict):
+        return _FrozenDict((k, _freeze(v)) for k, v in obj.items())
+    if isinstance(obj, list):
+        return tuple(_freeze(x) for x in obj)
+    return obj
+
+
+class _WatchedFile:
+    """Parsed contents of a json file that are only reloaded when the file changes on disk.
+
+    The file is `stat`ed at most once every `check_interval` seconds, between checks a lookup
+    is a single attribute read. A reload is parsed completely before it replaces the old
+    snapshot so readers never see a half applied file.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        parse: Callable[[Any], Any] = _freeze,
+        check_interval: float = 1.0,
+    ):
+        self.path = path
+        self.check_interval = check_interval
+        self._parse = parse
+        self._lock = threading.Lock()
+        self._stat_key: "Tuple[int, int, int] | None" = None
+        self._next_check = 0.0
+        self._snapshot: "Tuple[int, Any] | None" = None  # (version, value)
+
+    @property
+    def version(self) -> int:
+        """int: Incremented every time the file is reloaded."""
+        return self.snapshot()[0]
+
+    def get(self) -> Any:
+        """Get the parsed contents of the file.
+
+        Returns:
+            Any: The output of `parse` for the current contents of the file.
+        """
+        return self.snapshot()[1]
+
+    def snapshot(self) -> Tuple[int, Any]:
+        """Get the current version and parsed contents together.
+
+        Returns:
+            Tuple[int, Any]: (version, value)
+        """
+        if self._snapshot is None or time.monotonic() >= self._next_check:
+            self._refresh()
+        return self._snapshot  # type: ignore
+
+    def _refresh(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            if self._snapshot is not None and now < self._next_check:
+                return  # ? another thread refreshed while we were waiting for the lock
+
+            try:
+                stat = os.stat(self.path)
+                key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+                if key != self._stat_key:
+                    with open(self.path, "rt", encoding="utf-8") as f:
+                        value = self._parse(json.load(f))
+
+                    version = 0 if self._snapshot is None else self._snapshot[0] + 1
+                    self._snapshot = (version, value)
+                    self._stat_key = key
+            except (OSError, ValueError) as e:
+                if self._snapshot is None:
+                    raise
+                # ! keep serving the last good snapshot, the file is probably mid-write
+                _logger.error(
+                    "Reloading %s failed, keeping old values: %s" % (self.path, e)
+                )
+
+            self._next_check = now + self.check_interval
+
+
 class Configs:
-    def __init__(self, config_path: str = _config_path):
-        self.config_path = config_path
+    """Read-only access to a json config file.
+
+    There is one shared instance per config file per process, the file is parsed once and
+    only parsed again when it changes on disk.
+    """
+
+    _instances: Dict[str, "Configs"] = {}
+    _instances_lock = threading.Lock()
+
+    def __new__(cls, config_path: str = _config_path):
+        key = os.path.realpath(config_path)
+
+        with cls._instances_lock:
+            instance = cls._instances.get(key)
+            if instance is None:
+                instance = super().__new__(cls)
+                instance.config_path = config_path
+                instance._file = _WatchedFile(config_path)
+                cls._instances[key] = instance
+
+        return instance
 
-    def get(self, *keys) -> Any:
-        with open(self.config_path, "rt", encoding="utf-8") as f:
-            configs: Dict[str, Any] = json.load(f)
+    @property
+    def version(self) -> int:
+        """int: Incremented every time the config file is reloaded."""
+        return self._file.version
+
+    def get(self, *keys, default: Any = _MISSING) -> Any:
+        """Get a value from the config file.
+
+        Dicts and lists in the result are read-only snapshots (`dict` and `tuple`), copy them
+        before changing anything.
+
+        Args:
+            *keys (str | int): Path to the value.
+            default (Any, optional): Returned without logging an error if the path does not exist.
+
+        Returns:
+            Any: The value, `default` or `None` if the path does not exist.
+        """
+        configs = self._file.get()
 
         try:
             for key in keys:
                 configs = configs[key]
-        except (KeyError, IndexError) as e:
-            _logger.error("%s is not a valid path" % keys)
+        except (KeyError, IndexError, TypeError) as e:
+            if default is not _MISSING:
+                return default
+            _logger.error("%s is not a valid path" % (keys,))
             return None
         return configs
 
 
 class Banned:
-    def __init__(self, banned_cache_path: str = _banned_cache_path):
-        self.banned_cache_path = banned_cache_path
-
-    def get(self, user: str):
-        with open(self.banned_cache_path, "rt", encoding="utf-8") as f:
-            banned: Dict[str, List[str]] = json.load(f)
-
-        for key, value in banned.items():
-            if key.lower() == user.lower():
-                return value
-
-    def is_in(self, user: str, subreddit: str):
+    """Persistent record of the subreddits every user was already banned from.
+
+    Backed by SQLite in WAL mode so threads and processes can read and write it at the same
+    time, every thread gets its own connection. Names are stored in lowercase.
+    """
+
+    def __init__(
+        self,
+        banned_db_path: str = _banned_db_path,
+        legacy_cache_path: str = _banned_cache_path,
+    ):
+        self.banned_db_path = banned_db_path
+        self._local = threading.local()
+        self._migrate(legacy_cache_path)
+
+    def _connection(self) -> sqlite3.Connection:
+        connection: "sqlite3.Connection | None" = getattr(
+            self._local, "connection", None
+        )
+        if connection is None:
+            # ? isolation_level=None disables implicit transactions, writes use BEGIN IMMEDIATE
+            connection = sqlite3.connect(
+                self.banned_db_path, timeout=30, isolation_level=None
+            )
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS banned ("
+                "user TEXT NOT NULL, subreddit TEXT NOT NULL, "
+                "PRIMARY KEY (user, subreddit)) WITHOUT ROWID"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)"
+            )
+            self._local.connection = connection
+        return connection
+
+    def _migrate(self, legacy_cache_path: str) -> None:
+        """Imports the old `banned_users.cache.json` once and renames it to `*.migrated`.
+
+        Args:
+            legacy_cache_path (str): Path of the old json cache.
+        """
+        if not os.path.exists(legacy_cache_path):
+            return
+
+        with open(legacy_cache_path, "rt", encoding="utf-8") as f:
+            legacy: Dict[str, List[str]] = json.load(f)
+
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            # ? another process may have migrated while we were reading the file
+            migrated = connection.execute(
+                "SELECT 1 FROM meta WHERE key = 'json_migrated'"
+            ).fetchone()
+
+            if migrated is None:
+                connection.executemany(
+                    "INSERT OR IGNORE INTO banned (user, subreddit) VALUES (?, ?)",
+                    (
+                        (user.lower(), sub.lower())
+                        for user, subs in legacy.items()
+                        for sub in subs
+                    ),
+                )
+                connection.execute(
+                    "INSERT INTO meta (key, value) VALUES ('json_migrated', ?)",
+                    (str(time.time()),),
+                )
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
 
-        banned_in = self.get(user)
+        try:
+            os.replace(legacy_cache_path, legacy_cache_path + ".migrated")
+        except FileNotFoundError:
+            pass
 
-        if banned_in is None:
-            return False
+        _logger.info("Migrated %d users from %s" % (len(legacy), legacy_cache_path))
 
-        if subreddit.lower() in banned_in:
-            return True
+    def get(self, user: str) -> "List[str] | None":
+        """Get every subreddit a user was banned from.
 
-        return False
+        Args:
+            user (str): Name of the user, case insensitive.
 
-    def add(self, user: str, new_subs: List[str]):
-        # sourcery skip: use-dict-items
-        with open(self.banned_cache_path, "rt", encoding="utf-8") as f:
-            banned: Dict[str, List[str]] = json.load(f)
+        Returns:
+            List[str] | None: The subreddits in lowercase, `None` if the user was never banned.
+        """
+        rows = (
+            self._connection()
+            .execute("SELECT subreddit FROM banned WHERE user = ?", (user.lower(),))
+            .fetchall()
+        )
+        return [row[0] for row in rows] if rows else None
+
+    def is_in(self, user: str, subreddit: str) -> bool:
+        """Check if a user was already banned from a subreddit.
+
+        Args:
+            user (str): Name of the user, case insensitive.
+            subreddit (str): Name of the subreddit, case insensitive.
+
+        Returns:
+            bool
+        """
+        return (
+            self._connection()
+            .execute(
+                "SELECT 1 FROM banned WHERE user = ? AND subreddit = ?",
+                (user.lower(), subreddit.lower()),
+            )
+            .fetchone()
+            is not None
+        )
 
-        for key in banned:
-            if key.lower() == user.lower():
+    def add(self, user: str, new_subs: List[str]) -> None:
+        """Record that a user was banned from some subreddits, in a single transaction.
 
-                banned[key] += new_subs
-                banned[key] = list(set(banned[key]))
-                break
-        else:
-            banned[user.lower()] = [x.lower() for x in new_subs]
+        Args:
+            user (str): Name of the user, case insensitive.
+            new_subs (List[str]): Subreddits the user was banned from.
+        """
+        if not len(new_subs):
+            return
 
-        with open(self.banned_cache_path, "wt", encoding="utf-8") as f:
-            json.dump(banned, f)
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.executemany(
+                "INSERT OR IGNORE INTO banned (user, subreddit) VALUES (?, ?)",
+                ((user.lower(), sub.lower()) for sub in new_subs),
+            )
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
 
 
 class Blacklist:
+    """Lowercase index of the blacklisted subreddits, rebuilt only when the file changes."""
+
     def __init__(self, blacklist_path: str = _blacklist_path):
         self.blacklist_path = blacklist_path
+        self._file = _WatchedFile(
+            blacklist_path, lambda subs: frozenset(str(x).lower() for x in subs)
+        )
+
+    @property
+    def index(self) -> FrozenSet[str]:
+        """FrozenSet[str]: Every blacklisted subreddit in lowercase."""
+        return self._file.get()
+
+    @property
+    def version(self) -> int:
+        """int: Incremented every time the blacklist file is reloaded."""
+        return self._file.version
+
+    def contains(self, name: str) -> bool:
+        """Check if a subreddit is blacklisted.
+
+        Args:
+            name (str): Name of the subreddit, case insensitive.
+
+        Returns:
+            bool
+        """
+        return name.lower() in self._file.get()
 
     def get(self) -> List[str]:
-        with open(self.blacklist_path, "rt", encoding="utf-8") as f:
-            blacklist: List[str] = json.load(f)
+        """Get a copy of the blacklist, prefer `contains` for lookups.
 
-        return [sub.lower() for sub in blacklist]
+        Returns:
+            List[str]: Every blacklisted subreddit in lowercase.
+        """
+        return list(self._file.get())
 
 
 class Moderating:
@@ -143,8 +463,8 @@ class Moderating:
             x.lower() for x in subs if str(x).lower() != "u_" + Secrets.username.lower()
         ]
         if not len(result):
-            with gen_reddit_instance() as r:  # it's ok to create a reddit instance here because this should only be called when the cache is empty
-                self.update(r)
+            # ? only happens when the cache is empty
+            self.update(thread_reddit())
             return (
                 self.get()
             )  # will create a recursion loop if the bot does not moderate any subreddits
@@ -154,10 +474,631 @@ class Moderating:
 
         modded_subs = [str(x) for x in reddit.user.moderator_subreddits(limit=None)]  # type: ignore
 
+        self.save(modded_subs)
+
+        return
+
+    def save(self, modded_subs: List[str]) -> None:
+        """Overwrite the cache with a fresh list of moderated subreddits.
+
+        Args:
+            modded_subs (List[str])
+        """
         with open(self.mod_cache_path, "wt", encoding="utf-8") as f:
             json.dump(modded_subs, f, indent=4)
 
-        return
+
+class WorkerSlices:
+    """Splits the moderated subs between the submission worker processes started by main.py.
+
+    Every sub falls in one of `BUCKETS` buckets by a stable hash of its name. main.py writes
+    which worker owns which bucket with `assign`, the workers read it with `owned` and pick up
+    changes on their own.
+    """
+
+    BUCKETS = 64
+
+    def __init__(self, slices_path: str = _worker_slices_path):
+        self.slices_path = slices_path
+        self._file = _WatchedFile(slices_path)
+
+    @property
+    def version(self) -> int:
+        """int: Changes when main.py assigns the buckets again, `-1` before the first time."""
+        try:
+            return self._file.version
+        except (OSError, ValueError):
+            return -1
+
+    @classmethod
+    def bucket(cls, sub: str) -> int:
+        return zlib.crc32(sub.lower().encode("utf-8")) % cls.BUCKETS
+
+    def owners(self) -> Dict[int, int]:
+        """Which worker owns every bucket.
+
+        Returns:
+            Dict[int, int]: bucket: worker, empty if main.py did not assign the buckets yet.
+        """
+        try:
+            owners = self._file.get()["owners"]
+        except (OSError, ValueError, KeyError):
+            return {}
+        return {int(bucket): worker for bucket, worker in owners.items()}
+
+    def owned(self, worker: int, subs: Iterable[str]) -> List[str]:
+        """The given subs that belong to a worker.
+
+        Args:
+            worker (int)
+            subs (Iterable[str])
+
+        Returns:
+            List[str]
+        """
+        owners = self.owners()
+        return [sub for sub in subs if owners.get(self.bucket(sub)) == worker]
+
+    def assign(self, workers: List[int]) -> Dict[int, int]:
+        """Give the buckets of workers that are gone to the others and even out the rest.
+
+        Buckets only move when they have to, a worker keeps its subs as long as it lives.
+
+        Args:
+            workers (List[int]): The workers that are alive.
+
+        Returns:
+            Dict[int, int]: bucket: worker
+        """
+        owners = self.owners()
+        counts = {worker: 0 for worker in workers}
+
+        for bucket, worker in owners.items():
+            if worker in counts:
+                counts[worker] += 1
+
+        for bucket in range(self.BUCKETS):
+            if owners.get(bucket) not in counts and len(counts):
+                worker = min(counts, key=lambda x: counts[x])
+                owners[bucket] = worker
+                counts[worker] += 1
+
+        while len(counts) and max(counts.values()) - min(counts.values()) > 1:
+            busiest = max(counts, key=lambda x: counts[x])
+            idlest = min(counts, key=lambda x: counts[x])
+            bucket = next(x for x, worker in owners.items() if worker == busiest)
+            owners[bucket] = idlest
+            counts[busiest] -= 1
+            counts[idlest] += 1
+
+        _write_json_atomic(self.slices_path, {"owners": owners})
+        return owners
+
+
+class WorkerHealth:
+    """Health and counters every submission worker reports to main.py through a small file."""
+
+    def __init__(self, health_dir: str = _worker_health_dir):
+        self.health_dir = health_dir
+        os.makedirs(health_dir, exist_ok=True)
+
+    def report(self, worker: int, **fields: Any) -> None:
+        """Replace a worker's report, the time it was written is added as `time`.
+
+        Args:
+            worker (int)
+            **fields: Anything json can hold.
+        """
+        fields.update(worker=worker, pid=os.getpid(), time=time.time())
+        _write_json_atomic(self._path(worker), fields)
+
+    def read(self, worker: int) -> "Dict[str, Any] | None":
+        try:
+            with open(self._path(worker), "rt", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def clear(self, worker: int) -> None:
+        try:
+            os.remove(self._path(worker))
+        except FileNotFoundError:
+            pass
+
+    def _path(self, worker: int) -> str:
+        return os.path.join(self.health_dir, "%d.health.json" % worker)
+
+
+class LRUCache:
+    """Thread safe mapping that forgets the least recently used keys once `maxsize` is reached."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Get a value and mark it as recently used.
+
+        Args:
+            key (Hashable)
+            default (Any, optional): Returned when the key is missing. Defaults to None.
+
+        Returns:
+            Any
+        """
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+            except KeyError:
+                return default
+            return self._data[key]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        """Set a value, evicting the least recently used key if the cache is full.
+
+        Args:
+            key (Hashable)
+            value (Any)
+        """
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+
+class SeenSet:
+    """Thread safe set that only remembers the last `maxsize` keys added to it."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._ring: Deque[Hashable] = deque()
+        self._keys: Set[Hashable] = set()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._keys
+
+    def add(self, key: Hashable) -> bool:
+        """Remember a key, forgetting the oldest one if the set is full.
+
+        Args:
+            key (Hashable)
+
+        Returns:
+            bool: `False` if the key was already remembered.
+        """
+        with self._lock:
+            if key in self._keys:
+                return False
+
+            if len(self._ring) >= self.maxsize:
+                self._keys.discard(self._ring.popleft())
+
+            self._ring.append(key)
+            self._keys.add(key)
+            return True
+
+
+class TokenBucket:
+    """Thread safe token bucket, `acquire` blocks until a token is available."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate  # tokens per second
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """Take a token, waiting for one if the bucket is empty.
+
+        Returns:
+            float: Seconds spent waiting.
+        """
+        waited = 0.0
+        while (wait := self.try_acquire()) > 0:
+            time.sleep(wait)
+            waited += wait
+        return waited
+
+    def try_acquire(self) -> float:
+        """Take a token if one is available, without waiting.
+
+        Returns:
+            float: `0` if a token was taken, otherwise how long until one is available.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+
+            return (1 - self._tokens) / self.rate
+
+
+class Priority(IntEnum):
+    """Who gets the rate limit budget first, lower goes first."""
+
+    REMOVAL = 0
+    STREAM = 1
+    BAN = 2
+    PLUGIN = 3
+
+
+class RateGovernor:
+    """Token bucket for the account's OAuth budget, shared by every thread and every process.
+
+    The bucket lives in a small state file locked with `flock`, so `inbox.py`, `submissions.py`
+    and their plugins all spend from the same budget. Every time a reddit instance sees new
+    `X-Ratelimit-*` headers the bucket is clamped to what reddit says is left and the refill rate
+    is set to spread the rest evenly until the window resets.
+
+    Lower priorities leave a reserve in the bucket (a fraction of `burst`) that only higher
+    priorities can spend, so removals are never stuck behind plugins.
+    """
+
+    RESERVE = {
+        Priority.REMOVAL: 0.0,
+        Priority.STREAM: 0.1,
+        Priority.BAN: 0.25,
+        Priority.PLUGIN: 0.4,
+    }
+
+    # tokens, updated at, refill rate, window reset at
+    _STATE = struct.Struct("<dddd")
+
+    def __init__(
+        self,
+        state_path: str,
+        burst: float = 60,
+        requests_per_window: float = 600,
+        window: float = 600,
+    ):
+        self.state_path = state_path
+        self.burst = burst
+        self.default_rate = requests_per_window / window
+        self.window = window
+        self._lock = threading.Lock()
+        self._memory_state: "Tuple[float, float, float, float] | None" = None
+
+    def acquire(self, priority: Priority = Priority.PLUGIN) -> float:
+        """Take one request from the budget, waiting until the priority's share allows it.
+
+        Args:
+            priority (Priority, optional): Defaults to Priority.PLUGIN.
+
+        Returns:
+            float: Seconds spent waiting.
+        """
+        waited = 0.0
+        while (wait := self.try_acquire(priority)) > 0:
+            time.sleep(wait)
+            waited += wait
+        return waited
+
+    def try_acquire(self, priority: Priority = Priority.PLUGIN) -> float:
+        """Take one request from the budget if the priority's share allows it, without waiting.
+
+        Args:
+            priority (Priority, optional): Defaults to Priority.PLUGIN.
+
+        Returns:
+            float: `0` if the request was granted, otherwise how long to wait before trying again.
+        """
+        reserve = self.burst * self.RESERVE[priority]
+
+        with self._locked_state() as state:
+            tokens, _, rate, reset_at = state.values
+            now = time.time()
+
+            if tokens >= reserve + 1:
+                state.values = (tokens - 1, now, rate, reset_at)
+                return 0
+
+            if rate > 0:
+                wait = (reserve + 1 - tokens) / rate
+            else:
+                wait = reset_at - now
+
+        # ? check again at least every 30s, another process may have seen fresher headers
+        return min(max(wait, 0.01), 30)
+
+    def observe(self, remaining: float, reset_timestamp: float) -> None:
+        """Feed fresh `X-Ratelimit-*` values into the bucket.
+
+        Args:
+            remaining (float): Requests left in the current window.
+            reset_timestamp (float): Unix time when the window resets.
+        """
+        with self._locked_state() as state:
+            tokens, updated, rate, reset_at = state.values
+            time_left = reset_timestamp - time.time()
+
+            if time_left <= 0:
+                return  # ! stale headers from a window that is already over
+
+            time_left = max(time_left, 1)
+            state.values = (
+                min(tokens, remaining),
+                updated,
+                remaining / time_left,
+                reset_timestamp,
+            )
+
+    def _locked_state(self) -> "_GovernorState":
+        return _GovernorState(self)
+
+    def _refill(
+        self, values: "Tuple[float, float, float, float] | None"
+    ) -> Tuple[float, float, float, float]:
+        now = time.time()
+
+        if values is None:
+            return (self.burst, now, self.default_rate, now + self.window)
+
+        tokens, updated, rate, reset_at = values
+
+        if now >= reset_at:
+            # * new window without fresh headers yet, fall back to the steady rate
+            rate = self.default_rate
+            reset_at = now + self.window
+
+        tokens = min(self.burst, tokens + max(now - updated, 0) * rate)
+        return (tokens, now, rate, reset_at)
+
+
+class _GovernorState:
+    """Context manager that holds the governor's locks and loads/saves its state."""
+
+    def __init__(self, governor: RateGovernor):
+        self.governor = governor
+        self.values: Tuple[float, float, float, float]
+        self._file = None
+
+    def __enter__(self) -> "_GovernorState":
+        governor = self.governor
+        governor._lock.acquire()
+
+        try:
+            if fcntl is None:
+                raw = governor._memory_state
+            else:
+                self._file = open(governor.state_path, "a+b")
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+                self._file.seek(0)
+                data = self._file.read(governor._STATE.size)
+                raw = (
+                    governor._STATE.unpack(data)
+                    if len(data) == governor._STATE.size
+                    else None
+                )
+            self.values = governor._refill(raw)  # type: ignore
+        except BaseException:
+            self._release()
+            raise
+
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        try:
+            if exc_type is None:
+                if self._file is None:
+                    self.governor._memory_state = self.values
+                else:
+                    # ? "a+b" always appends, truncate first so the state stays at offset 0
+                    self._file.truncate(0)
+                    self._file.write(self.governor._STATE.pack(*self.values))
+                    self._file.flush()
+        finally:
+            self._release()
+
+    def _release(self) -> None:
+        if self._file is not None:
+            self._file.close()  # * closing the file also drops the flock
+            self._file = None
+        self.governor._lock.release()
+
+
+@dataclass(frozen=True)
+class CrosspostParent:
+    fullname: str
+    subreddit: str
+    author: str
+
+    @property
+    def id(self) -> str:
+        """str: The parent's id without the `t3_` prefix."""
+        return self.fullname.split("_", 1)[-1]
+
+
+class ParentResolver:
+    """Finds the subreddit and author of crosspost parents while spending as few requests as possible.
+
+    The `crosspost_parent_list` sent along with the listing is used first, then a LRU of parents
+    that were already resolved and only what is still missing is fetched from `/api/info`, up to
+    100 parents per request.
+    """
+
+    def __init__(self, maxsize: int = 10_000):
+        self._cache = LRUCache(maxsize)
+
+    def from_listing(
+        self, submission: "praw.models.Submission"
+    ) -> "CrosspostParent | None":
+        """Resolve a parent without making any request.
+
+        Args:
+            submission (praw.models.Submission): A crosspost that came from a listing.
+
+        Returns:
+            CrosspostParent | None: `None` if the parent has to be fetched.
+        """
+        fullname: str = submission.crosspost_parent
+
+        for data in listed_attr(submission, "crosspost_parent_list") or ():
+            if data.get("name") == fullname:
+                parent = CrosspostParent(
+                    fullname, str(data.get("subreddit")), str(data.get("author"))
+                )
+                self._cache.put(fullname, parent)
+                return parent
+
+        return self._cache.get(fullname)
+
+    def resolve(
+        self,
+        reddit: praw.reddit.Reddit,
+        submissions: Iterable["praw.models.Submission"],
+    ) -> Dict[str, CrosspostParent]:
+        """Resolve the parents of many crossposts, fetching the missing ones in batches.
+
+        Args:
+            reddit (praw.reddit.Reddit): Instance used for `/api/info`.
+            submissions (Iterable[praw.models.Submission]): Crossposts.
+
+        Returns:
+            Dict[str, CrosspostParent]: Parents by fullname, parents that no longer exist are left out.
+        """
+        result, missing = self.split(submissions)
+
+        for idx in range(0, len(missing), 100):
+            control_ratelimit(reddit, Priority.STREAM)
+
+            # https://praw.readthedocs.io/en/stable/code_overview/reddit_instance.html#praw.Reddit.info
+            for fetched in reddit.info(fullnames=missing[idx : idx + 100]):
+                parent = self.remember(fetched)
+                result[parent.fullname] = parent
+
+        return result
+
+    def split(
+        self, submissions: Iterable["praw.models.Submission"]
+    ) -> Tuple[Dict[str, CrosspostParent], List[str]]:
+        """Resolve what can be resolved without a request.
+
+        Args:
+            submissions (Iterable[praw.models.Submission]): Crossposts.
+
+        Returns:
+            Tuple[Dict[str, CrosspostParent], List[str]]: Parents by fullname, fullnames of the parents that have to be fetched.
+        """
+        result: Dict[str, CrosspostParent] = {}
+        missing: List[str] = []
+
+        for submission in submissions:
+            parent = self.from_listing(submission)
+            if parent is not None:
+                result[parent.fullname] = parent
+            elif submission.crosspost_parent not in missing:
+                missing.append(submission.crosspost_parent)
+
+        return result, missing
+
+    def remember(self, fetched: Any) -> CrosspostParent:
+        """Cache a parent fetched from `/api/info`.
+
+        Args:
+            fetched (Any): The fetched submission.
+
+        Returns:
+            CrosspostParent
+        """
+        parent = CrosspostParent(
+            fetched.fullname, str(fetched.subreddit), str(fetched.author)
+        )
+        self._cache.put(parent.fullname, parent)
+        return parent
+
+
+class RedditProvider:
+    """Builds `praw.Reddit` instances that share one OAuth token and one connection pool per account.
+
+    praw is not thread safe, so `get` gives every thread its own instance. All instances of an
+    account still send their requests through the same requestor, one kept alive
+    `requests.Session`, and use the same token, which only one thread refreshes when it expires.
+    They also share one prawcore rate limiter, so every instance reads the account's latest
+    `X-Ratelimit-*` headers, and only the governor waits (see `bypass_rate_limiter`).
+    """
+
+    def __init__(self):
+        # * account: (requestor, authorizer, rate limiter)
+        self._shared: Dict[Tuple[Any, ...], Tuple[Any, Any, Any]] = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def get(self, secrets: Type[Secrets] = Secrets) -> praw.reddit.Reddit:
+        """The calling thread's own instance for an account, created on first use.
+
+        Args:
+            secrets (Type[Secrets], optional): Defaults to Secrets.
+
+        Returns:
+            praw.reddit.Reddit
+        """
+        instances = getattr(self._local, "instances", None)
+        if instances is None:
+            instances = self._local.instances = {}
+
+        key = _account_key(secrets)
+        if key not in instances:
+            instances[key] = self.create(secrets)
+        return instances[key]
+
+    def create(self, secrets: Type[Secrets] = Secrets) -> praw.reddit.Reddit:
+        """A new instance that shares the token and connections of the account's other instances.
+
+        Args:
+            secrets (Type[Secrets], optional): Defaults to Secrets.
+
+        Returns:
+            praw.reddit.Reddit
+        """
+        key = _account_key(secrets)
+
+        with self._lock:
+            shared = self._shared.get(key)
+
+            if shared is None:
+                reddit = praw.Reddit(**_as_dict(secrets))
+                core = getattr(reddit, "_core", None)
+
+                # ? praw keeps these private, without them every instance authorizes on its own
+                if core is not None and hasattr(core, "_authorizer"):
+                    authorizer = core._authorizer
+                    _share_refresh(authorizer)
+                    self._shared[key] = (
+                        authorizer._authenticator._requestor,
+                        authorizer,
+                        core._rate_limiter,
+                    )
+            else:
+                requestor, authorizer, rate_limiter = shared
+                reddit = praw.Reddit(
+                    requestor_class=lambda *args, **kwargs: requestor,
+                    **_as_dict(secrets),
+                )
+                for name in ("_core", "_authorized_core"):
+                    core = getattr(reddit, name, None)
+                    if core is not None:
+                        core._authorizer = authorizer
+                        core._rate_limiter = rate_limiter
+
+        bypass_rate_limiter(reddit)
+        reddit._validate_on_submit = True
+        return reddit
 
 
 #############################
@@ -165,12 +1106,23 @@ class Moderating:
 #############################
 
 
+LOG_QUEUE_SIZE = 10000  # * records waiting to be written, more are dropped
+MAX_LOG_SIZE = 10  # * default size of a log file in MB before it is rotated
+LOG_BACKUPS = 5
+
 _loggers: Dict[str, logging.Logger] = {}
+_log_routes: Dict[str, List[logging.Handler]] = {}  # logger name => handlers
+_log_files: Dict[str, logging.Handler] = {}  # real path => handler
+_log_queue: "Queue[logging.LogRecord | None]" = Queue(LOG_QUEUE_SIZE)
+_log_lock = threading.Lock()
+_log_listener: "logging.handlers.QueueListener | None" = None
+_stdout_handler: "logging.Handler | None" = None
 
 logging.getLogger("requests").setLevel(logging.WARNING)
 logging.getLogger("prawcore").setLevel(logging.WARNING)
 logging.getLogger("urllib3.connectionpool").setLevel(logging.WARNING)
 
+
 # https://stackoverflow.com/a/56944256 <= (@guiloj) credit is important kids
 class _CustomFormatter(logging.Formatter):
     def __init__(self, file: bool = False):
@@ -191,39 +1143,169 @@ class _CustomFormatter(logging.Formatter):
             logging.CRITICAL: bold_red + format_ + reset,
             "NORMAL": format_,
         }
+        # * built once, not for every record
+        self._formatters = {
+            level: logging.Formatter(fmt) for level, fmt in self.FORMATS.items()
+        }
 
     def format(self, record):
-        log_fmt = (
-            self.FORMATS.get(record.levelno)
+        formatter = (
+            self._formatters.get(record.levelno, self._formatters["NORMAL"])
             if self.OS != "nt"
-            else self.FORMATS.get("NORMAL")
+            else self._formatters["NORMAL"]
         )
-        formatter = logging.Formatter(log_fmt)
         return formatter.format(record)
 
 
+class _QueueHandler(logging.handlers.QueueHandler):
+    """Hands records over to the listener thread, drops them instead of blocking when it lags."""
+
+    def __init__(self, queue: "Queue[logging.LogRecord | None]"):
+        super().__init__(queue)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except Full:
+            self.dropped += 1
+
+
+class _QueueListener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self):
+        # ? only used at exit, waits for the listener to make room instead of failing
+        self.queue.put(self._sentinel)
+
+
+class _RotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """A `RotatingFileHandler` that follows rotations done by other processes.
+
+    Several scripts write to the same log file, when one of them rotates it the others
+    reopen the new file instead of writing to (and rotating again) the renamed one.
+    """
+
+    def shouldRollover(self, record: logging.LogRecord) -> int:
+        if self.stream is not None:
+            try:
+                replaced = not os.path.samestat(
+                    os.stat(self.baseFilename), os.fstat(self.stream.fileno())
+                )
+            except OSError:
+                replaced = True
+
+            if replaced:
+                self.stream.close()
+                self.stream = self._open()  # type: ignore
+        return super().shouldRollover(record)
+
+
+class _LogDispatcher(logging.Handler):
+    """Runs in the listener thread, sends every record to the handlers of its logger."""
+
+    def handle(self, record: logging.LogRecord) -> bool:
+        handlers = _log_routes.get(record.name, ())
+        dropped = _queue_handler.dropped
+
+        if dropped:
+            _queue_handler.dropped -= dropped
+            warning = logging.makeLogRecord(
+                {
+                    "name": record.name,
+                    "levelno": logging.WARNING,
+                    "levelname": "WARNING",
+                    "msg": "%d log record(s) were dropped, the log queue was full"
+                    % dropped,
+                }
+            )
+            self._emit(handlers, warning)
+
+        self._emit(handlers, record)
+        return True
+
+    @staticmethod
+    def _emit(handlers: Iterable[logging.Handler], record: logging.LogRecord):
+        for handler in handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+
+_queue_handler = _QueueHandler(_log_queue)
+
+
+def _file_handler(file_path: str) -> logging.Handler:
+    """One handler per file, shared by every logger that writes to it.
+
+    Args:
+        file_path (str)
+
+    Returns:
+        logging.Handler
+    """
+    key = os.path.realpath(file_path)
+    handler = _log_files.get(key)
+
+    if handler is None:
+        handler = _RotatingFileHandler(
+            file_path,
+            maxBytes=int(
+                _configs.get("logging", "max_file_size", default=MAX_LOG_SIZE)
+                * 1024
+                * 1024
+            ),
+            backupCount=_configs.get("logging", "backup_count", default=LOG_BACKUPS),
+            encoding="utf-8",
+        )
+        handler.setLevel(_configs.get("logging", "file_level"))
+        handler.setFormatter(_CustomFormatter(True))
+        _log_files[key] = handler
+
+    return handler
+
+
+def _start_logging():
+    global _log_listener, _stdout_handler
+
+    _stdout_handler = logging.StreamHandler(sys.stdout)
+    _stdout_handler.setLevel(_configs.get("logging", "stdout_level"))
+    _stdout_handler.setFormatter(_CustomFormatter())
+
+    _log_listener = _QueueListener(_log_queue, _LogDispatcher())
+    _log_listener.start()
+    # * write what is still queued before the process exits
+    atexit.register(_log_listener.stop)
+
+
 def Logger(file_path: str, name: str) -> logging.Logger:
+    """Get the logger called `name`, created on the first call.
 
-    if _loggers.get(name):
-        return _loggers.get(name)  # type: ignore
+    Records are formatted and written by a single listener thread, logging never waits
+    for a file or stdout.
 
-    # create logger with 'spam_application'
-    logger: logging.Logger = logging.getLogger(name)
-    logger.setLevel(logging.DEBUG)
+    Args:
+        file_path (str): The log file, rotated once it reaches `logging.max_file_size` MB.
+        name (str)
 
-    # create console handler with a higher log level
-    _ch = logging.StreamHandler(sys.stdout)
-    _ch.setLevel(_configs.get("logging", "stdout_level"))
-    _ch.setFormatter(_CustomFormatter())
+    Returns:
+        logging.Logger
+    """
+    with _log_lock:
+        logger = _loggers.get(name)
+        if logger is not None:
+            return logger
 
-    _fh = logging.FileHandler(file_path)
-    _fh.setLevel(_configs.get("logging", "file_level"))
-    _fh.setFormatter(_CustomFormatter(True))
+        if _log_listener is None:
+            _start_logging()
 
-    logger.addHandler(_fh)
-    logger.addHandler(_ch)
+        handlers = [_file_handler(file_path), _stdout_handler]
+        _log_routes[name] = handlers  # type: ignore
 
-    _loggers[file_path] = logger
+        logger = logging.getLogger(name)
+        # ? records no handler wants are never created
+        logger.setLevel(min(x.level for x in handlers))  # type: ignore
+        logger.addHandler(_queue_handler)
+        logger.propagate = False
+
+        _loggers[name] = logger
 
     return logger
 
@@ -234,66 +1316,254 @@ def Logger(file_path: str, name: str) -> logging.Logger:
 
 _configs = Configs()
 _logger = Logger(str(ABSDIR.joinpath("../logs/std.lib.log")), "StdLib")
+_governor = RateGovernor(_ratelimit_state_path)
+_reddit_provider = RedditProvider()
+_last_limits: "weakref.WeakKeyDictionary[praw.reddit.Reddit, Tuple[float, float]]" = (
+    weakref.WeakKeyDictionary()
+)
+_ratelimit_remaining = metrics.gauge(
+    "ratelimit_remaining", "Requests left in reddit's current rate limit window"
+)
+_ratelimit_wait = metrics.histogram(
+    "ratelimit_wait_seconds",
+    "Time control_ratelimit waited for the rate limit budget",
+    ("priority",),
+)
 
 ###############################
 # ======== FUNCTIONS ======== #
 ###############################
 
 
-def catch(error: BaseException, logger: logging.Logger) -> int:
+def _write_json_atomic(path: str, obj: Any) -> None:
+    """Write json to a temporary file and move it over `path`, readers never see half of it.
+
+    Args:
+        path (str)
+        obj (Any)
+    """
+    tmp_path = "%s.%d.tmp" % (path, os.getpid())
 
+    with open(tmp_path, "wt", encoding="utf-8") as f:
+        json.dump(obj, f, indent=4)
+
+    os.replace(tmp_path, path)
+
+
+def catch_delay(error: BaseException, logger: logging.Logger) -> "float | None":
+    """Log an error and decide how long to back off before trying again.
+
+    Args:
+        error (BaseException)
+        logger (logging.Logger)
+
+    Returns:
+        float | None: Seconds to wait, `None` if the error can not be recovered from.
+    """
     if isinstance(error, PrawErrors.Critical):
         logger.critical(
             "Critical error ocurred: %s : %s" % (type(error).__name__, error)
         )
-        time.sleep(60)
+        return 60
     elif isinstance(error, PrawErrors.NonCritical):
         logger.warning("Reddit API is down: %s : %s" % (type(error).__name__, error))
-        time.sleep(120)
+        return 120
     elif isinstance(error, PrawErrors.SysExit):
         logger.critical(
             "An exception went unhandled: %s : %s" % (type(error).__name__, error)
         )
-        return 1
+        return None
     else:
         logger.critical(
             "Something went very wrong: %s : %s" % (type(error).__name__, error)
         )
+        return None
+
+
+def catch(error: BaseException, logger: logging.Logger) -> int:
+
+    delay = catch_delay(error, logger)
+
+    if delay is None:
         return 1
+
+    time.sleep(delay)
     return 0
 
 
+def listed_attr(thing: Any, name: str, default: Any = None) -> Any:
+    """Read an attribute a listing sent along, without fetching the object when it is missing.
+
+    praw fetches the whole object (one request) for any attribute it does not have yet, so
+    `hasattr(submission, "crosspost_parent")` costs a request for every submission that is not
+    a crosspost.
+
+    Args:
+        thing (Any): A praw object that came from a listing.
+        name (str)
+        default (Any, optional): Defaults to None.
+
+    Returns:
+        Any
+    """
+    return vars(thing).get(name, default)
+
+
 def _as_dict(obj: object):
     _vars = vars(obj)
     return {k: v for k, v in zip(_vars.keys(), _vars.values()) if not k.startswith("_")}
 
 
-def control_ratelimit(reddit: praw.reddit.Reddit):
+def observe_ratelimit(reddit: Any) -> None:
+    """Feed an instance's latest `X-Ratelimit-*` headers into the shared governor.
+
+    Args:
+        reddit (Any): A `praw.Reddit` or `asyncpraw.Reddit` instance.
+    """
     limit = reddit.auth.limits
 
-    requests_left = (
-        int(limit["remaining"]) if isinstance(limit["remaining"], (int, float)) else 0
-    )
-    time_left = (
-        limit["reset_timestamp"]
-        if isinstance(limit["reset_timestamp"], (int, float))
-        else 0
-    ) - time.time()
-
-    if _logger.level == logging.DEBUG:
-        curframe = inspect.currentframe()
-        calframe = inspect.getouterframes(curframe, 2)
-        _logger.debug(f"{calframe[1][3]}() => {requests_left}, {int(time_left)}s")
-
-    if requests_left < 20:
-        if time_left > 0:
-            time.sleep(time_left)
-        return
+    remaining = limit.get("remaining")
+    reset_timestamp = limit.get("reset_timestamp")
+
+    if isinstance(remaining, (int, float)) and isinstance(
+        reset_timestamp, (int, float)
+    ):
+        # ? only feed headers once, an idle instance keeps reporting its last response
+        if _last_limits.get(reddit) != (remaining, reset_timestamp):
+            _last_limits[reddit] = (remaining, reset_timestamp)
+            _governor.observe(remaining, reset_timestamp)
+            _ratelimit_remaining.set(remaining)
+
+
+def try_control_ratelimit(reddit: Any, priority: Priority = Priority.PLUGIN) -> float:
+    """Non-blocking `control_ratelimit`, for callers that can not sleep (e.g. an event loop).
+
+    Args:
+        reddit (Any): A `praw.Reddit` or `asyncpraw.Reddit` instance.
+        priority (Priority, optional): Who is asking. Defaults to Priority.PLUGIN.
+
+    Returns:
+        float: `0` if the request may be made now, otherwise how long to wait before asking again.
+    """
+    observe_ratelimit(reddit)
+    return _governor.try_acquire(priority)
+
+
+def control_ratelimit(
+    reddit: praw.reddit.Reddit, priority: Priority = Priority.PLUGIN
+) -> float:
+    """Wait for the shared rate limit budget before making a request.
+
+    Also feeds the instance's latest `X-Ratelimit-*` headers into the shared governor.
+
+    Args:
+        reddit (praw.reddit.Reddit): The instance that is about to make a request.
+        priority (Priority, optional): Who is asking. Defaults to Priority.PLUGIN.
+
+    Returns:
+        float: Seconds spent waiting.
+    """
+    observe_ratelimit(reddit)
+
+    waited = _governor.acquire(priority)
+    _ratelimit_wait.observe(waited, priority.name)
+
+    if waited > 1:
+        _logger.debug(
+            "%s() waited %.1fs for the rate limit (%s)"
+            % (sys._getframe(1).f_code.co_name, waited, priority.name)
+        )
+
+    return waited
 
 
 def gen_reddit_instance(secrets: Type[Secrets] = Secrets) -> praw.reddit.Reddit:
-    reddit = praw.Reddit(**_as_dict(secrets))
-    reddit._validate_on_submit = True
-    # _logger.debug("Created reddit instance: %s" % reddit)
-    # I'm not sure about this debug call
-    return reddit
+    """A new reddit instance, it shares its token and connections with the other instances.
+
+    Use `thread_reddit` unless the instance is handed to another thread.
+    """
+    return _reddit_provider.create(secrets)
+
+
+def thread_reddit(secrets: Type[Secrets] = Secrets) -> praw.reddit.Reddit:
+    """The calling thread's own reddit instance, praw is not thread safe.
+
+    Args:
+        secrets (Type[Secrets], optional): Defaults to Secrets.
+
+    Returns:
+        praw.reddit.Reddit
+    """
+    return _reddit_provider.get(secrets)
+
+
+def serve_metrics(process: str, aggregate: bool = False) -> None:
+    """Serve the process' metrics on localhost, unless `metrics.enabled` is false.
+
+    Args:
+        process (str): Name of the process in main.py's aggregated metrics.
+        aggregate (bool, optional): Serve every process' metrics on `metrics.port`, only
+            main.py does. Defaults to False.
+    """
+    if not _configs.get("metrics", "enabled", default=True):
+        return
+
+    port = _configs.get("metrics", "port", default=9464) if aggregate else 0
+
+    try:
+        port = metrics.serve(process, port, aggregate)
+    except OSError as e:
+        _logger.error("Serving the metrics of %s failed: %s" % (process, e))
+        return
+
+    _logger.info(
+        "Metrics of %s are served on http://127.0.0.1:%d/metrics" % (process, port)
+    )
+
+
+def _account_key(secrets: Type[Secrets]) -> Tuple[Any, ...]:
+    return tuple(sorted(_as_dict(secrets).items()))
+
+
+def bypass_rate_limiter(reddit: Any) -> None:
+    """Leave the waiting to the governor, prawcore's own rate limiter only tracks the headers.
+
+    prawcore sleeps before every request by what it estimates the account spends, each instance
+    on its own and blind to priorities. With the bans spending the budget it held the detector
+    back for seconds before removals while the governor had already let them through.
+
+    Args:
+        reddit (Any): A `praw.Reddit` or `asyncpraw.Reddit` instance.
+    """
+    for name in ("_core", "_authorized_core", "_read_only_core"):
+        limiter = getattr(getattr(reddit, name, None), "_rate_limiter", None)
+        if limiter is None:
+            continue
+
+        if inspect.iscoroutinefunction(limiter.delay):
+
+            async def delay():
+                return None
+
+        else:
+
+            def delay():
+                return None
+
+        limiter.delay = delay
+
+
+def _share_refresh(authorizer: Any) -> None:
+    """Let only one thread at a time refresh a token that is shared between instances.
+
+    The others wait and use the fresh token instead of asking for one of their own.
+    """
+    refresh = authorizer.refresh
+    lock = threading.Lock()
+
+    def locked_refresh():
+        with lock:
+            if not authorizer.is_valid():
+                refresh()
+
+    authorizer.refresh = locked_refresh
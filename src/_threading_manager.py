@@ -2,15 +2,29 @@
 # ======== IMPORTS ======== #
 #############################
 
-import ctypes
-import inspect
+import json
 import os
 import threading
+import time
 import uuid
-from queue import Queue
-from typing import Any, Callable, Dict, List, Tuple
-
-from _stdlib import Configs, Logger, p
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from queue import Empty, Queue
+from typing import Any, Callable, Deque, Dict, Iterable, List, Set, TextIO, Tuple
+
+from _metrics import metrics
+from _stdlib import (
+    Configs,
+    Logger,
+    LRUCache,
+    Priority,
+    SeenSet,
+    TokenBucket,
+    catch,
+    control_ratelimit,
+    p,
+)
 
 ############################
 # ======== PATHS ========= #
@@ -30,121 +44,359 @@ _logger = Logger(
     str(ABSDIR.joinpath("../logs/threading.manager.log")), "ThreadingManager"
 )
 
+LISTING_LIMIT = 100  # ? the most reddit returns in one listing page
+TARGET_PER_POLL = 25  # * new submissions a poll should return on average
+MAX_SHARD_SIZE = 100
+SLOW_POLL = 3.0  # * seconds, shards shrink while polls are slower than this
+FAST_POLL = 1.0  # * seconds, shards grow while polls are faster than this
+# * how many submission ids are remembered so none is processed twice
+PROCESSED_IDS = 100000
+
+# ? not labeled by shard, shard ids change with every split and merge
+_scanned = metrics.counter(
+    "submissions_scanned_total", "New submissions handed over for detection"
+)
+_shards = metrics.gauge("shards", "Shards the moderated subs are polled in")
+
 #############################
 # ======== CLASSES ======== #
 #############################
 
 
-# http://tomerfiliba.com/recipes/Thread2/
-class StreamThread(threading.Thread):
-    def __init__(
-        self, target: Callable[[Any], Any], args: "List | Tuple", id_: uuid.UUID
-    ):
-        super().__init__(target=target, args=args)
+@dataclass
+class Page:
+    """What one poll of a shard hands to the detector.
+
+    `checkpoint` is the newest submission of the listing, (fullname, created_utc). The
+    checkpoints of `subs` only move up to it once the detector handled `submissions`, a
+    page without new submissions still goes through the detector so the checkpoints never
+    pass a page that is waiting for it.
+    """
+
+    submissions: List[Any]  # new submissions, oldest first
+    subs: Tuple[str, ...]
+    checkpoint: "Tuple[str, float] | None" = None
+
+
+class Shard:
+    """A group of subreddits whose `/new` listings are fetched together as one multireddit.
+
+    Every shard is polled on its own interval, which follows the shard's traffic: it backs off
+    exponentially while nothing new shows up and shrinks on busy shards so a poll returns
+    about a quarter of a listing page. A listing without any already seen submission means
+    more than a page was posted between two polls, that is counted in `overflows`.
+
+    Subs are added and removed one at a time, every change bumps `version` so the poller can
+    tell the shard changed with an integer compare.
+    """
+
+    def __init__(self, id_: uuid.UUID, subs: List[str], interval: float):
         self.id = id_
+        self.version = 0
+        self.interval = interval
+        self.next_poll = time.monotonic()
+        self.rate = 0.0  # new submissions per second, moving average
+        self._measured = False
+        self.overflowed = False
+        self.overflows = 0
+        self._seen = LRUCache(1000)
+        self._primed_version: "int | None" = None
+        self._last_poll: "float | None" = None
+        self._members: Dict[str, None] = dict.fromkeys(subs)  # ? an ordered set
+        self._subs: "Tuple[str, ...]" = tuple(self._members)
+        self._subs_version = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._members)
+
+    def __contains__(self, sub: str) -> bool:
+        return sub in self._members
+
+    @property
+    def subs(self) -> Tuple[str, ...]:
+        return self.snapshot()[1]
+
+    def snapshot(self) -> Tuple[int, Tuple[str, ...]]:
+        """The shard's version and subs, read together.
+
+        Returns:
+            Tuple[int, Tuple[str, ...]]
+        """
+        with self._lock:
+            # * built once per version, not on every change
+            if self._subs_version != self.version:
+                self._subs = tuple(self._members)
+                self._subs_version = self.version
+            return self.version, self._subs
+
+    def add(self, sub: str):
+        with self._lock:
+            self._members[sub] = None
+            self.version += 1
+
+    def remove(self, sub: str):
+        with self._lock:
+            if sub in self._members:
+                del self._members[sub]
+                self.version += 1
+
+    def is_primed(self, version: int) -> bool:
+        """If a listing was already fetched for this version of the shard."""
+        return version == self._primed_version
+
+    def new_items(
+        self,
+        version: int,
+        listing: List[Any],
+        resume: "Dict[str, Tuple[str, float]] | None" = None,
+    ) -> List[Any]:
+        """Filter a listing down to the submissions that were not seen yet.
+
+        The first listing after the shard's subs changed is only remembered, except for the
+        submissions of subs in `resume` that are newer than the sub's checkpoint.
+
+        Args:
+            version (int): The shard's version when the listing was fetched.
+            listing (List[Any]): Submissions, newest first.
+            resume (Dict[str, Tuple[str, float]] | None, optional): Checkpoints by sub, (fullname, created_utc). Defaults to None.
+
+        Returns:
+            List[Any]: The new submissions, oldest first.
+        """
+        new = []
+        for submission in reversed(listing):
+            if self._seen.get(submission.id) is None:
+                self._seen.put(submission.id, True)
+                new.append(submission)
+
+        if version != self._primed_version:
+            self._primed_version = version
+            self.overflowed = False
+            return [x for x in new if _after_checkpoint(x, resume or {})]
+
+        self.overflowed = len(listing) >= LISTING_LIMIT and len(new) == len(listing)
+        return new
+
+    def record_poll(
+        self,
+        new: int,
+        min_interval: float,
+        max_interval: float,
+        priming: bool = False,
+    ) -> "float | None":
+        """Adapt the polling interval to what the last poll returned.
+
+        A priming poll only starts the clock, it returns nothing new by construction and would
+        otherwise look like a quiet poll. The rate starts at the first measured one.
 
-    def _get_my_tid(self):
-        """determines this (self's) thread id"""
-        if not self.is_alive():
-            raise threading.ThreadError("the thread is not active")
+        Args:
+            new (int): How many new submissions the poll returned.
+            min_interval (float): Lower bound for the interval in seconds.
+            max_interval (float): Upper bound for the interval in seconds.
+            priming (bool, optional): If the poll primed the shard. Defaults to False.
 
-        # do we have it cached?
-        if hasattr(self, "_thread_id"):
-            return self._thread_id
+        Returns:
+            float | None: Seconds since the previous poll, `None` if nothing was measured.
+        """
+        now = time.monotonic()
+        last_poll, self._last_poll = self._last_poll, now
 
-        # no, look for it in the _active dict
-        for tid, tobj in threading._active.items():  # type: ignore - Pylance hides "private" members
-            if tobj is self:
-                self._thread_id = tid
-                return tid
+        if priming or last_poll is None:
+            return None
 
-        raise AssertionError("could not determine the thread's id")
+        elapsed = max(now - last_poll, 0.001)
+        rate = new / elapsed
+        self.rate = rate if not self._measured else 0.7 * self.rate + 0.3 * rate
+        self._measured = True
 
-    def raise_exc(self, exctype):
-        """raises the given exception type in the context of this thread"""
-        _async_raise(self._get_my_tid(), exctype)
+        if self.overflowed:
+            self.overflows += 1
+            interval = self.interval / 2
+        elif not new:
+            interval = self.interval * 2
+        else:
+            # * at most double at once so one quiet poll does not push a busy shard too far
+            interval = min(TARGET_PER_POLL / self.rate, self.interval * 2)
 
-    def terminate(self):
-        """raises SystemExit in the context of the given thread, which should
-        cause the thread to exit silently (unless caught)"""
-        self.raise_exc(SystemExit)
+        self.interval = min(max(interval, min_interval), max_interval)
+        return elapsed
 
 
 class ThreadManager:
+    """Keeps the moderated subs split into shards and streams every shard from a single thread.
+
+    The poller thread fetches the `/new` listing of whichever shard is due next (see `Shard`
+    for how each shard's interval adapts to its traffic) and hands each page of new
+    submissions to the detector thread (`target`) through one queue. The checkpoints of a
+    shard's subs only move once the detector handled the page, a crash never skips a page
+    that was fetched but not checked yet.
+
+    The submission rate of every sub is measured so new subs go to the least busy shard and
+    `rebalance` can move subs away from shards that carry much more traffic than the rest.
+    The shard size starts at `max_subs_per_thread` and follows the observed poll latency.
+
+    `index` maps every sub to the id of its shard, so adding or removing a sub does not have
+    to look through the other shards. The ids of the last `PROCESSED_IDS` submissions `target`
+    handled are remembered in `processed`, no submission is handed over twice.
+    """
+
     def __init__(
-        self, target: Callable[[uuid.UUID, Dict[uuid.UUID, List[str]], Queue], None]
+        self,
+        target: Callable[[List[Any]], None],
+        reddit_factory: Callable[[], Any],
+        checkpoints: "Checkpoints | None" = None,
     ):
-        self.thread_dict = {}
+        self.checkpoints = checkpoints
+        self.shards: Dict[uuid.UUID, Shard] = {}
         self.errors = Queue()
+        self.submissions: "Queue[Page]" = Queue()
         self.target = target
-        self.running: List[StreamThread] = []
-        self.last_running_len: int
-        self.modding: List[str] = []
+        self.reddit_factory = reddit_factory
+        self.running: List[threading.Thread] = []
+        self.modding: Set[str] = set()
+        self.index: Dict[str, uuid.UUID] = {}
+        self.processed = SeenSet(PROCESSED_IDS)
+        # * new submissions per second of every sub, moving average
+        self.sub_rates: Dict[str, float] = {}
+        # * newest submission polled of every sub, (fullname, created_utc), kept when a sub moves
+        self.positions: Dict[str, Tuple[str, float]] = {}
+        self.latency = 0.0  # seconds per poll, moving average
+        self.max_subs: int = _configs.get("threading", "max_subs_per_thread")
+        self._stop = threading.Event()
 
     def initialize(self, subs: List[str]):
-        self.modding = subs
+        # ? a sub listed twice would end up in two shards
+        subs = list(dict.fromkeys(subs))
+        self.modding = set(subs)
         split = self._split_sub_list(subs)
 
         for sub_list in split:
-            self._make_thread(sub_list)
+            self._make_shard(sub_list)
 
-        self.last_running_len = len(self.running)
+        _shards.track(lambda: len(self.shards))
+        self._start()
 
-        _logger.debug(
-            "Created %d threads for %d sets of subs" % (len(self.running), len(split))
-        )
+        _logger.debug("Created %d shards for %d subs" % (len(self.shards), len(subs)))
 
     def update(self, new_subs: List[str]):
-        """Updates all threads with the new given subs, creates new ones if necessary.
+        """Updates all shards with the new given subs, creates new ones if necessary.
 
         Args:
-            new_subs (List[str]): List of subs to add to threads.
+            new_subs (List[str]): List of subs that are moderated now.
         """
-        difference = _list_diff(self.modding, new_subs)
-
-        if len(difference[0]):  # stopped modding.
-            _logger.info(f"Stopped modding: {difference[0]}")
-            for thread in self.running:
-                for sub in difference[0]:
-                    if sub in self.thread_dict[thread.id]:
-                        try:
-                            self.thread_dict[thread.id].remove(sub)
-                        except BaseException:
-                            continue
-
-        if len(difference[1]):  # subs we started modding
-            _logger.info(f"Started modding: {difference[1]}")
-            to_add = difference[1]
-
-            limit = _configs.get("threading", "max_subs_per_thread")
-
-            for thread in self.running:
-                if (length := len(self.thread_dict[thread.id])) < limit:
-                    fill_add = self._fill_thread(to_add, length)
-                    self.thread_dict[thread.id] += fill_add[0]
-                    to_add = fill_add[1]
-                if not len(to_add):
-                    break
-
-            if len(to_add):
-                for sub_list in self._split_sub_list(to_add):
-                    self._make_thread(sub_list)
-                _logger.info(f"Threads created: {len(to_add)}")
+        new_subs = set(new_subs)
+        removed = self.modding - new_subs
+        added = new_subs - self.modding
+
+        if len(removed):  # stopped modding.
+            _logger.info(f"Stopped modding: {sorted(removed)}")
+
+            for sub in removed:
+                self._remove_sub(self.shards[self.index[sub]], sub)
+                self.sub_rates.pop(sub, None)
+                self.positions.pop(sub, None)
+                if self.checkpoints is not None:
+                    self.checkpoints.discard(sub)
+
+        if len(added):  # subs we started modding
+            _logger.info(f"Started modding: {sorted(added)}")
+            shard_count = len(self.shards)
+
+            # * busiest first, so they get spread before the shards fill up
+            for sub in sorted(added, key=self._weight, reverse=True):
+                self._place(sub)
+
+            if len(self.shards) > shard_count:
+                _logger.info(f"Shards created: {len(self.shards) - shard_count}")
 
         self.modding = new_subs
         _logger.debug(
-            "Running Threads [%d => %d] %d are alive."
-            % (
-                self.last_running_len,
-                len(self.running),
-                len([t for t in self.running if t.is_alive()]),
-            )
+            "%d shards, %d submission page(s) waiting for the detector"
+            % (len(self.shards), self.submissions.qsize())
         )
 
-        self.last_running_len = len(self.running)
+    def rebalance(self, max_moves: int = 10):
+        """Moves a few subs between shards to even out their traffic.
+
+        Shards over the size limit are split first. Then subs are moved from the busiest
+        shard to the quietest one while the busiest carries more than `rebalance_threshold`
+        times the average traffic of the other shards. Last, the two quietest shards are
+        merged if both were measured, the result fits and would not count as busy. Moving a sub
+        makes both shards re-prime, so at most `max_moves` subs are moved per call, merges
+        included.
+
+        Args:
+            max_moves (int, optional): Defaults to 10.
+        """
+        self._adapt_shard_size()
+        threshold = _configs.get("threading", "rebalance_threshold", default=2.0)
+        moves = 0
+
+        for shard in list(self.shards.values()):
+            while len(shard) > self.max_subs and moves < max_moves:
+                sub = min(shard.subs, key=self._weight)
+                self._remove_sub(shard, sub)
+                self._place(sub)
+                moves += 1
+
+        while moves < max_moves and len(self.shards) > 1:
+            shards = sorted(self.shards.values(), key=self._load)
+            light, heavy = shards[0], shards[-1]
+            loads = [self._load(x) for x in shards]
+            others = sum(loads[:-1]) / (len(loads) - 1)
+
+            if len(heavy) < 2 or loads[-1] <= threshold * others:
+                break
+
+            # ? a full shard can only take a sub by giving its quietest one back
+            swap = None
+            if len(light) >= self.max_subs:
+                swap = min(light.subs, key=self._weight)
+            back = self._weight(swap) if swap is not None else 0.0
+
+            # ? moving a sub only helps if it carries less than the gap between the two shards
+            gap = loads[-1] - loads[0]
+            candidates = [x for x in heavy.subs if 0 < self._weight(x) - back < gap]
+            if not len(candidates):
+                break
+
+            sub = max(
+                candidates,
+                key=lambda x: min(self._weight(x) - back, gap - self._weight(x) + back),
+            )
+            self._move(sub, heavy, light)
+            if swap is not None:
+                self._move(swap, light, heavy)
+            moves += 1
+
+        if len(self.shards) > 1:
+            shards = sorted(self.shards.values(), key=self._load)
+            # ? the smaller of the two quietest shards moves into the other
+            source, destination = sorted(shards[:2], key=len)
+            merged = self._load(source) + self._load(destination)
+            rest = [self._load(x) for x in shards[2:]]
+
+            # ! before their rates are measured all shards look idle
+            if (
+                self._is_measured(source)
+                and self._is_measured(destination)
+                and len(source) + len(destination) <= self.max_subs
+                and moves + len(source) <= max_moves
+                and (not len(rest) or merged <= threshold * sum(rest) / len(rest))
+            ):
+                for sub in source.subs:
+                    self._move(sub, source, destination)
+                    moves += 1
+
+        if moves:
+            _logger.info(
+                "Rebalanced %d sub(s), %d shards of up to %d subs"
+                % (moves, len(self.shards), self.max_subs)
+            )
 
     def check_errors(self):
-        """Checks all running threads for errors, returns the first error it finds.
+        """Checks the poller and detector for errors, returns the first error it finds.
 
         Returns:
             Type[BaseException]
@@ -161,71 +413,381 @@ class ThreadManager:
         return error
 
     def check_running(self):
-        """Checks all running threads and removes dead ones from the running list."""
-        killed = 0
+        """Restarts the poller or detector thread if one of them died."""
+        if self._stop.is_set():
+            return
 
         for thread in self.running.copy():
             if not thread.is_alive():
-                killed += 1
+                _logger.warning("Thread %s died, restarting it" % thread.name)
                 self.running.remove(thread)
-
-        if killed:
-            _logger.info("Popped %d dead thread(s)" % killed)
+                self._start_thread(thread.name)
 
     def _end(self):
-        """Kill all threads"""
+        """Stop the poller and detector threads."""
+        self._stop.set()
 
         for thread in self.running.copy():
-            if thread.is_alive():
-                thread.terminate()
+            if thread is not threading.current_thread():
                 thread.join()
-
             self.running.remove(thread)
 
-        _logger.info("Threads were terminated!")
+        if self.checkpoints is not None:
+            self.checkpoints.flush(force=True)
+
+        _logger.info("Threads were stopped!")
+
+    def _start(self):
+        for name in ("Poller", "Detector"):
+            self._start_thread(name)
+
+    def _start_thread(self, name: str):
+        target = self._poll if name == "Poller" else self._detect
+        thread = threading.Thread(target=target, name=name)
+        self.running.append(thread)
+        thread.start()
+
+    def _poll(self):
+        """Fetches the `/new` listing of whichever shard is due next until `_end` is called."""
+        reddit = self.reddit_factory()
+
+        while not self._stop.is_set():
+            shards = list(self.shards.values())
+
+            if not len(shards):
+                self._stop.wait(1)
+                continue
+
+            shard = min(shards, key=lambda x: x.next_poll)
+            delay = shard.next_poll - time.monotonic()
+
+            if delay > 0:
+                # ? wake up at least every second, new shards are polled right away
+                self._stop.wait(min(delay, 1))
+                continue
+
+            try:
+                page = self._fetch(reddit, shard)
+            except BaseException as e:
+                if catch(e, _logger):
+                    self.errors.put(e)
+                    return
+                continue
+
+            if page is not None:
+                self.submissions.put(page)
+
+    def _fetch(self, reddit: Any, shard: Shard) -> "Page | None":
+        version, subs = shard.snapshot()
+
+        if not len(subs):
+            return None
+
+        resume = self._resume_points(shard, version, subs)
+        limit = self._listing_limit(resume)
+        since = min((x[1] for x in resume.values()), default=None)
+
+        control_ratelimit(reddit, Priority.STREAM)
+
+        started = time.monotonic()
+        listing = []
+
+        # ? praw pages through the listing with `after=` as it is consumed
+        # https://praw.readthedocs.io/en/stable/code_overview/models/subreddit.html#praw.models.Subreddit.new
+        for submission in reddit.subreddit("+".join(subs)).new(limit=limit):
+            listing.append(submission)
+
+            if self._needs_next_page(listing, since, limit):
+                control_ratelimit(reddit, Priority.STREAM)
+            elif not len(listing) % LISTING_LIMIT:
+                break
+
+        self._record_latency(
+            (time.monotonic() - started)
+            / max(1, (len(listing) + LISTING_LIMIT - 1) // LISTING_LIMIT)
+        )
+
+        return self._process_listing(shard, version, subs, listing, resume)
+
+    def _resume_points(
+        self, shard: Shard, version: int, subs: Tuple[str, ...]
+    ) -> Dict[str, Tuple[str, float]]:
+        """Where the shard has to catch up from on each of its subs after it changed.
+
+        That is the newest submission polled of a sub, also if it was polled in another
+        shard, or its checkpoint after a restart.
+
+        Args:
+            shard (Shard)
+            version (int)
+            subs (Tuple[str, ...])
+
+        Returns:
+            Dict[str, Tuple[str, float]]: Empty once the shard is primed.
+        """
+        if shard.is_primed(version):
+            return {}
+
+        points = {}
+        for sub in subs:
+            known = [self.positions.get(sub)]
+            if self.checkpoints is not None:
+                known.append(self.checkpoints.get(sub))
+
+            known = [x for x in known if x is not None]
+            if len(known):
+                points[sub] = max(known, key=lambda x: x[1])
+        return points
+
+    def _listing_limit(self, resume: Dict[str, Tuple[str, float]]) -> int:
+        if not len(resume):
+            return LISTING_LIMIT
+        pages = _configs.get("threading", "max_catch_up_pages", default=10)
+        return LISTING_LIMIT * max(1, pages)
+
+    def _needs_next_page(
+        self, listing: List[Any], since: "float | None", limit: int
+    ) -> bool:
+        """If a listing that is being read has to go on to the next page to reach `since`.
+
+        Args:
+            listing (List[Any]): What was read so far, newest first.
+            since (float | None): The oldest checkpoint to reach, `None` to read one page.
+            limit (int): The most submissions to read.
+
+        Returns:
+            bool
+        """
+        if len(listing) % LISTING_LIMIT or len(listing) >= limit or since is None:
+            return False
+        return listing[-1].created_utc >= since
+
+    def _process_listing(
+        self,
+        shard: Shard,
+        version: int,
+        subs: Tuple[str, ...],
+        listing: List[Any],
+        resume: Dict[str, Tuple[str, float]],
+    ) -> "Page | None":
+        """Picks the new submissions out of a listing into a page for the detector.
+
+        Args:
+            shard (Shard)
+            version (int): The shard's version when the listing was fetched.
+            subs (Tuple[str, ...]): The subs the listing was fetched for.
+            listing (List[Any]): Submissions, newest first.
+            resume (Dict[str, Tuple[str, float]]): See `_resume_points`.
+
+        Returns:
+            Page | None: `None` if there is nothing to hand over.
+        """
+        priming = not shard.is_primed(version)
+        new = shard.new_items(version, listing, resume)
+        # ? a sub that moved or overlapping catch-ups can bring a submission up again
+        new = [x for x in new if x.id not in self.processed]
+        _scanned.inc(value=len(new))
+
+        if len(resume):
+            limit = self._listing_limit(resume)
+            since = min(x[1] for x in resume.values())
+
+            if len(listing) >= limit and listing[-1].created_utc >= since:
+                _logger.warning(
+                    "Could not catch up on %s within %d submissions, some were missed"
+                    % ("+".join(resume), limit)
+                )
+            _logger.info(
+                "Caught up on %d submission(s) from %d sub(s)" % (len(new), len(resume))
+            )
+
+        self._reschedule(shard, new, priming)
+
+        # ? a listing covers all of the shard's subs down to its oldest submission
+        checkpoint = None
+        if len(listing):
+            newest = (listing[0].fullname, listing[0].created_utc)
+            for sub in subs:
+                position = self.positions.get(sub)
+                if position is None or position[1] < newest[1]:
+                    self.positions[sub] = newest
+            if self.checkpoints is not None:
+                checkpoint = newest
+
+        if not len(new) and checkpoint is None:
+            return None
+        return Page(new, subs, checkpoint)
+
+    def _unprocessed(self, page: Page) -> List[Any]:
+        """The submissions of a page `target` did not handle yet, pages can overlap.
+
+        Args:
+            page (Page)
+
+        Returns:
+            List[Any]
+        """
+        return [x for x in page.submissions if x.id not in self.processed]
+
+    def _commit(self, page: Page, handled: List[Any]):
+        """Remember what `target` handled and move the checkpoints up to the page.
+
+        Args:
+            page (Page)
+            handled (List[Any]): What `target` was called with.
+        """
+        for submission in handled:
+            self.processed.add(submission.id)
+
+        if self.checkpoints is not None and page.checkpoint is not None:
+            self.checkpoints.advance(page.subs, *page.checkpoint)
+            self.checkpoints.flush()
+
+    def _record_latency(self, seconds: float):
+        self.latency = (
+            seconds if not self.latency else 0.8 * self.latency + 0.2 * seconds
+        )
+
+    def _reschedule(self, shard: Shard, new: List[Any], priming: bool = False):
+        """Pick when a shard that was just polled is polled next.
+
+        Args:
+            shard (Shard)
+            new (List[Any]): What the poll returned.
+            priming (bool, optional): If the poll only primed the shard. Defaults to False.
+        """
+        if shard.overflowed:
+            _logger.warning(
+                "More than %d submissions were posted to %s between two polls, some were missed"
+                % (LISTING_LIMIT, "+".join(shard.subs))
+            )
+
+        elapsed = shard.record_poll(
+            len(new),
+            _configs.get("threading", "min_poll_interval", default=2),
+            _configs.get("threading", "max_poll_interval", default=120),
+            priming,
+        )
+
+        if elapsed is not None:
+            counts = Counter(str(x.subreddit).lower() for x in new)
+            for sub in shard.subs:
+                rate = counts.get(sub, 0) / elapsed
+                self.sub_rates[sub] = 0.7 * self.sub_rates.get(sub, rate) + 0.3 * rate
+
+        # ! all shards together can't poll faster than the budget, stretch every interval equally
+        demand = sum(1 / x.interval for x in list(self.shards.values()))
+        budget = _configs.get("threading", "poll_requests_per_minute", default=40) / 60
+
+        shard.next_poll = time.monotonic() + shard.interval * max(1, demand / budget)
+
+    def _detect(self):
+        """Hands every page of new submissions to `target` until `_end` is called."""
+        while not self._stop.is_set():
+            try:
+                page = self.submissions.get(timeout=1)
+            except Empty:
+                continue
+
+            try:
+                new = self._unprocessed(page)
+                if len(new):
+                    self.target(new)
+                self._commit(page, new)
+            except BaseException as e:
+                if catch(e, _logger):
+                    self.errors.put(e)
+                    return
 
     def _generate_safe_id(self) -> uuid.UUID:
-        """Generates an ID for a thread that is not already present (unlikely).
+        """Generates an ID for a shard that is not already present (unlikely).
 
         Returns:
             uuid.UUID: The ID
         """
         _id = uuid.uuid4()
-        while _id in self.thread_dict.keys():
+        while _id in self.shards.keys():
             _id = uuid.uuid4()
         return _id
 
-    def _make_thread(self, subs: List[str]):
-        """Creates and adds a thread to the running list and dict given the subs it should mod.
+    def _make_shard(self, subs: List[str]):
+        """Creates a shard for the given subs, the poller picks it up on its next round.
 
         Args:
             subs (List[str])
         """
         id_ = self._generate_safe_id()
-        thread = StreamThread(self.target, (id_, self.thread_dict, self.errors), id_)  # type: ignore - Pylance thinks generic type `Any` should match with static types for some reason
-        self.thread_dict[id_] = subs
-        self.running.append(thread)
-        thread.start()
+        self.shards[id_] = Shard(
+            id_, subs, _configs.get("threading", "poll_interval", default=10)
+        )
+        for sub in subs:
+            self.index[sub] = id_
         return
 
-    def _fill_thread(self, new: list, filled: int):
-        """Fills a list based on the limit defined as std.LIMIT and returns the remainder.
+    def _place(self, sub: str):
+        """Adds a sub to the least busy shard that has room, or to a new shard.
+
+        Args:
+            sub (str)
+        """
+        open_shards = [x for x in self.shards.values() if len(x) < self.max_subs]
+
+        if not len(open_shards):
+            self._make_shard([sub])
+            return
+
+        shard = min(open_shards, key=self._load)
+        shard.add(sub)
+        self.index[sub] = shard.id
+
+    def _remove_sub(self, shard: Shard, sub: str):
+        shard.remove(sub)
+        self.index.pop(sub, None)
+        if not len(shard):
+            del self.shards[shard.id]
+
+    def _move(self, sub: str, source: Shard, destination: Shard):
+        destination.add(sub)
+        self.index[sub] = destination.id
+        source.remove(sub)
+        if not len(source):
+            del self.shards[source.id]
+
+    def _weight(self, sub: str) -> float:
+        """Measured submission rate of a sub, the average of all subs if it was never measured.
 
         Args:
-            new (list): The list to be filled.
-            filled (int): How much of the other list is filled.
+            sub (str)
 
         Returns:
-            Tuple[List[str], List[str]]: The list of elements that can fit in a list already filled by `filled` items and limited by `std.LIMIT`, the remainder.
+            float
         """
-        limit = _configs.get("threading", "max_subs_per_thread")
-        return (
-            [x for idx, x in enumerate(new) if idx < limit - filled],
-            [x for idx, x in enumerate(new) if idx >= limit - filled],
-        )
+        if sub in self.sub_rates:
+            return self.sub_rates[sub]
+        if not len(self.sub_rates):
+            return 0.0
+        return sum(self.sub_rates.values()) / len(self.sub_rates)
+
+    def _load(self, shard: Shard) -> float:
+        return sum(self._weight(x) for x in shard.subs)
+
+    def _is_measured(self, shard: Shard) -> bool:
+        return all(x in self.sub_rates for x in shard.subs)
+
+    def _adapt_shard_size(self):
+        """Shrinks shards while polls are slow and lets them grow while polls are fast."""
+        if not self.latency or not _configs.get(
+            "threading", "adaptive_shard_size", default=True
+        ):
+            return
+
+        if self.latency > SLOW_POLL and self.max_subs > 1:
+            self.max_subs = max(1, int(self.max_subs * 0.75))
+        elif self.latency < FAST_POLL and self.max_subs < MAX_SHARD_SIZE:
+            self.max_subs += 1
 
     def _split_sub_list(self, subs: List[str]):
-        """Splits a list into a list of lists with a maximum amount of items determined by std.LIMIT
+        """Splits a list into a list of lists with a maximum amount of items determined by `max_subs`
 
         Args:
             subs (list): The list.
@@ -233,25 +795,370 @@ class ThreadManager:
         Returns:
             List[List[str]]: The now splitted list.
         """
-        limit = _configs.get("threading", "max_subs_per_thread")
+        limit = self.max_subs
         return [subs[x : x + limit] for x in range(0, len(subs), limit)]
 
 
+class Checkpoints:
+    """The newest submission every sub was polled up to, so polling can resume from there.
+
+    Kept in memory and written to `path` as one json object at most every `flush_interval`
+    seconds, the file is replaced atomically.
+    """
+
+    def __init__(self, path: str, flush_interval: float = 5.0):
+        self.path = path
+        self.flush_interval = flush_interval
+
+        self._points: Dict[str, Tuple[str, float]] = {}  # sub: (fullname, created_utc)
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._last_flush = time.monotonic()
+
+        self._load()
+
+    def __len__(self) -> int:
+        return len(self._points)
+
+    def get(self, sub: str) -> "Tuple[str, float] | None":
+        return self._points.get(sub)
+
+    def advance(self, subs: Iterable[str], fullname: str, created_utc: float) -> None:
+        """Move the checkpoint of every given sub up to a submission, never back.
+
+        Args:
+            subs (Iterable[str])
+            fullname (str): The submission's fullname.
+            created_utc (float): When the submission was posted.
+        """
+        with self._lock:
+            for sub in subs:
+                point = self._points.get(sub)
+                if point is None or point[1] < created_utc:
+                    self._points[sub] = (fullname, created_utc)
+                    self._dirty = True
+
+    def discard(self, sub: str) -> None:
+        with self._lock:
+            if self._points.pop(sub, None) is not None:
+                self._dirty = True
+
+    def adopt(self, path: str, subs: Iterable[str]) -> int:
+        """Take the checkpoints of some subs from another checkpoints file if they are newer.
+
+        Args:
+            path (str): A file written by another `Checkpoints`.
+            subs (Iterable[str])
+
+        Returns:
+            int: How many checkpoints were taken.
+        """
+        other = Checkpoints(path, float("inf"))
+        adopted = 0
+
+        for sub in subs:
+            point = other.get(sub)
+            if point is not None:
+                with self._lock:
+                    current = self._points.get(sub)
+                    if current is None or current[1] < point[1]:
+                        self._points[sub] = point
+                        self._dirty = True
+                        adopted += 1
+        return adopted
+
+    def flush(self, force: bool = False) -> None:
+        """Write the checkpoints if they changed and `flush_interval` passed.
+
+        Args:
+            force (bool, optional): Ignore `flush_interval`. Defaults to False.
+        """
+        with self._lock:
+            if not self._dirty:
+                return
+            if not force and time.monotonic() - self._last_flush < self.flush_interval:
+                return
+
+            tmp_path = self.path + ".tmp"
+
+            with open(tmp_path, "wt", encoding="utf-8") as f:
+                json.dump(self._points, f)
+                f.flush()
+                os.fsync(f.fileno())
+
+            os.replace(tmp_path, self.path)
+            self._dirty = False
+            self._last_flush = time.monotonic()
+
+    def _load(self) -> None:
+        if not os.path.exists(self.path):
+            return
+
+        try:
+            with open(self.path, "rt", encoding="utf-8") as f:
+                points = json.load(f)
+            self._points = {sub: (x[0], float(x[1])) for sub, x in points.items()}
+        except (ValueError, TypeError, IndexError, AttributeError) as e:
+            _logger.error("Could not read %s, starting over : %s" % (self.path, e))
+
+
 class BanQueue:
-    def __init__(self):
-        self._queue: List[str] = []
+    """Durable FIFO of users waiting to be banned, safe to share between threads.
+
+    Every change is appended to a journal file (one json record per line) which is replayed on
+    start, so users that were still queued or being banned when the process died are banned
+    again. The journal is flushed on every write but only fsynced every `fsync_interval`
+    seconds and it is rewritten with just the pending users once it gets too long.
+
+    A user is only queued once at a time, `get` hands it out and `ack` removes it for good.
+    """
+
+    def __init__(
+        self,
+        journal_path: str,
+        fsync_interval: float = 1.0,
+        compact_after: int = 1000,
+    ):
+        self.journal_path = journal_path
+        self.fsync_interval = fsync_interval
+        self.compact_after = compact_after
+
+        self._pending: Deque[Tuple[str, float]] = deque()  # (user, queued at)
+        self._in_flight: Dict[str, float] = {}
+        self._queued: Set[str] = set()  # pending and in flight users
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._records = 0
+        self._last_fsync = 0.0
+
+        self._replay()
+        self._journal: TextIO = open(self.journal_path, "at", encoding="utf-8")
+        with self._lock:
+            self._compact()
+
+    def __len__(self) -> int:
+        return len(self._queued)
+
+    def put(self, user: str) -> bool:
+        """Queue a user, does nothing if the user is already queued or being banned.
+
+        Args:
+            user (str)
+
+        Returns:
+            bool: If the user was queued.
+        """
+        with self._lock:
+            if user in self._queued:
+                return False
+
+            queued_at = time.time()
+            self._write(["put", user, queued_at])
+            self._pending.append((user, queued_at))
+            self._queued.add(user)
+            self._not_empty.notify()
+        return True
+
+    def get(self, timeout: float = 0) -> "str | None":
+        """Take the oldest user out of the queue, it stays in the journal until `ack` is called.
+
+        Args:
+            timeout (float, optional): How long to wait for a user. Defaults to 0.
+
+        Returns:
+            str | None: The user, `None` if the queue stayed empty.
+        """
+        with self._lock:
+            if not len(self._pending) and timeout > 0:
+                self._not_empty.wait(timeout)
+
+            if not len(self._pending):
+                return None
+
+            user, queued_at = self._pending.popleft()
+            self._in_flight[user] = queued_at
+            return user
+
+    def ack(self, user: str) -> None:
+        """Mark a user returned by `get` as done.
+
+        Args:
+            user (str)
+        """
+        with self._lock:
+            if self._in_flight.pop(user, None) is None:
+                return
+
+            self._queued.discard(user)
+            self._write(["ack", user])
+
+            if self._records > self.compact_after and self._records > 4 * len(self):
+                self._compact()
+
+    def retry(self, user: str) -> None:
+        """Put a user returned by `get` back at the end of the queue.
+
+        Args:
+            user (str)
+        """
+        with self._lock:
+            queued_at = self._in_flight.pop(user, None)
+            if queued_at is not None:
+                self._pending.append((user, queued_at))
+                self._not_empty.notify()
+
+    def is_empty(self) -> bool:
+        return not len(self)
+
+    def oldest_age(self) -> float:
+        """Seconds since the oldest user still in the queue was queued.
+
+        Returns:
+            float: `0` if the queue is empty.
+        """
+        with self._lock:
+            oldest = list(self._in_flight.values())
+            if len(self._pending):
+                oldest.append(self._pending[0][1])
+        return time.time() - min(oldest) if len(oldest) else 0
+
+    def sync(self) -> None:
+        """Flush and fsync the journal."""
+        with self._lock:
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+            self._last_fsync = time.monotonic()
+
+    def _write(self, record: list) -> None:
+        self._journal.write(json.dumps(record) + "\n")
+        self._journal.flush()
+        self._records += 1
+
+        if time.monotonic() - self._last_fsync >= self.fsync_interval:
+            os.fsync(self._journal.fileno())
+            self._last_fsync = time.monotonic()
+
+    def _replay(self) -> None:
+        """Rebuilds the queue from the journal, users that were being banned are queued first."""
+        if not os.path.exists(self.journal_path):
+            return
+
+        queued: Dict[str, float] = {}  # ? dicts keep insertion order
+
+        with open(self.journal_path, "rt", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    _logger.warning("Skipping broken ban journal record: %r" % line)
+                    continue
+
+                if record[0] == "put":
+                    queued.setdefault(record[1], record[2])
+                elif record[0] == "ack":
+                    queued.pop(record[1], None)
+
+        self._pending.extend(queued.items())
+        self._queued.update(queued)
+
+        if len(self._pending):
+            _logger.info("Recovered %d queued ban(s)" % len(self._pending))
+
+    def _compact(self) -> None:
+        """Rewrites the journal with only the users still queued, must hold `_lock`."""
+        tmp_path = self.journal_path + ".tmp"
+
+        with open(tmp_path, "wt", encoding="utf-8") as f:
+            for user, queued_at in list(self._in_flight.items()) + list(self._pending):
+                f.write(json.dumps(["put", user, queued_at]) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+        self._journal.close()
+        os.replace(tmp_path, self.journal_path)
+        self._journal = open(self.journal_path, "at", encoding="utf-8")
+        self._records = len(self)
+        self._last_fsync = time.monotonic()
+
+
+class BanExecutor:
+    """Bans a user from many subreddits at once with a fixed pool of worker threads.
+
+    Every ban takes a token from a shared `TokenBucket` before it is sent, so the amount of
+    workers only changes how many bans can wait on the network at once, not the request rate.
+    """
+
+    def __init__(self, workers: int, budget: TokenBucket):
+        self._budget = budget
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="Ban")
+        # * when the bans of the last minute finished
+        self._finished: Deque[float] = deque()
+        self._lock = threading.Lock()
+
+    def run(
+        self,
+        user: str,
+        subs: List[str],
+        ban: Callable[[str, str], bool],
+        checkpoint: Callable[[str, str], None],
+    ) -> int:
+        """Ban a user from every given subreddit and wait until all bans are done.
+
+        Args:
+            user (str): The user to be banned.
+            subs (List[str]): Subreddits to ban the user from.
+            ban (Callable[[str, str], bool]): Called with (user, subreddit) from a worker thread, returns if the ban succeeded.
+            checkpoint (Callable[[str, str], None]): Called with (user, subreddit) after every successful ban.
+
+        Returns:
+            int: How many bans succeeded.
+        """
+        futures = {
+            self._pool.submit(self._ban_one, ban, user, sub): sub for sub in subs
+        }
+        succeeded = 0
+
+        for future in as_completed(futures):
+            try:
+                if not future.result():
+                    continue
+            except Exception as e:
+                _logger.error(
+                    "Banning u/%s from r/%s raised: %s" % (user, futures[future], e)
+                )
+                continue
+
+            checkpoint(user, futures[future])
+            succeeded += 1
+
+        return succeeded
+
+    def bans_per_minute(self) -> int:
+        """How many bans finished in the last 60 seconds.
+
+        Returns:
+            int
+        """
+        with self._lock:
+            self._forget_old(time.monotonic())
+            return len(self._finished)
 
-    def put(self, obj: Any):
-        self._queue.append(obj)
+    def _ban_one(
+        self, ban: Callable[[str, str], bool], user: str, subreddit: str
+    ) -> bool:
+        self._budget.acquire()
+        result = ban(user, subreddit)
 
-    def get(self) -> "str | None":
-        return self._queue.pop(0) if len(self._queue) else None
+        with self._lock:
+            now = time.monotonic()
+            self._finished.append(now)
+            self._forget_old(now)
 
-    def is_empty(self):
-        return not len(self._queue)
+        return result
 
-    def is_full(self):
-        return len(self._queue)
+    def _forget_old(self, now: float) -> None:
+        while len(self._finished) and self._finished[0] < now - 60:
+            self._finished.popleft()
 
 
 ###############################
@@ -259,32 +1166,18 @@ class BanQueue:
 ###############################
 
 
-def _list_diff(list_: list, other: list) -> Tuple[List[Any], List[Any]]:
-    """Difference between two lists.
+def _after_checkpoint(submission: Any, resume: Dict[str, Tuple[str, float]]) -> bool:
+    """If a submission was posted after the checkpoint of its sub.
 
     Args:
-        list_ (list): list number 1
-        other (list): list number 2
+        submission (Any)
+        resume (Dict[str, Tuple[str, float]]): Checkpoints by sub, (fullname, created_utc).
 
     Returns:
-        Tuple[list]: Difference between the two lists. `[0]` == `list_` - `other`, `[1]` == `other` - `list_`
+        bool: `False` for subs without a checkpoint.
     """
-    return ([x for x in list_ if x not in other], [x for x in other if x not in list_])
-
-
-def _async_raise(tid, exctype):
-    """Raises the exception, performs cleanup if needed."""
-    # cspell: disable-next-line
-    if not inspect.isclass(exctype):
-        raise TypeError("Only types can be raised (not instances)")
-    res = ctypes.pythonapi.PyThreadState_SetAsyncExc(
-        ctypes.c_long(tid), ctypes.py_object(exctype)
-    )
-    if res == 0:
-        raise ValueError("invalid thread id")
-    elif res != 1:
-        # """if it returns a number greater than one, you're in trouble,
-        # and you should call it again with exc=NULL to revert the effect"""
-        ctypes.pythonapi.PyThreadState_SetAsyncExc(ctypes.c_long(tid), 0)
-        #                                                   ^  needs to be c_long to work, I'm not sure about `0`.
-        raise SystemError("PyThreadState_SetAsyncExc failed")
+    point = resume.get(str(submission.subreddit).lower())
+    if point is None:
+        return False
+    # ? reddit timestamps are in seconds, more than one submission can share one
+    return submission.created_utc >= point[1] and submission.fullname != point[0]
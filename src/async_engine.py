@@ -0,0 +1,551 @@
+#############################
+# ======== IMPORTS ======== #
+#############################
+
+import asyncio
+import functools
+import inspect
+import os
+import sys
+import time
+import uuid
+from dataclasses import asdict
+from typing import Any, Awaitable, Callable, Dict, List, TypeVar
+
+# ? optional dependency, only needed to run this file
+try:
+    import asyncpraw
+    import asyncpraw.exceptions
+    import asyncpraw.models
+    import asyncprawcore
+except ImportError:
+    asyncpraw = None  # type: ignore
+
+import inbox
+import submissions
+from _stdlib import (
+    Logger,
+    Priority,
+    Secrets,
+    TokenBucket,
+    bypass_rate_limiter,
+    catch_delay,
+    listed_attr,
+    p,
+    serve_metrics,
+    try_control_ratelimit,
+)
+from _threading_manager import (
+    LISTING_LIMIT,
+    Checkpoints,
+    Page,
+    Shard,
+    ThreadManager,
+)
+
+############################
+# ======== PATHS ========= #
+############################
+
+
+ABSPATH = os.path.abspath(__file__)
+ABSDIR = p(os.path.dirname(ABSPATH))
+
+
+###############################
+# ======== INSTANCES ======== #
+###############################
+
+# * the stores, caches and plugin loaders are the ones the threaded scripts use
+configs = submissions.configs
+logger = Logger(str(ABSDIR.joinpath("../logs/async.engine.log")), "AsyncEngine")
+
+T = TypeVar("T")
+
+
+#############################
+# ======== CLASSES ======== #
+#############################
+
+
+class AsyncThreadManager(ThreadManager):
+    """`ThreadManager` that runs on the event loop, with one polling task per shard.
+
+    Shards are still assigned by `ThreadManager.update`, a reconcile task starts a task for
+    every new shard and cancels the tasks of shards that are gone. Every task polls its shard
+    whenever it is due, requests are spaced by the shared rate limit governor.
+    """
+
+    def __init__(
+        self,
+        target: Callable[[List[Any]], Awaitable[None]],
+        reddit: Any,
+        checkpoints: "Checkpoints | None" = None,
+    ):
+        super().__init__(target, lambda: reddit, checkpoints)  # type: ignore
+        self.reddit = reddit
+        self.submissions: "asyncio.Queue[Page]" = asyncio.Queue()  # type: ignore
+        self.tasks: Dict[str, "asyncio.Future[None]"] = {}
+        self.shard_tasks: Dict[uuid.UUID, "asyncio.Future[None]"] = {}
+
+    def check_running(self):
+        """Restarts the reconcile or detector task if one of them died."""
+        if self._stop.is_set():
+            return
+
+        for name, task in list(self.tasks.items()):
+            if task.done():
+                logger.warning("Task %s died, restarting it" % name)
+                self._start_task(name)
+
+    def _end(self):
+        self._stop.set()
+
+        for task in list(self.tasks.values()) + list(self.shard_tasks.values()):
+            task.cancel()
+
+        logger.info("Tasks were cancelled!")
+
+    def _start(self):
+        for name in ("Reconcile", "Detector"):
+            self._start_task(name)
+
+    def _start_task(self, name: str):
+        coroutine = self._reconcile() if name == "Reconcile" else self._detect_async()
+        self.tasks[name] = asyncio.ensure_future(coroutine)
+
+    async def _reconcile(self):
+        """Keeps exactly one polling task running per shard."""
+        while not self._stop.is_set():
+            for id_, shard in list(self.shards.items()):
+                task = self.shard_tasks.get(id_)
+                if task is None or task.done():
+                    self.shard_tasks[id_] = asyncio.ensure_future(
+                        self._poll_shard(shard)
+                    )
+
+            for id_ in [x for x in self.shard_tasks if x not in self.shards]:
+                self.shard_tasks.pop(id_).cancel()
+
+            await asyncio.sleep(1)
+
+    async def _poll_shard(self, shard: Shard):
+        while shard.id in self.shards:
+            await asyncio.sleep(max(shard.next_poll - time.monotonic(), 0))
+
+            try:
+                page = await self._fetch_async(shard)
+            except asyncio.CancelledError:
+                raise
+            except BaseException as e:
+                if await acatch(e):
+                    self.errors.put(e)
+                    return
+                continue
+
+            if page is not None:
+                self.submissions.put_nowait(page)
+
+    async def _fetch_async(self, shard: Shard) -> "Page | None":
+        version, subs = shard.snapshot()
+
+        if not len(subs):
+            return None
+
+        resume = self._resume_points(shard, version, subs)
+        limit = self._listing_limit(resume)
+        since = min((x[1] for x in resume.values()), default=None)
+
+        await control_ratelimit_async(self.reddit, Priority.STREAM)
+
+        started = time.monotonic()
+        listing = []
+
+        subreddit = await self.reddit.subreddit("+".join(subs))
+        async for submission in subreddit.new(limit=limit):
+            listing.append(submission)
+
+            if self._needs_next_page(listing, since, limit):
+                await control_ratelimit_async(self.reddit, Priority.STREAM)
+            elif not len(listing) % LISTING_LIMIT:
+                break
+
+        self._record_latency(
+            (time.monotonic() - started)
+            / max(1, (len(listing) + LISTING_LIMIT - 1) // LISTING_LIMIT)
+        )
+
+        return self._process_listing(shard, version, subs, listing, resume)
+
+    async def _detect_async(self):
+        while not self._stop.is_set():
+            page = await self.submissions.get()
+
+            try:
+                new = self._unprocessed(page)
+                if len(new):
+                    await self.target(new)
+                await to_thread(self._commit, page, new)
+            except asyncio.CancelledError:
+                raise
+            except BaseException as e:
+                if await acatch(e):
+                    self.errors.put(e)
+                    return
+
+
+###############################
+# ======== FUNCTIONS ======== #
+###############################
+
+
+async def to_thread(func: Callable[..., T], *args, **kwargs) -> T:
+    """`asyncio.to_thread` for Python 3.8, runs a blocking call in the default executor.
+
+    The stores, the ban journal, the checkpoints and the plugin loaders are the ones the
+    threaded scripts use, they write to disk or wait on locks and queues.
+
+    Args:
+        func (Callable[..., T])
+
+    Returns:
+        T: What `func` returned.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, functools.partial(func, *args, **kwargs))
+
+
+def gen_async_reddit_instance() -> "asyncpraw.Reddit":
+    reddit = asyncpraw.Reddit(**asdict(Secrets()))
+    bypass_rate_limiter(reddit)
+    reddit._validate_on_submit = True
+    return reddit
+
+
+async def acatch(error: BaseException) -> int:
+    """`_stdlib.catch` that backs off without blocking the event loop.
+
+    Args:
+        error (BaseException)
+
+    Returns:
+        int: `1` if the error can not be recovered from.
+    """
+    delay = catch_delay(error, logger)
+
+    if delay is None:
+        return 1
+
+    await asyncio.sleep(delay)
+    return 0
+
+
+async def control_ratelimit_async(reddit: Any, priority: Priority) -> None:
+    """Wait for the shared rate limit budget without blocking the event loop.
+
+    Args:
+        reddit (Any): The instance that is about to make a request.
+        priority (Priority)
+    """
+    while (wait := try_control_ratelimit(reddit, priority)) > 0:
+        await asyncio.sleep(wait)
+
+
+async def fetch_parents(reddit: Any, crossposts: List[Any]) -> Dict[str, Any]:
+    """Async `ParentResolver.resolve`, fetches what is missing from the listing in batches.
+
+    Args:
+        reddit (Any)
+        crossposts (List[Any])
+
+    Returns:
+        Dict[str, CrosspostParent]: Parents by fullname.
+    """
+    result, missing = submissions.parents.split(crossposts)
+
+    for idx in range(0, len(missing), 100):
+        await control_ratelimit_async(reddit, Priority.STREAM)
+
+        fetched = reddit.info(fullnames=missing[idx : idx + 100])
+        # ? newer asyncpraw versions return a coroutine
+        if inspect.isawaitable(fetched):
+            fetched = await fetched
+
+        async for item in fetched:
+            parent = submissions.parents.remember(item)
+            result[parent.fullname] = parent
+
+    return result
+
+
+async def remove_submission(submission: Any):
+    options = configs.get("on_bad_post")
+
+    if not options["remove"]:
+        return
+
+    try:
+        await submission.mod.remove(**options["remove_opts"])
+        await submission.mod.send_removal_message(**options["remove_message_content"])
+    except Exception as e:
+        logger.error("Removing submission %s failed: %s" % (submission, e))
+
+
+async def check_submissions(reddit: Any, page: List[Any]):
+    """Async `submissions.check_crossposts` for a page of new submissions.
+
+    Args:
+        reddit (Any)
+        page (List[Any]): New submissions, oldest first.
+    """
+    crossposts = [x for x in page if listed_attr(x, "crosspost_parent")]
+    submissions.crossposts_seen.inc(value=len(crossposts))
+
+    if not len(crossposts):
+        return
+
+    started = time.monotonic()
+    resolved = await fetch_parents(reddit, crossposts)
+    submissions.parent_lookup.observe(time.monotonic() - started)
+
+    for submission in crossposts:
+        parent = resolved.get(submission.crosspost_parent)
+
+        if parent is None or not submissions.blacklist.contains(parent.subreddit):
+            continue
+
+        logger.debug("Bad submission found: %s : u/%s", submission, submission.author)
+        submissions.bad_posts_seen.inc()
+        detected = time.monotonic()
+
+        if str(submission.author).lower() == parent.author.lower():
+            await to_thread(submissions.ban_queue.put, str(submission.author).lower())
+
+        await control_ratelimit_async(reddit, Priority.REMOVAL)
+        await remove_submission(submission)
+        submissions.removal_latency.observe(time.monotonic() - detected)
+
+        await to_thread(
+            submissions.plugins.on,
+            "on_bad_post",
+            submission=str(submission),
+            parent=parent.id,
+        )
+
+
+async def ban_user_in_moderating(reddit: Any, user_name: str, budget: TokenBucket):
+    """Async `submissions.ban_user_in_moderating`, bans run concurrently under `budget`.
+
+    Args:
+        reddit (Any)
+        user_name (str)
+        budget (TokenBucket): Shared ban rate limit.
+    """
+    if not configs.get("on_bad_post", "ban"):
+        return
+
+    already_banned = set(await to_thread(submissions.banned.get, user_name) or ())
+    moderating = await to_thread(submissions.moderating.get)
+    remaining = [sub for sub in moderating if sub not in already_banned]
+    workers = asyncio.Semaphore(configs.get("bans", "workers", default=4))
+
+    async def ban(sub: str) -> bool:
+        async with workers:
+            while (wait := budget.try_acquire()) > 0:
+                await asyncio.sleep(wait)
+            await control_ratelimit_async(reddit, Priority.BAN)
+
+            options = dict(configs.get("on_bad_post", "ban_opts"))
+            options["ban_message"] = options["ban_message"] % {"subreddit": sub}
+
+            try:
+                subreddit = await reddit.subreddit(sub)
+                await subreddit.banned.add(user_name, **options)
+            except Exception as e:
+                logger.error("Banning u/%s from r/%s failed : %s" % (user_name, sub, e))
+                return False
+
+        await to_thread(submissions.banned.add, user_name, [sub])
+        return True
+
+    results = await asyncio.gather(*(ban(sub) for sub in remaining))
+    submissions.bans_done.inc(value=sum(results))
+
+    logger.info(
+        "Banned u/%s from %d/%d subreddit(s)"
+        % (user_name, sum(results), len(remaining))
+    )
+
+
+async def send_message_to_subreddit(subreddit: Any):
+    options = configs.get("on_invite")
+
+    if not options["send_message"]:
+        return
+
+    message = dict(options["message_content"])
+    message["message"] = message["message"] % {"subreddit": subreddit}
+
+    try:
+        await subreddit.message(**message)
+    except Exception as e:
+        logger.error("Sending message to r/%s failed: %s" % (subreddit, e))
+
+
+async def make_sticky_announcement(subreddit: Any):
+    options = configs.get("on_invite")
+
+    if not options["make_announcement"]:
+        return
+
+    if sum([1 async for post in subreddit.hot(limit=2) if post.stickied]) >= 2:
+        return
+
+    try:
+        submission = await subreddit.submit(**options["announcement_content"])
+        await submission.mod.approve()
+        await submission.mod.distinguish(how="yes")
+        await submission.mod.sticky(state=True)
+    except Exception as e:
+        logger.error("Making announcement to r/%s failed: %s" % (subreddit, e))
+
+
+async def check_inbox(reddit: Any):
+    """Async `inbox.check_inbox`.
+
+    Args:
+        reddit (Any)
+    """
+    async for unread in reddit.inbox.unread(limit=None):
+        await control_ratelimit_async(reddit, Priority.STREAM)
+
+        if isinstance(unread, asyncpraw.models.SubredditMessage) and not (
+            inbox.is_ignored(str(unread.subreddit))
+        ):
+            try:
+                subreddit = await reddit.subreddit(str(unread.subreddit))
+                await subreddit.mod.accept_invite()
+
+                await to_thread(
+                    inbox.plugins.on, "on_invite", subreddit=str(unread.subreddit)
+                )
+
+                await asyncio.sleep(1)
+
+                await send_message_to_subreddit(subreddit)
+                await make_sticky_announcement(subreddit)
+            except (
+                asyncpraw.exceptions.RedditAPIException,
+                asyncprawcore.exceptions.NotFound,
+            ) as e:
+                logger.warning(
+                    "Accepting invite from r/%s failed: %s" % (unread.subreddit, e)
+                )
+
+        await unread.mark_read()
+
+    moderating = [str(x) async for x in reddit.user.moderator_subreddits(limit=None)]
+    await to_thread(submissions.moderating.save, moderating)
+    await to_thread(inbox.plugins.check)
+
+
+async def manage_bans(reddit: Any):
+    budget = TokenBucket(
+        configs.get("bans", "per_minute", default=30) / 60,
+        configs.get("bans", "workers", default=4),
+    )
+
+    while 1:
+        user = await to_thread(submissions.ban_queue.get)
+
+        if user is None:
+            await asyncio.sleep(1)
+            continue
+
+        try:
+            await ban_user_in_moderating(reddit, user, budget)
+            await to_thread(submissions.ban_queue.ack, user)
+        except asyncio.CancelledError:
+            # ? the loop is shutting down, nothing else is waiting on it anymore
+            submissions.ban_queue.retry(user)
+            raise
+        except BaseException as e:
+            await to_thread(submissions.ban_queue.retry, user)
+            if await acatch(e):
+                raise
+
+
+async def manage_inbox(reddit: Any):
+    while 1:
+        try:
+            await check_inbox(reddit)
+        except asyncio.CancelledError:
+            raise
+        except BaseException as e:
+            if await acatch(e):
+                raise
+            continue
+
+        await asyncio.sleep(120)
+
+
+async def manage_threads(thread_manager: AsyncThreadManager):
+    while 1:
+        await asyncio.sleep(120)
+
+        thread_manager.update(await to_thread(submissions.moderating.get))
+        thread_manager.rebalance()
+
+        error = thread_manager.check_errors()
+
+        if error is not None:
+            raise SystemExit("Unplanned SystemExit: %s" % error)
+
+        thread_manager.check_running()
+
+
+async def run():
+    """Runs polling, detection, bans and the inbox as tasks until one of them fails."""
+    serve_metrics("async_engine.py")
+    reddit = gen_async_reddit_instance()
+
+    thread_manager = AsyncThreadManager(
+        lambda page: check_submissions(reddit, page), reddit, submissions.checkpoints
+    )
+    thread_manager.initialize(await to_thread(submissions.moderating.get))
+
+    tasks = [
+        asyncio.ensure_future(manage_bans(reddit)),
+        asyncio.ensure_future(manage_inbox(reddit)),
+        asyncio.ensure_future(manage_threads(thread_manager)),
+    ]
+
+    try:
+        # * the first task to fail takes the others down with it
+        await asyncio.gather(*tasks)
+    finally:
+        thread_manager._end()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await reddit.close()
+
+
+##########################
+# ======== MAIN ======== #
+##########################
+
+
+def main():
+    if asyncpraw is None:
+        logger.critical("async_engine.py needs asyncpraw: pip install asyncpraw")
+        sys.exit(1)
+
+    if submissions.legacy_ban_cache_path.exists():
+        submissions._migrate_pickled_queue()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -4,6 +4,7 @@
 
 import os
 import time
+from typing import FrozenSet, Tuple
 
 import praw
 import praw.exceptions
@@ -16,10 +17,12 @@ from _stdlib import (
     Configs,
     Logger,
     Moderating,
+    Priority,
     catch,
     control_ratelimit,
     gen_reddit_instance,
     p,
+    serve_metrics,
 )
 
 ############################
@@ -48,6 +51,30 @@ plugins = PluginLoader(["on_invite"])
 ###############################
 
 
+_ignore_index: "Tuple[int, FrozenSet[str]]" = (-1, frozenset())
+
+
+def is_ignored(subreddit: str) -> bool:
+    """Check if invites from a subreddit should be ignored (blacklisted or in `on_invite.ignore`).
+
+    Args:
+        subreddit (str)
+
+    Returns:
+        bool
+    """
+    global _ignore_index
+
+    # ? the ignore list only gets lowercased again when the config file was reloaded
+    if _ignore_index[0] != configs.version:
+        _ignore_index = (
+            configs.version,
+            frozenset(x.lower() for x in configs.get("on_invite", "ignore")),
+        )
+
+    return subreddit.lower() in _ignore_index[1] or blacklist.contains(subreddit)
+
+
 def send_message_to_subreddit(subreddit: praw.models.Subreddit) -> None:
     """Send message to a given subreddit.
 
@@ -59,7 +86,7 @@ def send_message_to_subreddit(subreddit: praw.models.Subreddit) -> None:
     if not options["send_message"]:
         return
 
-    message = options["message_content"]
+    message = dict(options["message_content"])
 
     message["message"] = message["message"] % {"subreddit": subreddit}
 
@@ -123,14 +150,11 @@ def check_inbox(reddit: praw.reddit.Reddit) -> None:
     inbox = reddit.inbox.unread(limit=None)  # type: ignore
 
     for unread in inbox:
-        control_ratelimit(reddit)
+        control_ratelimit(reddit, Priority.STREAM)
 
         if isinstance(unread, praw.models.SubredditMessage):
 
-            if str(unread.subreddit).lower() in (
-                [x.lower() for x in configs.get("on_invite", "ignore")]
-                + blacklist.get()
-            ):
+            if is_ignored(str(unread.subreddit)):
                 continue
 
             try:
@@ -172,6 +196,7 @@ def main():
 
     error = BaseException("Exception was not registered!")
 
+    serve_metrics("inbox.py")
     reddit = gen_reddit_instance()
 
     while 1:
@@ -4,11 +4,22 @@
 
 import os
 import sys
+import threading
 import time
+from collections import deque
+from queue import Empty, Queue
 from subprocess import PIPE, Popen
+from typing import Deque, Dict, List, Tuple
 
 from _plugin_loader import PluginLoader
-from _stdlib import Configs, Logger, p
+from _stdlib import (
+    Configs,
+    Logger,
+    WorkerHealth,
+    WorkerSlices,
+    p,
+    serve_metrics,
+)
 
 ############################
 # ======== PATHS ========= #
@@ -27,6 +38,218 @@ ABSDIR = p(os.path.dirname(ABSPATH))
 configs = Configs()
 logger = Logger(str(ABSDIR.joinpath("../logs/main.log")), "Main")
 plugins = PluginLoader(["on_main_critical"])
+slices = WorkerSlices()
+health = WorkerHealth()
+
+WORKER_SCRIPT = "submissions.py"
+STDERR_LINES = 200  # * how much of every child's stderr is kept
+STDERR_GRACE = 1.0  # * seconds to wait for the rest of a child's stderr once it exited
+RESTART_BACKOFF = 1.0  # * seconds before the first restart, doubled on every crash
+MAX_RESTART_BACKOFF = 300.0
+CRASH_WINDOW = 600.0  # * seconds, crashes older than this are forgotten
+HEALTH_INTERVAL = 10.0
+
+
+#############################
+# ======== CLASSES ======== #
+#############################
+
+
+class Child:
+    """A script started by main.py.
+
+    One thread drains the child's stderr into a ring buffer of its last `STDERR_LINES` lines,
+    so a chatty child can never fill the pipe. Another waits for the child and reports the exit
+    through the supervisor's queue the moment it is gone, even if a process the child started
+    still holds the pipe open.
+    """
+
+    def __init__(self, script: str, worker: "int | None" = None):
+        self.script = script
+        self.worker = worker
+        self.process: "Popen | None" = None
+        self.started = 0.0
+        self.restart_at: "float | None" = None
+        self.stderr: Deque[str] = deque(maxlen=STDERR_LINES)
+        self._crashes: Deque[float] = deque()
+
+    @property
+    def name(self) -> str:
+        if self.worker is None:
+            return self.script
+        return "%s (worker %d)" % (self.script, self.worker)
+
+    def start(self, exits: "Queue[Tuple[Child, Popen]]"):
+        """Start the script, as one of the submission workers if `worker` is set.
+
+        Args:
+            exits (Queue[Tuple[Child, Popen]]): Gets (self, process) when the process exits.
+        """
+        env = dict(os.environ)
+        if self.worker is not None:
+            env["SUBMISSIONS_WORKER"] = str(self.worker)
+
+        # ? a new buffer, the drain thread of the last run may still be reading its pipe
+        self.stderr = deque(maxlen=STDERR_LINES)
+        self.restart_at = None
+        self.started = time.time()
+        self.process = Popen(
+            [sys.executable, str(ABSDIR.joinpath(self.script))],
+            stdout=sys.stdout,
+            stderr=PIPE,
+            env=env,
+        )
+
+        drain = threading.Thread(
+            target=self._drain,
+            args=(self.process, self.stderr),
+            name="Stderr %s" % self.name,
+            daemon=True,
+        )
+        drain.start()
+
+        threading.Thread(
+            target=self._watch,
+            args=(self.process, drain, exits),
+            name="Watch %s" % self.name,
+            daemon=True,
+        ).start()
+
+    def schedule_restart(self, max_restarts: int) -> "float | None":
+        """Pick when the child is restarted after a crash, later on every crash in a row.
+
+        Args:
+            max_restarts (int): How many crashes within `CRASH_WINDOW` are tolerated.
+
+        Returns:
+            float | None: Seconds until the restart, `None` if the child is crash looping.
+        """
+        now = time.monotonic()
+        self._crashes.append(now)
+        while self._crashes[0] < now - CRASH_WINDOW:
+            self._crashes.popleft()
+
+        if len(self._crashes) > max_restarts:
+            self.restart_at = None
+            return None
+
+        delay = min(
+            RESTART_BACKOFF * 2 ** (len(self._crashes) - 1), MAX_RESTART_BACKOFF
+        )
+        self.restart_at = now + delay
+        return delay
+
+    def _drain(self, process: Popen, stderr: Deque[str]):
+        for line in iter(process.stderr.readline, b""):  # type: ignore
+            stderr.append(line.decode("utf-8", "replace").rstrip("\n"))
+
+    def _watch(
+        self,
+        process: Popen,
+        drain: threading.Thread,
+        exits: "Queue[Tuple[Child, Popen]]",
+    ):
+        process.wait()
+        # * the last lines, usually the traceback, unless something else keeps the pipe open
+        drain.join(STDERR_GRACE)
+        exits.put((self, process))
+
+
+###############################
+# ======== FUNCTIONS ======== #
+###############################
+
+
+def _workers(children: List[Child]) -> Dict[int, Popen]:
+    return {
+        x.worker: x.process
+        for x in children
+        if x.worker is not None and x.process is not None
+    }
+
+
+def check_workers(workers: Dict[int, Popen], started: Dict[int, float]):
+    """Kills workers that stopped reporting their health, logs a summary of the others.
+
+    Args:
+        workers (Dict[int, Popen]): The submission workers that are alive.
+        started (Dict[int, float]): When every worker was started.
+    """
+    timeout = configs.get("main.py", "worker_timeout", default=300)
+    totals: Dict[str, float] = {}
+
+    for worker, process in workers.items():
+        report = health.read(worker)
+
+        # ? a report from before a restart does not count
+        last_seen = started[worker]
+        if report is not None and report["pid"] == process.pid:
+            last_seen = report["time"]
+
+        if time.time() - last_seen > timeout:
+            logger.error(
+                "Worker %d did not report for %ds, killing it" % (worker, timeout)
+            )
+            process.kill()
+            continue
+
+        for key, value in (report or {}).items():
+            if key not in ("worker", "pid", "time") and isinstance(value, (int, float)):
+                totals[key] = totals.get(key, 0) + value
+
+    logger.debug(
+        "%d worker(s): %s"
+        % (len(workers), ", ".join("%s=%g" % item for item in sorted(totals.items())))
+    )
+
+
+def reassign(workers: Dict[int, Popen]):
+    """Splits the subs between the workers that are alive.
+
+    Args:
+        workers (Dict[int, Popen]): The submission workers that are alive.
+    """
+    if not len(workers):
+        return
+
+    slices.assign(list(workers))
+    logger.info("Subs are split between workers %s" % sorted(workers))
+
+
+def on_exit(child: Child, exit_code: int):
+    """Logs a child that exited and schedules its restart, unless it is crash looping.
+
+    A child that exited with code 0 stopped on purpose, it is not restarted and does not count
+    as a crash.
+
+    Args:
+        child (Child)
+        exit_code (int)
+    """
+    if exit_code == 0:
+        logger.info("Process %s exited cleanly, it is not restarted" % child.name)
+        return
+
+    error = "\n".join(child.stderr)
+    delay = child.schedule_restart(configs.get("main.py", "max_restarts", default=5))
+
+    if delay is None:
+        logger.critical(
+            "Process %s exited with code %d, it crashed too often and is not restarted : %s"
+            % (child.name, exit_code, error)
+        )
+    else:
+        logger.critical(
+            "Process %s exited with code %d, restarting it in %ds : %s"
+            % (child.name, exit_code, delay, error)
+        )
+
+    plugins.on(
+        "on_main_critical",
+        file_name=str(ABSDIR.joinpath(child.script)),
+        exit_code=exit_code,
+        error=error,
+    )
 
 
 ##########################
@@ -35,52 +258,78 @@ plugins = PluginLoader(["on_main_critical"])
 
 
 def main():
-    processes = [
-        Popen(
-            [sys.executable, str(ABSDIR.joinpath(script))],
-            stdout=sys.stdout,
-            stderr=PIPE,
-        )
-        for script in configs.get("main.py", "scripts")
-        if not script.startswith("_")
-    ]
+    serve_metrics("main.py", aggregate=True)
+
+    worker_count = configs.get("main.py", "submission_workers", default=1)
+    children: List[Child] = []
+    exits: "Queue[Tuple[Child, Popen]]" = Queue()
+
+    for script in configs.get("main.py", "scripts"):
+        if script.startswith("_"):
+            continue
+
+        if script != WORKER_SCRIPT or worker_count <= 1:
+            children.append(Child(script))
+            continue
+
+        slices.assign(list(range(worker_count)))
+        children.extend(Child(script, worker) for worker in range(worker_count))
+
+    for child in children:
+        child.start(exits)
+
+    next_health_check = time.monotonic() + HEALTH_INTERVAL
 
     try:
 
         while 1:
-            time.sleep(120)
+            running = [x for x in children if x.process is not None]
+            waiting = [x.restart_at for x in children if x.restart_at is not None]
+
+            if not len(running) and not len(waiting):
+                break
 
-            for process in processes.copy():
+            # * wake up for the next exit, restart or health check, whichever comes first
+            timeout = min(waiting + [next_health_check]) - time.monotonic()
 
-                if (exit_code := process.poll()) is not None:
+            try:
+                child, process = exits.get(timeout=max(timeout, 0))
+            except Empty:
+                pass
+            else:
+                if child.process is process:
+                    child.process = None
+                    on_exit(child, process.returncode)
 
-                    _, error = process.communicate()
-                    file_name = process.args[1]  # type: ignore
+                    if child.worker is not None:
+                        health.clear(child.worker)
+                        reassign(_workers(children))
 
-                    error = error.decode("utf-8")
+            now = time.monotonic()
 
-                    logger.critical(
-                        "Process %s exited with code %d : %s"
-                        % (file_name, exit_code, error)
-                    )
+            for child in children:
+                if child.restart_at is not None and child.restart_at <= now:
+                    logger.info("Restarting %s" % child.name)
+                    child.start(exits)
 
-                    processes.remove(process)
+                    if child.worker is not None:
+                        reassign(_workers(children))
 
-                    plugins.on(
-                        "on_main_critical",
-                        file_name=file_name,
-                        exit_code=exit_code,
-                        error=error,
-                    )
+            if now >= next_health_check:
+                next_health_check = now + HEALTH_INTERVAL
 
-            if not len(processes):
-                break
+                workers = _workers(children)
+                started = {x.worker: x.started for x in children}
+
+                if len(workers):
+                    check_workers(workers, started)  # type: ignore
 
     except (SystemExit, KeyboardInterrupt):
         logger.info("SystemExit: terminating processes and exiting with code 1...")
 
-        for process in processes:
-            process.kill()
+        for child in children:
+            if child.process is not None:
+                child.process.kill()
 
         sys.stdout.flush()
         sys.stderr.flush()
@@ -2,15 +2,18 @@
 # ======== IMPORTS ======== #
 #############################
 
+import glob
 import os
 import pickle
 import threading
 import time
-from typing import Dict, List
+from collections import Counter
+from typing import List
 
 import praw
 import praw.models
 
+from _metrics import metrics
 from _plugin_loader import PluginLoader
 from _stdlib import (
     Banned,
@@ -18,13 +21,20 @@ from _stdlib import (
     Configs,
     Logger,
     Moderating,
-    Secrets,
+    ParentResolver,
+    Priority,
+    TokenBucket,
+    WorkerHealth,
+    WorkerSlices,
     catch,
     control_ratelimit,
     gen_reddit_instance,
+    listed_attr,
     p,
+    serve_metrics,
+    thread_reddit,
 )
-from _threading_manager import BanQueue, Queue, ThreadManager, uuid
+from _threading_manager import BanExecutor, BanQueue, Checkpoints, ThreadManager
 
 ###########################
 # ======== PATHS ======== #
@@ -33,7 +43,17 @@ from _threading_manager import BanQueue, Queue, ThreadManager, uuid
 
 ABSPATH = os.path.abspath(__file__)
 ABSDIR = p(os.path.dirname(ABSPATH))
-ban_cache_path = ABSDIR.joinpath("../cache/ban.queue")
+# ? set by main.py when it runs several submission workers, each one owns a slice of the subs
+worker_id: "int | None" = (
+    int(os.environ["SUBMISSIONS_WORKER"])
+    if "SUBMISSIONS_WORKER" in os.environ
+    else None
+)
+_suffix = "" if worker_id is None else ".%d" % worker_id
+
+ban_journal_path = ABSDIR.joinpath("../cache/ban.queue%s.journal" % _suffix)
+legacy_ban_cache_path = ABSDIR.joinpath("../cache/ban.queue")
+checkpoints_path = ABSDIR.joinpath("../cache/stream.checkpoints%s.json" % _suffix)
 
 ###############################
 # ======== INSTANCES ======== #
@@ -46,13 +66,38 @@ logger = Logger(str(ABSDIR.joinpath("../logs/submissions.log")), "Submissions")
 moderating = Moderating()
 plugins = PluginLoader(["on_bad_post"])
 banned = Banned()
-
-
-if ban_cache_path.exists():
-    with open(ban_cache_path, "rb") as f:
-        ban_queue = pickle.load(f)
-else:
-    ban_queue = BanQueue()
+parents = ParentResolver()
+ban_executor = BanExecutor(
+    configs.get("bans", "workers", default=4),
+    TokenBucket(
+        configs.get("bans", "per_minute", default=30) / 60,
+        configs.get("bans", "workers", default=4),
+    ),
+)
+ban_queue = BanQueue(str(ban_journal_path))
+checkpoints = Checkpoints(str(checkpoints_path))
+slices = WorkerSlices()
+health = WorkerHealth()
+counters: "Counter[str]" = Counter()
+
+crossposts_seen = metrics.counter("crossposts_total", "Crossposts checked")
+bad_posts_seen = metrics.counter(
+    "bad_posts_total", "Crossposts from blacklisted subreddits"
+)
+bans_done = metrics.counter("bans_total", "Users banned from a subreddit")
+parent_lookup = metrics.histogram(
+    "parent_lookup_seconds", "Time to resolve the parents of a page of crossposts"
+)
+removal_latency = metrics.histogram(
+    "removal_latency_seconds",
+    "Time from detecting a bad post to its removal",
+)
+metrics.gauge("ban_queue_depth", "Users waiting to be banned").track(
+    lambda: len(ban_queue)
+)
+metrics.gauge("bans_per_minute", "Bans made in the last minute").track(
+    lambda: ban_executor.bans_per_minute()
+)
 
 
 ###############################
@@ -60,8 +105,8 @@ else:
 ###############################
 
 
-def ban_user(subreddit: praw.models.Subreddit, user_name: str):
-    options = configs.get("on_bad_post", "ban_opts")
+def ban_user(subreddit: praw.models.Subreddit, user_name: str) -> bool:
+    options = dict(configs.get("on_bad_post", "ban_opts"))
 
     options["ban_message"] = options["ban_message"] % {"subreddit": subreddit}
 
@@ -73,33 +118,52 @@ def ban_user(subreddit: praw.models.Subreddit, user_name: str):
         subreddit.banned.add(user_name, **options)
     except Exception as e:
         logger.error("Banning u/%s from r/%s failed : %s" % (user_name, subreddit, e))
+        return False
+    return True
 
 
-def ban_user_in_moderating(user_name: str):
+def _ban_worker(user_name: str, subreddit: str) -> bool:
+    """Ban a user from a subreddit by name using the calling thread's own reddit instance.
 
-    if not configs.get("on_bad_post", "ban"):
-        return
+    Args:
+        user_name (str)
+        subreddit (str)
 
-    reddit = gen_reddit_instance()
+    Returns:
+        bool: If the ban succeeded.
+    """
+    reddit = thread_reddit()
 
-    subs_banned_in = []
+    control_ratelimit(reddit, Priority.BAN)
 
-    for subreddit in reddit.user.moderator_subreddits(limit=None):  # type: ignore
-        if str(subreddit).lower() == "u_" + Secrets.username.lower():
-            continue
+    return ban_user(reddit.subreddit(subreddit), user_name)
 
-        if banned.is_in(user_name, str(subreddit).lower()):
-            continue
 
-        control_ratelimit(reddit)
+def ban_user_in_moderating(user_name: str):
 
-        ban_user(subreddit, user_name)
+    if not configs.get("on_bad_post", "ban"):
+        return
+
+    already_banned = set(banned.get(user_name) or ())
+    remaining = [sub for sub in moderating.get() if sub not in already_banned]
+
+    if not len(remaining):
+        return
 
-        subs_banned_in.append(str(subreddit).lower())
+    succeeded = ban_executor.run(
+        user_name,
+        remaining,
+        _ban_worker,
+        lambda user, sub: banned.add(user, [sub]),
+    )
 
-        time.sleep(2)
+    counters["bans"] += succeeded
+    bans_done.inc(value=succeeded)
 
-    banned.add(user_name, subs_banned_in)
+    logger.info(
+        "Banned u/%s from %d/%d subreddit(s), %d ban(s) in the last minute"
+        % (user_name, succeeded, len(remaining), ban_executor.bans_per_minute())
+    )
 
 
 def remove_submission(submission: praw.models.Submission):
@@ -118,98 +182,164 @@ def remove_submission(submission: praw.models.Submission):
         logger.error("Removing submission %s failed: %s" % (submission, e))
 
 
-def pickle_queue(queue: BanQueue):
-    with open(ban_cache_path, "wb") as f:
-        pickle.dump(queue, f)
-
-
-def check_submissions(  # sourcery no-metrics
-    id_: uuid.UUID, subs_dict: Dict[uuid.UUID, List[str]], errors: Queue
+def check_crossposts(
+    reddit: praw.reddit.Reddit, crossposts: List[praw.models.Submission]
 ):
-    reddit = gen_reddit_instance()
-
-    while 1:
-        try:
-
-            modded = subs_dict[id_]
-
-            submission_stream = reddit.subreddit("+".join(modded)).stream.submissions(
-                skip_existing=True, pause_after=10
+    """Remove crossposts from blacklisted subreddits and queue their authors for a ban.
+
+    Args:
+        reddit (praw.reddit.Reddit): Instance used to fetch parents missing from the listing.
+        crossposts (List[praw.models.Submission]): Submissions with a `crosspost_parent`.
+    """
+    started = time.monotonic()
+    resolved = parents.resolve(reddit, crossposts)
+    parent_lookup.observe(time.monotonic() - started)
+
+    for submission in crossposts:
+        parent = resolved.get(submission.crosspost_parent)
+
+        if parent is None:
+            logger.warning(
+                "Parent %s of %s could not be found"
+                % (submission.crosspost_parent, submission)
             )
+            continue
 
-            for submission in submission_stream:
+        if not blacklist.contains(parent.subreddit):
+            continue
 
-                control_ratelimit(reddit)
+        counters["bad_posts"] += 1
+        bad_posts_seen.inc()
+        detected = time.monotonic()
 
-                if submission is None:
-                    time.sleep(10)
-                    continue
+        logger.debug(
+            "Bad submission found: %s : u/%s",
+            submission,
+            submission.author,
+        )
 
-                if hasattr(submission, "crosspost_parent"):
+        if str(submission.author).lower() == parent.author.lower():
+            ban_queue.put(str(submission.author).lower())
 
-                    parent = reddit.submission(
-                        submission.crosspost_parent.split("_")[1]
-                    )
+        control_ratelimit(reddit, Priority.REMOVAL)
+        # ? the submission belongs to the poller's instance, act through our own
+        remove_submission(reddit.submission(submission.id))
+        removal_latency.observe(time.monotonic() - detected)
 
-                    if str(parent.subreddit).lower() in blacklist.get():
-                        logger.debug(
-                            "Bad submission found: %s : u/%s",
-                            submission,
-                            submission.author,
-                        )
+        plugins.on(
+            "on_bad_post",
+            submission=str(submission),
+            parent=parent.id,
+        )
 
-                        if str(submission.author).lower() == str(parent.author).lower():
-                            ban_queue.put(str(submission.author).lower())
-                            pickle_queue(ban_queue)
 
-                        remove_submission(submission)
+def check_submissions(page: List[praw.models.Submission]):
+    """Check a page of new submissions handed over by the poller.
 
-                        plugins.on(
-                            "on_bad_post",
-                            submission=str(submission),
-                            parent=str(parent),
-                        )
+    Args:
+        page (List[praw.models.Submission]): New submissions, oldest first.
+    """
+    counters["submissions"] += len(page)
 
-                if not len(subs_dict[id_]):
-                    return
+    crossposts = [x for x in page if listed_attr(x, "crosspost_parent")]
 
-                if modded != subs_dict[id_]:
-                    break
+    crossposts_seen.inc(value=len(crossposts))
 
-        except BaseException as e:
-            if catch(e, logger):
-                errors.put(e)
-                break
-            continue
+    if len(crossposts):
+        check_crossposts(thread_reddit(), crossposts)
 
 
 def manage_bans(thread_manager: ThreadManager):
     while 1:
+        user = None
         try:
-            time.sleep(60)
+            user = ban_queue.get(timeout=60)
 
-            if ban_queue.is_empty():
-                if ban_cache_path.exists():
-                    ban_cache_path.unlink(True)
+            if user is None:
                 continue
 
-            if user := ban_queue.get():
-                ban_user_in_moderating(user)
+            ban_user_in_moderating(user)
+            ban_queue.ack(user)
+
+            logger.debug(
+                "Ban queue: %d user(s) left, oldest queued %ds ago"
+                % (len(ban_queue), ban_queue.oldest_age())
+            )
 
         except BaseException as e:
+            if user is not None:
+                ban_queue.retry(user)
+
             if catch(e, logger):
                 thread_manager.errors.put(e)
                 break
             continue
 
 
+def owned_subs() -> List[str]:
+    """The moderated subs this process streams, all of them unless it is one of main.py's workers.
+
+    Returns:
+        List[str]
+    """
+    subs = moderating.get()
+    if worker_id is None:
+        return subs
+    return slices.owned(worker_id, subs)
+
+
+def adopt_checkpoints(subs: List[str]):
+    """Take over the checkpoints other workers saved for subs that were just given to this one.
+
+    Args:
+        subs (List[str])
+    """
+    for path in glob.glob(str(ABSDIR.joinpath("../cache/stream.checkpoints.*.json"))):
+        if os.path.realpath(path) != os.path.realpath(checkpoints_path):
+            checkpoints.adopt(path, subs)
+
+
+def report_health(thread_manager: ThreadManager):
+    if worker_id is None:
+        return
+
+    health.report(
+        worker_id,
+        subs=len(thread_manager.modding),
+        shards=len(thread_manager.shards),
+        pages_waiting=thread_manager.submissions.qsize(),
+        poll_latency=thread_manager.latency,
+        overflows=sum(x.overflows for x in list(thread_manager.shards.values())),
+        ban_queue=len(ban_queue),
+        oldest_ban=ban_queue.oldest_age(),
+        **counters,
+    )
+
+
 def manage_threads(thread_manager: ThreadManager):
+    last_update = time.monotonic()
+    slices_version = slices.version
+
     while 1:
-        time.sleep(120)
+        time.sleep(10)
+        report_health(thread_manager)
+
+        # ? main.py moves subs between workers when one of them dies, pick that up right away
+        if time.monotonic() - last_update < 120 and slices.version == slices_version:
+            continue
+
+        last_update = time.monotonic()
+        slices_version = slices.version
 
-        new_modded = moderating.get()
+        new_modded = owned_subs()
+
+        if worker_id is not None:
+            adopt_checkpoints(
+                [x for x in new_modded if x not in thread_manager.modding]
+            )
 
         thread_manager.update(new_modded)
+        thread_manager.rebalance()
 
         error = thread_manager.check_errors()
 
@@ -219,14 +349,47 @@ def manage_threads(thread_manager: ThreadManager):
         thread_manager.check_running()
 
 
+def _migrate_pickled_queue():
+    """Moves users from the old pickled `cache/ban.queue` into the ban journal."""
+
+    class _LegacyBanQueue:
+        _queue: List[str] = []
+
+    class _Unpickler(pickle.Unpickler):
+        def find_class(self, module: str, name: str):
+            # ! only the old BanQueue is allowed, never load arbitrary objects
+            if name == "BanQueue":
+                return _LegacyBanQueue
+            raise pickle.UnpicklingError("%s.%s is not allowed" % (module, name))
+
+    try:
+        with open(legacy_ban_cache_path, "rb") as f:
+            legacy = _Unpickler(f).load()
+    except Exception as e:
+        logger.error("Could not read %s : %s" % (legacy_ban_cache_path, e))
+        return
+
+    for user in legacy._queue:
+        ban_queue.put(user)
+
+    ban_queue.sync()
+    legacy_ban_cache_path.unlink()
+    logger.info("Migrated %d queued ban(s) to the journal" % len(legacy._queue))
+
+
 ##########################
 # ======== MAIN ======== #
 ##########################
 
 
 def main():
-    thread_manager = ThreadManager(check_submissions)
-    thread_manager.initialize(moderating.get())
+    if legacy_ban_cache_path.exists() and not worker_id:
+        _migrate_pickled_queue()
+
+    serve_metrics("submissions.py" + _suffix)
+
+    thread_manager = ThreadManager(check_submissions, gen_reddit_instance, checkpoints)
+    thread_manager.initialize(owned_subs())
 
     threading.Thread(target=manage_bans, args=(thread_manager,)).start()
 
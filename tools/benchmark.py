@@ -0,0 +1,512 @@
+#############################
+# ======== IMPORTS ======== #
+#############################
+
+import argparse
+import gc
+import itertools
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from pathlib import Path as p
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List, Tuple
+
+from loadtest import setup_defaults
+
+############################
+# ======== PATHS ========= #
+############################
+
+
+ABSPATH = os.path.abspath(__file__)
+ABSDIR = p(os.path.dirname(ABSPATH))
+ROOT = ABSDIR.joinpath("..")
+
+# * a benchmark's setup returns the operation to time and how many times one run calls it
+Setup = Callable[[argparse.Namespace, p], Tuple[Callable[[], Any], int]]
+
+_benchmarks: Dict[str, Setup] = {}
+
+###############################
+# ======== FUNCTIONS ======== #
+###############################
+
+
+def benchmark(setup: Setup) -> Setup:
+    """Register a benchmark under the name of its setup function."""
+    _benchmarks[setup.__name__] = setup
+    return setup
+
+
+def prepare(workspace: p, args: argparse.Namespace) -> None:
+    """Copy the bot into `workspace` with quiet logging and placeholder secrets.
+
+    Args:
+        workspace (p)
+        args (argparse.Namespace): Parsed command line.
+    """
+    for name in ("src", "plugins"):
+        shutil.copytree(
+            str(ROOT.joinpath(name)),
+            str(workspace.joinpath(name)),
+            ignore=shutil.ignore_patterns("__pycache__"),
+        )
+
+    dir_paths, file_paths = setup_defaults()
+
+    for path in dir_paths:
+        workspace.joinpath(path).mkdir(parents=True, exist_ok=True)
+    for path, content in file_paths.items():
+        workspace.joinpath(path).write_text(content, encoding="utf-8")
+
+    config = json.loads(file_paths["config/config.json"])
+    config["logging"]["stdout_level"] = 50
+    config["logging"]["file_level"] = 50
+
+    webhook = json.loads(file_paths["config/plugins/webhook.json"])
+    webhook["messages"]["on_bad_post"] = {
+        "content": "Removed %(submission)s, crosspost of %(parent)s",
+        "embeds": [
+            {
+                "title": "Bad post in r/%(subreddit)s",
+                "description": "100%% sure, by u/%(author)s",
+                "fields": [{"name": "parent", "value": "%(parent)s"}],
+            }
+        ],
+    }
+
+    files = {
+        "config/config.json": config,
+        "config/plugins/webhook.json": webhook,
+        "keys/secrets.json": {
+            "client_id": "benchmark",
+            "client_secret": "benchmark",
+            "password": "benchmark",
+            "user_agent": "benchmark of the crosspost bot",
+            "username": "benchmark_bot",
+        },
+        "data/blacklist.json": ["blacklisted_%d" % x for x in range(args.blacklist)],
+        "cache/moderating_subreddits.cache.json": [
+            "sub_%d" % x for x in range(args.subs)
+        ],
+    }
+    for path, content in files.items():
+        workspace.joinpath(path).write_text(json.dumps(content, indent=4), "utf-8")
+
+
+def measure(operation: Callable[[], Any], number: int, repeat: int) -> Dict[str, Any]:
+    """Time `repeat` runs of `number` calls, like `timeit` with the gc off.
+
+    Args:
+        operation (Callable[[], Any])
+        number (int): Calls per run.
+        repeat (int): Runs.
+
+    Returns:
+        Dict[str, Any]: Nanoseconds per call of every run and their summary.
+    """
+    runs = []
+    enabled = gc.isenabled()
+    gc.disable()
+
+    try:
+        for _ in range(repeat):
+            loop = itertools.repeat(None, number)
+            started = time.perf_counter_ns()
+            for _ in loop:
+                operation()
+            runs.append((time.perf_counter_ns() - started) / number)
+    finally:
+        if enabled:
+            gc.enable()
+
+    return {
+        "number": number,
+        "runs_ns": runs,
+        "median_ns": statistics.median(runs),
+        "min_ns": min(runs),
+        "stdev_ns": statistics.stdev(runs) if len(runs) > 1 else 0.0,
+    }
+
+
+def _commit() -> Dict[str, Any]:
+    try:
+        sha = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=str(ROOT),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+        dirty = subprocess.run(
+            ["git", "status", "--porcelain", "--", "src", "plugins"],
+            cwd=str(ROOT),
+            capture_output=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return {"sha": None, "dirty": None}
+    return {"sha": sha, "dirty": bool(dirty)}
+
+
+def _format_ns(ns: float) -> str:
+    for unit, size in (("s", 1e9), ("ms", 1e6), ("us", 1e3)):
+        if ns >= size:
+            return "%.2f%s" % (ns / size, unit)
+    return "%.0fns" % ns
+
+
+def compare(results: Dict[str, Any], base: Dict[str, Any], threshold: float) -> int:
+    """Print how every benchmark changed since `base`.
+
+    Args:
+        results (Dict[str, Any]): This run's report.
+        base (Dict[str, Any]): An older report.
+        threshold (float): Relative change below which a benchmark counts as unchanged.
+
+    Returns:
+        int: How many benchmarks got slower.
+    """
+    slower = 0
+    print("\nCompared to %s:" % (base["meta"]["commit"]["sha"] or "?")[:12])
+
+    for name, result in results["results"].items():
+        old = base["results"].get(name)
+        if old is None:
+            print("  %-28s new" % name)
+            continue
+
+        ratio = result["median_ns"] / old["median_ns"]
+        verdict = ""
+        if ratio > 1 + threshold:
+            verdict = "slower"
+            slower += 1
+        elif ratio < 1 - threshold:
+            verdict = "faster"
+
+        print(
+            "  %-28s %10s -> %10s %+7.1f%% %s"
+            % (
+                name,
+                _format_ns(old["median_ns"]),
+                _format_ns(result["median_ns"]),
+                100 * (ratio - 1),
+                verdict,
+            )
+        )
+
+    return slower
+
+
+################################
+# ======== BENCHMARKS ======== #
+################################
+
+
+@benchmark
+def configs_get(args, workspace):
+    from _stdlib import Configs
+
+    configs = Configs()
+    return lambda: configs.get("threading", "poll_interval"), 100_000
+
+
+@benchmark
+def blacklist_contains(args, workspace):
+    from _stdlib import Blacklist
+
+    blacklist = Blacklist()
+    # * every other lookup is a hit, names come in the case reddit sends them
+    names = itertools.cycle(
+        ["Blacklisted_%d" % x for x in range(0, args.blacklist, 7)]
+        + ["Clean_%d" % x for x in range(0, args.blacklist, 7)]
+    )
+    return lambda: blacklist.contains(next(names)), 100_000
+
+
+@benchmark
+def blacklist_get(args, workspace):
+    from _stdlib import Blacklist
+
+    blacklist = Blacklist()
+    return blacklist.get, 1_000
+
+
+def _banned(args):
+    from _stdlib import Banned
+
+    banned = Banned()
+    connection = banned._connection()
+
+    if connection.execute("SELECT COUNT(*) FROM banned").fetchone()[0] < args.banned:
+        # ? straight into the table, one transaction per user would take minutes
+        connection.execute("BEGIN IMMEDIATE")
+        connection.executemany(
+            "INSERT OR IGNORE INTO banned (user, subreddit) VALUES (?, ?)",
+            (("user_%d" % x, "sub_%d" % (x % 100)) for x in range(args.banned)),
+        )
+        connection.execute("COMMIT")
+
+    return banned
+
+
+@benchmark
+def banned_is_in(args, workspace):
+    banned = _banned(args)
+    rnd = random.Random(1)
+    users = itertools.cycle(
+        ["User_%d" % rnd.randrange(args.banned * 2) for _ in range(10_000)]
+    )
+    return lambda: banned.is_in(next(users), "sub_1"), 10_000
+
+
+@benchmark
+def banned_get(args, workspace):
+    banned = _banned(args)
+    rnd = random.Random(2)
+    users = itertools.cycle(
+        ["user_%d" % rnd.randrange(args.banned * 2) for _ in range(10_000)]
+    )
+    return lambda: banned.get(next(users)), 10_000
+
+
+@benchmark
+def banned_add(args, workspace):
+    banned = _banned(args)
+    users = ("new_user_%d" % x for x in itertools.count())
+    return lambda: banned.add(next(users), ["sub_1", "sub_2", "sub_3"]), 1_000
+
+
+@benchmark
+def moderating_get(args, workspace):
+    from _stdlib import Moderating
+
+    return Moderating().get, 100
+
+
+def _thread_manager(args, subs: List[str]):
+    from _threading_manager import ThreadManager
+
+    manager = ThreadManager(lambda page: None, lambda: None)
+    manager._start = lambda: None  # type: ignore
+    manager.initialize(subs)
+
+    rnd = random.Random(3)
+    manager.sub_rates = {x: rnd.expovariate(10) for x in subs}
+    return manager
+
+
+@benchmark
+def thread_manager_update(args, workspace):
+    subs = ["sub_%d" % x for x in range(args.subs)]
+    manager = _thread_manager(args, subs)
+
+    # * 1% of the subs change between two updates
+    churn = max(1, args.subs // 100)
+    other = subs[churn:] + ["other_%d" % x for x in range(churn)]
+    states = itertools.cycle([other, subs])
+
+    return lambda: manager.update(next(states)), 20
+
+
+@benchmark
+def thread_manager_place(args, workspace):
+    manager = _thread_manager(args, ["sub_%d" % x for x in range(args.subs)])
+
+    def place():
+        manager._place("placed")
+        manager._remove_sub(manager.shards[manager.index["placed"]], "placed")
+
+    return place, 1_000
+
+
+@benchmark
+def split_sub_list(args, workspace):
+    subs = ["sub_%d" % x for x in range(args.subs)]
+    manager = _thread_manager(args, subs[:1])
+    return lambda: manager._split_sub_list(subs), 1_000
+
+
+@benchmark
+def rebalance(args, workspace):
+    manager = _thread_manager(args, ["sub_%d" % x for x in range(args.subs)])
+    return manager.rebalance, 20
+
+
+@benchmark
+def shard_new_items(args, workspace):
+    from _threading_manager import LISTING_LIMIT, Shard
+
+    subs = ["sub_%d" % x for x in range(100)]
+    shard = Shard(uuid.uuid4(), subs, 10)
+    ids = itertools.count()
+    listing: List[Any] = []
+
+    def poll():
+        # * a quarter of every listing is new, like a shard polled at its target rate
+        for _ in range(LISTING_LIMIT // 4):
+            x = next(ids)
+            listing.insert(
+                0, SimpleNamespace(id=str(x), created_utc=x, subreddit=subs[x % 100])
+            )
+        del listing[LISTING_LIMIT:]
+        return shard.new_items(shard.version, listing)
+
+    poll()  # ? prime the shard
+    return poll, 1_000
+
+
+@benchmark
+def seen_set_add(args, workspace):
+    from _stdlib import SeenSet
+
+    seen = SeenSet(args.queue)
+    ids = map(str, itertools.count())
+    return lambda: seen.add(next(ids)), 100_000
+
+
+def _ban_queue(args, workspace: p, name: str):
+    from _threading_manager import BanQueue
+
+    path = str(workspace.joinpath("cache", name))
+    queue = BanQueue(path)
+    for x in range(args.queue - len(queue)):
+        queue.put("queued_%d" % x)
+    queue.sync()
+    return queue, path
+
+
+@benchmark
+def ban_queue_cycle(args, workspace):
+    queue, _ = _ban_queue(args, workspace, "ban.queue.cycle.journal")
+    users = ("user_%d" % x for x in itertools.count())
+
+    # * depth stays at `queue` users: one in, the oldest out and done
+    def cycle():
+        queue.put(next(users))
+        queue.ack(queue.get())  # type: ignore
+
+    return cycle, 10_000
+
+
+@benchmark
+def ban_queue_replay(args, workspace):
+    from _threading_manager import BanQueue
+
+    _, path = _ban_queue(args, workspace, "ban.queue.replay.journal")
+    return lambda: BanQueue(path)._journal.close(), 3
+
+
+@benchmark
+def webhook_render(args, workspace):
+    sys.path.append(str(workspace.joinpath("plugins")))
+    import webhook_plugin
+
+    event = {
+        "submission": "abc123",
+        "parent": 'def"456%s',
+        "subreddit": "some_sub",
+        "author": "someone",
+    }
+    return lambda: webhook_plugin.render_message("on_bad_post", event), 100_000
+
+
+##########################
+# ======== MAIN ======== #
+##########################
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Micro-benchmarks of the bot's hot paths at production scale."
+    )
+    parser.add_argument("--subs", type=int, default=10_000, help="moderated subs")
+    parser.add_argument("--blacklist", type=int, default=5_000)
+    parser.add_argument("--banned", type=int, default=500_000, help="banned users")
+    parser.add_argument("--queue", type=int, default=100_000, help="queue depths")
+    parser.add_argument("--quick", action="store_true", help="a tenth of every scale")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per benchmark")
+    parser.add_argument("-k", "--filter", default="", help="only names containing this")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--compare", help="results of an earlier run to compare with")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="relative change that counts as faster or slower",
+    )
+    parser.add_argument(
+        "--fail", action="store_true", help="exit with 1 if anything got slower"
+    )
+    args = parser.parse_args()
+
+    if args.quick:
+        for name in ("subs", "blacklist", "banned", "queue"):
+            setattr(args, name, max(1, getattr(args, name) // 10))
+
+    workspace = p(tempfile.mkdtemp(prefix="benchmark."))
+    prepare(workspace, args)
+    sys.path.insert(0, str(workspace.joinpath("src")))
+
+    report: Dict[str, Any] = {
+        "meta": {
+            "commit": _commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "time": time.time(),
+            "scale": {
+                name: getattr(args, name)
+                for name in ("subs", "blacklist", "banned", "queue")
+            },
+            "repeat": args.repeat,
+        },
+        "results": {},
+    }
+
+    try:
+        for name, setup in _benchmarks.items():
+            if args.filter not in name:
+                continue
+
+            operation, number = setup(args, workspace)
+            result = measure(operation, number, args.repeat)
+            report["results"][name] = result
+
+            print(
+                "%-28s %10s/op  min %10s  ±%4.1f%%  (%d x %d)"
+                % (
+                    name,
+                    _format_ns(result["median_ns"]),
+                    _format_ns(result["min_ns"]),
+                    100 * result["stdev_ns"] / max(result["median_ns"], 1),
+                    args.repeat,
+                    number,
+                )
+            )
+    finally:
+        shutil.rmtree(str(workspace), ignore_errors=True)
+
+    if args.json:
+        with open(args.json, "wt", encoding="utf-8") as f:
+            json.dump(report, f, indent=4)
+
+    slower = 0
+    if args.compare:
+        with open(args.compare, "rt", encoding="utf-8") as f:
+            slower = compare(report, json.load(f), args.threshold)
+
+    if args.fail and slower:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,621 @@
+#############################
+# ======== IMPORTS ======== #
+#############################
+
+import argparse
+import heapq
+import itertools
+import json
+import random
+import string
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterable, List, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+#############################
+# ======== CLASSES ======== #
+#############################
+
+
+class FakeReddit:
+    """In-memory stand-in for the parts of reddit's API the bot uses.
+
+    Submissions live in one list per subreddit, ordered by a global sequence number that stands
+    in for reddit's ids, so a `/new` listing of a multireddit is a merge of the newest entries
+    of its subs. Every crosspost whose parent is in a blacklisted subreddit is tracked from the
+    moment it is posted until a listing first returns it and until the bot removes it.
+
+    Requests spend from a rate limit window like reddit's (`X-Ratelimit-*` headers, `429` once
+    it is empty).
+    """
+
+    def __init__(
+        self,
+        modded: Iterable[str],
+        blacklisted: Iterable[str],
+        ratelimit: int = 600,
+        window: float = 600,
+        invites: Iterable[str] = (),
+    ):
+        self.modded = [x.lower() for x in modded]
+        self.blacklisted = set(x.lower() for x in blacklisted)
+        self.ratelimit = ratelimit
+        self.window = window
+
+        self._lock = threading.Lock()
+        self._seq = itertools.count(1)
+        self._posts: Dict[str, Dict[str, Any]] = {}  # fullname: data
+        self._by_sub: Dict[str, List[int]] = {}  # sub: sequence numbers, oldest first
+        self._by_seq: Dict[int, str] = {}  # sequence number: fullname
+        self._inbox: List[Dict[str, Any]] = [self._invite(x) for x in invites]
+
+        self._window_start = time.time()
+        self._used = 0
+
+        self.started = time.time()
+        self.requests: Dict[str, int] = {}
+        self.throttled = 0
+        self.posted = 0
+        self.listed_items = 0
+        self.listings = 0
+        self.empty_listings = 0
+        self.info_ids = 0
+        self.seen: set = set()
+        self.bad: Dict[str, Dict[str, "float | None"]] = {}
+        self.bans: List[Tuple[str, str]] = []
+        self.accepted: List[str] = []
+        self.not_found: Dict[str, int] = {}
+
+    # ======== posting ======== #
+
+    def post(
+        self,
+        subreddit: str,
+        author: str,
+        parent: "Dict[str, Any] | None" = None,
+        embed_parent: bool = True,
+    ) -> Dict[str, Any]:
+        """Post a submission, a crosspost of `parent` if it is set.
+
+        Args:
+            subreddit (str)
+            author (str)
+            parent (Dict[str, Any] | None, optional): A submission returned by `post`.
+            embed_parent (bool, optional): Send the parent along as `crosspost_parent_list`
+                like reddit does, otherwise the bot has to look it up. Defaults to True.
+
+        Returns:
+            Dict[str, Any]: The submission's data.
+        """
+        now = time.time()
+
+        with self._lock:
+            seq = next(self._seq)
+            id_ = _base36(seq)
+            data: Dict[str, Any] = {
+                "id": id_,
+                "name": "t3_" + id_,
+                "subreddit": subreddit,
+                "subreddit_name_prefixed": "r/" + subreddit,
+                "author": author,
+                "title": "submission " + id_,
+                "selftext": "",
+                "is_self": parent is None,
+                "url": "https://www.reddit.com/r/%s/comments/%s/" % (subreddit, id_),
+                "permalink": "/r/%s/comments/%s/" % (subreddit, id_),
+                "created_utc": now,
+                "stickied": False,
+                "over_18": False,
+                "score": 1,
+                "num_comments": 0,
+            }
+
+            if parent is not None:
+                data["crosspost_parent"] = parent["name"]
+                if embed_parent:
+                    data["crosspost_parent_list"] = [dict(parent)]
+
+                if parent["subreddit"].lower() in self.blacklisted:
+                    self.bad[data["name"]] = {
+                        "posted": now,
+                        "listed": None,
+                        "removed": None,
+                    }
+
+            self._posts[data["name"]] = data
+            self._by_sub.setdefault(subreddit.lower(), []).append(seq)
+            self._by_seq[seq] = data["name"]
+
+            if subreddit.lower() in self.modded:
+                self.posted += 1
+
+        return data
+
+    # ======== reading ======== #
+
+    def new(
+        self, subs: List[str], limit: int, after: str = "", before: str = ""
+    ) -> List[Dict[str, Any]]:
+        """The newest submissions of several subs, newest first, like `/r/a+b/new`.
+
+        Args:
+            subs (List[str])
+            limit (int)
+            after (str, optional): Only older submissions than this fullname.
+            before (str, optional): Only newer submissions than this fullname.
+
+        Returns:
+            List[Dict[str, Any]]
+        """
+        with self._lock:
+            after_seq = self._seq_of(after)
+            before_seq = self._seq_of(before)
+            runs = []
+
+            for sub in subs:
+                seqs = self._by_sub.get(sub.lower(), [])
+                low = 0 if before_seq is None else bisect_right(seqs, before_seq)
+                high = len(seqs) if after_seq is None else bisect_left(seqs, after_seq)
+
+                if before_seq is not None:
+                    # ? reddit returns the page right above `before`
+                    high = min(high, low + limit)
+                runs.append(seqs[max(low, high - limit) : high][::-1])
+
+            picked = list(itertools.islice(heapq.merge(*runs, key=lambda x: -x), limit))
+            children = [self._posts[self._by_seq[x]] for x in picked]
+
+            now = time.time()
+            self.listings += 1
+            self.listed_items += len(children)
+            self.empty_listings += not len(children)
+
+            for child in children:
+                self.seen.add(child["name"])
+                bad = self.bad.get(child["name"])
+                if bad is not None and bad["listed"] is None:
+                    bad["listed"] = now
+
+        return children
+
+    def info(self, fullnames: List[str]) -> List[Dict[str, Any]]:
+        with self._lock:
+            self.info_ids += len(fullnames)
+            return [self._posts[x] for x in fullnames if x in self._posts]
+
+    def unread(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [x for x in self._inbox if x["new"]]
+
+    # ======== moderating ======== #
+
+    def remove(self, fullname: str):
+        with self._lock:
+            bad = self.bad.get(fullname)
+            if bad is not None and bad["removed"] is None:
+                bad["removed"] = time.time()
+
+    def ban(self, subreddit: str, user: str):
+        with self._lock:
+            self.bans.append((subreddit.lower(), user.lower()))
+
+    def read(self, fullnames: List[str]):
+        with self._lock:
+            for message in self._inbox:
+                if message["name"] in fullnames:
+                    message["new"] = False
+
+    def accept_invite(self, subreddit: str):
+        with self._lock:
+            self.accepted.append(subreddit.lower())
+            if subreddit.lower() not in self.modded:
+                self.modded.append(subreddit.lower())
+
+    # ======== rate limit ======== #
+
+    def spend(self) -> Tuple[bool, Dict[str, str]]:
+        """Take a request from the rate limit window.
+
+        Returns:
+            Tuple[bool, Dict[str, str]]: If the request is allowed, the `X-Ratelimit-*` headers.
+        """
+        with self._lock:
+            now = time.time()
+            if now - self._window_start >= self.window:
+                self._window_start = now
+                self._used = 0
+
+            allowed = self._used < self.ratelimit
+            self._used += allowed
+            self.throttled += not allowed
+            reset = self._window_start + self.window - now
+
+            return allowed, {
+                "x-ratelimit-remaining": "%.1f" % (self.ratelimit - self._used),
+                "x-ratelimit-used": "%d" % self._used,
+                "x-ratelimit-reset": "%d" % max(1, reset),
+            }
+
+    def count(self, endpoint: str):
+        with self._lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+
+    def missing(self, path: str):
+        with self._lock:
+            self.not_found[path] = self.not_found.get(path, 0) + 1
+
+    # ======== stats ======== #
+
+    def stats(self) -> Dict[str, Any]:
+        """Everything the load test reports on, see `tools/loadtest.py`.
+
+        Returns:
+            Dict[str, Any]
+        """
+        with self._lock:
+            bad = [dict(x) for x in self.bad.values()]
+            return {
+                "elapsed": time.time() - self.started,
+                "posted": self.posted,
+                "seen": len(self.seen),
+                "listings": self.listings,
+                "listed_items": self.listed_items,
+                "empty_listings": self.empty_listings,
+                "info_ids": self.info_ids,
+                "requests": dict(self.requests),
+                "throttled": self.throttled,
+                "bad": bad,
+                "bans": len(self.bans),
+                "accepted_invites": len(self.accepted),
+                "not_found": dict(self.not_found),
+            }
+
+    # ======== helpers ======== #
+
+    def _seq_of(self, fullname: str) -> "int | None":
+        if not fullname.startswith("t3_"):
+            return None
+        return int(fullname[3:], 36)
+
+    def _invite(self, subreddit: str) -> Dict[str, Any]:
+        id_ = _random_id()
+        return {
+            "id": id_,
+            "name": "t4_" + id_,
+            "subreddit": subreddit,
+            "author": None,
+            "dest": "loadtest_bot",
+            "subject": "invitation to moderate /r/%s" % subreddit,
+            "body": "gadzooks! you are invited to become a moderator of /r/%s!"
+            % subreddit,
+            "was_comment": False,
+            "first_message_name": None,
+            "replies": "",
+            "created_utc": time.time(),
+            "new": True,
+        }
+
+
+class Generator(threading.Thread):
+    """Posts synthetic or recorded submissions to a `FakeReddit` at a steady rate.
+
+    A synthetic stream picks a random modded sub for every submission, `crossposts` of them are
+    crossposts and `bad` of those crosspost a submission from a blacklisted subreddit. A
+    recorded stream is a json lines file, one submission per line:
+
+        {"subreddit": "...", "author": "...", "crosspost_of": {"subreddit": "...", "author": "..."}}
+
+    `crosspost_of` is optional. Recorded streams are replayed at `rate` per second and looped.
+    """
+
+    def __init__(
+        self,
+        reddit: FakeReddit,
+        rate: float,
+        crossposts: float = 0.2,
+        bad: float = 0.3,
+        embedded: float = 0.5,
+        sources: int = 50,
+        replay: "str | None" = None,
+        seed: "int | None" = None,
+    ):
+        super().__init__(name="Generator", daemon=True)
+        self.reddit = reddit
+        self.rate = rate
+        self.crossposts = crossposts
+        self.bad = bad
+        self.embedded = embedded
+        self.random = random.Random(seed)
+        self.replay = replay
+        self._stop = threading.Event()
+
+        # * submissions that get crossposted, from blacklisted and from unrelated subreddits
+        self._bad_parents = [
+            reddit.post(sub, _random_id(self.random))
+            for sub in sorted(reddit.blacklisted)
+        ]
+        self._clean_parents = [
+            reddit.post("source_%d" % x, _random_id(self.random))
+            for x in range(sources)
+        ]
+
+    def stop(self):
+        self._stop.set()
+
+    def run(self):
+        events = self._recorded() if self.replay else self._synthetic()
+        next_at = time.monotonic()
+
+        for subreddit, author, parent, embed in events:
+            next_at += 1 / self.rate
+            delay = next_at - time.monotonic()
+
+            if self._stop.wait(max(delay, 0)):
+                return
+
+            self.reddit.post(subreddit, author, parent, embed)
+
+    def _synthetic(self):
+        rnd = self.random
+        while 1:
+            subreddit = rnd.choice(self.reddit.modded)
+            author = _random_id(rnd)
+            parent = None
+
+            if rnd.random() < self.crossposts:
+                pool = self._bad_parents if rnd.random() < self.bad else None
+                parent = rnd.choice(pool or self._clean_parents)
+
+                # ? most spam is reposted by the author of the original
+                if pool and rnd.random() < 0.5:
+                    author = parent["author"]
+
+            yield subreddit, author, parent, rnd.random() < self.embedded
+
+    def _recorded(self):
+        with open(self.replay, "rt", encoding="utf-8") as f:  # type: ignore
+            records = [json.loads(x) for x in f if x.strip()]
+
+        parents: Dict[Tuple[str, str], Dict[str, Any]] = {}
+
+        while 1:
+            for record in records:
+                parent = None
+                source = record.get("crosspost_of")
+
+                if source is not None:
+                    key = (source["subreddit"], source["author"])
+                    if key not in parents:
+                        parents[key] = self.reddit.post(*key)
+                    parent = parents[key]
+
+                yield record["subreddit"], record[
+                    "author"
+                ], parent, self.random.random() < self.embedded
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Routes praw's requests to the `FakeReddit` in `server.reddit`."""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self._route("GET")
+
+    def do_POST(self):
+        self._route("POST")
+
+    def log_message(self, *args):
+        pass
+
+    def _route(self, method: str):
+        url = urlsplit(self.path)
+        path = url.path.rstrip("/")
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        form = self._form()
+        reddit: FakeReddit = self.server.reddit  # type: ignore
+
+        if path == "/_stats":
+            self._reply(200, reddit.stats())
+            return
+
+        if path == "/api/v1/access_token":
+            reddit.count("access_token")
+            self._reply(
+                200,
+                {
+                    "access_token": "loadtest",
+                    "token_type": "bearer",
+                    "expires_in": 86400,
+                    "scope": "*",
+                },
+            )
+            return
+
+        parts = path.strip("/").split("/")
+        endpoint = _endpoint(parts)
+        reddit.count(endpoint)
+
+        allowed, headers = reddit.spend()
+        if not allowed:
+            self._reply(429, {"message": "Too Many Requests", "error": 429}, headers)
+            return
+
+        limit = min(int(query.get("limit", 25)), 100)
+
+        if endpoint == "new":
+            children = reddit.new(
+                parts[1].split("+"),
+                limit,
+                query.get("after", ""),
+                query.get("before", ""),
+            )
+            self._reply(200, _listing("t3", children), headers)
+        elif endpoint == "comments":
+            # ? what praw fetches when an attribute is missing from a listed submission
+            found = reddit.info(["t3_" + parts[1]])
+            if len(found):
+                self._reply(200, [_listing("t3", found), _listing("t1", [])], headers)
+            else:
+                self._reply(404, {"message": "Not Found", "error": 404}, headers)
+        elif endpoint == "hot":
+            self._reply(200, _listing("t3", []), headers)
+        elif endpoint == "info":
+            ids = (query.get("id") or form.get("id") or "").split(",")
+            self._reply(200, _listing("t3", reddit.info(ids)), headers)
+        elif endpoint == "moderator_subreddits":
+            names = ["t5_" + x for x in reddit.modded]
+            after = query.get("after", "")
+            start = names.index(after) + 1 if after in names else 0
+            subs = [
+                {"display_name": x, "name": "t5_" + x, "id": x}
+                for x in reddit.modded[start : start + limit]
+            ]
+            # ? like reddit, the last page ends the listing with `after: null`
+            more = start + limit < len(names)
+            self._reply(200, _listing("t5", subs, more), headers)
+        elif endpoint == "unread":
+            self._reply(200, _listing("t4", reddit.unread()), headers)
+        elif endpoint == "read_message":
+            reddit.read(form.get("id", "").split(","))
+            self._reply(200, {}, headers)
+        elif endpoint == "remove":
+            reddit.remove(form.get("id", ""))
+            self._reply(200, {}, headers)
+        elif endpoint == "friend":
+            reddit.ban(parts[1], form.get("name", ""))
+            self._reply(200, {"json": {"errors": []}}, headers)
+        elif endpoint == "accept_moderator_invite":
+            reddit.accept_invite(parts[1])
+            self._reply(200, {"json": {"errors": []}}, headers)
+        elif endpoint in ("removal_link_message", "compose"):
+            self._reply(200, {"json": {"errors": []}}, headers)
+        else:
+            reddit.missing("%s %s" % (method, path))
+            self._reply(404, {"message": "Not Found", "error": 404}, headers)
+
+    def _form(self) -> Dict[str, str]:
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return {}
+
+        body = self.rfile.read(length).decode("utf-8")
+        if self.headers.get("Content-Type", "").startswith("application/json"):
+            try:
+                return json.loads(body)
+            except ValueError:
+                return {}
+        return {k: v[-1] for k, v in parse_qs(body).items()}
+
+    def _reply(self, status: int, body: Any, headers: Dict[str, str] = {}):
+        payload = json.dumps(body).encode("utf-8")
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=UTF-8")
+        self.send_header("Content-Length", str(len(payload)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+###############################
+# ======== FUNCTIONS ======== #
+###############################
+
+
+def _base36(number: int) -> str:
+    digits = string.digits + string.ascii_lowercase
+    result = ""
+    while number:
+        number, rest = divmod(number, 36)
+        result = digits[rest] + result
+    return result or "0"
+
+
+def _random_id(rnd: "random.Random | None" = None) -> str:
+    return "".join((rnd or random).choices(string.ascii_lowercase + string.digits, k=8))
+
+
+def _endpoint(parts: List[str]) -> str:
+    """Name of an API path for the request counts, `/r/a+b/new` is `new`."""
+    if parts[:1] == ["r"] and len(parts) > 2:
+        return parts[-1]
+    if parts[:3] == ["subreddits", "mine", "moderator"]:
+        return "moderator_subreddits"
+    if parts[:1] == ["message"]:
+        return parts[-1]
+    if parts[:1] == ["comments"]:
+        return "comments"
+    return parts[-1] if len(parts) else ""
+
+
+def _listing(
+    kind: str, children: List[Dict[str, Any]], more: bool = True
+) -> Dict[str, Any]:
+    return {
+        "kind": "Listing",
+        "data": {
+            "after": children[-1]["name"] if more and len(children) else None,
+            "before": None,
+            "dist": len(children),
+            "children": [{"kind": kind, "data": x} for x in children],
+        },
+    }
+
+
+def serve(reddit: FakeReddit, port: int = 0) -> ThreadingHTTPServer:
+    """Serve a `FakeReddit` on `127.0.0.1` from a background thread.
+
+    Args:
+        reddit (FakeReddit)
+        port (int, optional): `0` picks a free port. Defaults to 0.
+
+    Returns:
+        ThreadingHTTPServer: `server_address[1]` is the port.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    server.daemon_threads = True
+    server.reddit = reddit  # type: ignore
+    threading.Thread(
+        target=server.serve_forever, name="FakeReddit", daemon=True
+    ).start()
+    return server
+
+
+##########################
+# ======== MAIN ======== #
+##########################
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for reddit's API.")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--subs", type=int, default=100, help="moderated subreddits")
+    parser.add_argument("--blacklisted", type=int, default=20)
+    parser.add_argument("--rate", type=float, default=10, help="submissions per second")
+    parser.add_argument("--crossposts", type=float, default=0.2)
+    parser.add_argument("--bad", type=float, default=0.3)
+    parser.add_argument("--replay", help="json lines file of recorded submissions")
+    args = parser.parse_args()
+
+    reddit = FakeReddit(
+        ["sub_%d" % x for x in range(args.subs)],
+        ["blacklisted_%d" % x for x in range(args.blacklisted)],
+    )
+    Generator(reddit, args.rate, args.crossposts, args.bad, replay=args.replay).start()
+    server = serve(reddit, args.port)
+
+    print("Serving on http://127.0.0.1:%d, stats on /_stats" % server.server_address[1])
+    try:
+        while 1:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
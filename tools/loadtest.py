@@ -0,0 +1,387 @@
+#############################
+# ======== IMPORTS ======== #
+#############################
+
+import argparse
+import ast
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path as p
+from subprocess import STDOUT, Popen
+from typing import Any, Dict, List, Tuple
+
+from fake_reddit import FakeReddit, Generator, serve
+
+############################
+# ======== PATHS ========= #
+############################
+
+
+ABSPATH = os.path.abspath(__file__)
+ABSDIR = p(os.path.dirname(ABSPATH))
+ROOT = ABSDIR.joinpath("..")
+
+PERCENTILES = (50, 90, 99)
+
+###############################
+# ======== FUNCTIONS ======== #
+###############################
+
+
+def setup_defaults() -> Tuple[List[str], Dict[str, str]]:
+    """The directories and default files `setup.py` creates, read without running it.
+
+    Returns:
+        Tuple[List[str], Dict[str, str]]: (dir_paths, file_paths)
+    """
+    tree = ast.parse(ROOT.joinpath("setup.py").read_text(encoding="utf-8"))
+    found: Dict[str, Any] = {}
+
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and isinstance(node.targets[0], ast.Name):
+            if node.targets[0].id in ("dir_paths", "file_paths"):
+                found[node.targets[0].id] = ast.literal_eval(node.value)
+
+    return found["dir_paths"], found["file_paths"]
+
+
+def prepare(workspace: p, api_url: str, blacklisted: List[str], args) -> None:
+    """Copy the bot into `workspace` and point it at the fake API.
+
+    Args:
+        workspace (p)
+        api_url (str): Base url of the fake reddit.
+        blacklisted (List[str])
+        args: Parsed command line.
+    """
+    for name in ("src", "plugins"):
+        shutil.copytree(
+            str(ROOT.joinpath(name)),
+            str(workspace.joinpath(name)),
+            ignore=shutil.ignore_patterns("__pycache__"),
+        )
+
+    dir_paths, file_paths = setup_defaults()
+
+    for path in dir_paths:
+        workspace.joinpath(path).mkdir(parents=True, exist_ok=True)
+    for path, content in file_paths.items():
+        workspace.joinpath(path).write_text(content, encoding="utf-8")
+
+    config = json.loads(file_paths["config/config.json"])
+    config["logging"]["stdout_level"] = 40
+    config["metrics"]["enabled"] = args.metrics
+    config["main.py"]["scripts"] = ["inbox.py", "submissions.py"]
+    config["main.py"]["submission_workers"] = args.workers
+
+    secrets = {
+        "client_id": "loadtest",
+        "client_secret": "loadtest",
+        "password": "loadtest",
+        "user_agent": "loadtest of the crosspost bot",
+        "username": "loadtest_bot",
+        "oauth_url": api_url,
+        "reddit_url": api_url,
+    }
+
+    files = {
+        "config/config.json": config,
+        "keys/secrets.json": secrets,
+        "data/blacklist.json": blacklisted,
+        # ? empty, the bot asks the fake api for the subs it moderates
+        "cache/moderating_subreddits.cache.json": [],
+    }
+    for path, content in files.items():
+        workspace.joinpath(path).write_text(json.dumps(content, indent=4), "utf-8")
+
+
+def start(workspace: p, workers: int) -> List[Popen]:
+    """Start the bot, through main.py when there are several submission workers.
+
+    Args:
+        workspace (p)
+        workers (int)
+
+    Returns:
+        List[Popen]
+    """
+    scripts = ["main.py"] if workers > 1 else ["submissions.py", "inbox.py"]
+    env = dict(os.environ, praw_check_for_updates="False")
+    processes = []
+
+    for script in scripts:
+        output = open(workspace.joinpath("logs", script + ".out"), "wb")
+        processes.append(
+            Popen(
+                [sys.executable, script],
+                cwd=str(workspace.joinpath("src")),
+                stdout=output,
+                stderr=STDOUT,
+                env=env,
+            )
+        )
+
+    return processes
+
+
+def stop(processes: List[Popen]) -> None:
+    """Terminate the bot, killing whatever is still running after 10 seconds.
+
+    Args:
+        processes (List[Popen])
+    """
+    for process in processes:
+        if process.poll() is None:
+            process.terminate()
+
+    deadline = time.monotonic() + 10
+    for process in processes:
+        try:
+            process.wait(max(deadline - time.monotonic(), 0.1))
+        except Exception:
+            process.kill()
+
+
+def percentiles(values: List[float]) -> Dict[str, "float | None"]:
+    """Nearest rank percentiles and the maximum.
+
+    Args:
+        values (List[float])
+
+    Returns:
+        Dict[str, float | None]: "p50", "p90", "p99" and "max", `None` without values.
+    """
+    values = sorted(values)
+    result: Dict[str, "float | None"] = {}
+
+    for percentile in PERCENTILES:
+        index = max(0, -(-len(values) * percentile // 100) - 1)
+        result["p%d" % percentile] = values[index] if len(values) else None
+
+    result["max"] = values[-1] if len(values) else None
+    return result
+
+
+def summarize(stats: Dict[str, Any], duration: float) -> Dict[str, Any]:
+    """Turn the fake api's stats into the load test report.
+
+    Args:
+        stats (Dict[str, Any]): `FakeReddit.stats()`
+        duration (float): Seconds submissions were generated for.
+
+    Returns:
+        Dict[str, Any]
+    """
+    bad = stats["bad"]
+    listed = [x for x in bad if x["listed"] is not None]
+    removed = [x for x in bad if x["removed"] is not None]
+    requests = dict(stats["requests"])
+    tokens = requests.pop("access_token", 0)
+    total = sum(requests.values())
+
+    return {
+        "duration": duration,
+        "submissions": {
+            "posted": stats["posted"],
+            "seen": stats["seen"],
+            "coverage": stats["seen"] / max(stats["posted"], 1),
+            "seen_per_second": stats["seen"] / duration,
+        },
+        "bad_posts": {
+            "posted": len(bad),
+            "detected": len(listed),
+            "removed": len(removed),
+            "removed_per_second": len(removed) / duration,
+        },
+        "latency": {
+            "post_to_listing": percentiles([x["listed"] - x["posted"] for x in listed]),
+            "listing_to_removal": percentiles(
+                [x["removed"] - x["listed"] for x in removed if x["listed"]]
+            ),
+            "post_to_removal": percentiles(
+                [x["removed"] - x["posted"] for x in removed]
+            ),
+        },
+        "requests": {
+            "total": total,
+            "per_second": total / duration,
+            "per_1000_submissions": 1000 * total / max(stats["seen"], 1),
+            "per_removal": total / max(len(removed), 1),
+            "by_endpoint": requests,
+            "token_requests": tokens,
+            "throttled": stats["throttled"],
+            "listing_fill": stats["listed_items"] / max(stats["listings"], 1),
+            "empty_listings": stats["empty_listings"] / max(stats["listings"], 1),
+            "ids_per_info_request": stats["info_ids"] / max(requests.get("info", 0), 1),
+        },
+        "bans": stats["bans"],
+        "accepted_invites": stats["accepted_invites"],
+        "not_found": stats["not_found"],
+    }
+
+
+def _print_report(report: Dict[str, Any]) -> None:
+    def ms(values: Dict[str, "float | None"]) -> str:
+        return ", ".join(
+            "%s=%s" % (k, "-" if v is None else "%.0fms" % (v * 1000))
+            for k, v in values.items()
+        )
+
+    submissions = report["submissions"]
+    bad = report["bad_posts"]
+    requests = report["requests"]
+
+    print("Submissions : %(posted)d posted, %(seen)d seen" % submissions, end="")
+    print(
+        " (%.1f%%), %.1f/s"
+        % (100 * submissions["coverage"], submissions["seen_per_second"])
+    )
+    print(
+        "Bad posts   : %(posted)d posted, %(detected)d detected, %(removed)d removed"
+        % bad
+    )
+    for name, values in report["latency"].items():
+        print("  %-19s %s" % (name, ms(values)))
+    print(
+        "Requests    : %d (%.2f/s), %.1f per 1000 submissions, %.1f per removal"
+        % (
+            requests["total"],
+            requests["per_second"],
+            requests["per_1000_submissions"],
+            requests["per_removal"],
+        )
+    )
+    print(
+        "  listings hold %.1f submissions, %.0f%% are empty, %.1f ids per /api/info"
+        % (
+            requests["listing_fill"],
+            100 * requests["empty_listings"],
+            requests["ids_per_info_request"],
+        )
+    )
+    print(
+        "  %d token request(s), %d throttled"
+        % (requests["token_requests"], requests["throttled"])
+    )
+    print(
+        "  " + ", ".join("%s=%d" % x for x in sorted(requests["by_endpoint"].items()))
+    )
+    print(
+        "Bans        : %d, invites accepted: %d"
+        % (report["bans"], report["accepted_invites"])
+    )
+    if len(report["not_found"]):
+        print("Not found   : %s" % report["not_found"])
+
+
+##########################
+# ======== MAIN ======== #
+##########################
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run the bot against a local fake reddit and report how it keeps up."
+    )
+    parser.add_argument("--subs", type=int, default=200, help="moderated subreddits")
+    parser.add_argument("--blacklisted", type=int, default=20)
+    parser.add_argument("--rate", type=float, default=10, help="submissions per second")
+    parser.add_argument(
+        "--crossposts", type=float, default=0.2, help="share of crossposts"
+    )
+    parser.add_argument(
+        "--bad", type=float, default=0.3, help="share of crossposts to blacklisted subs"
+    )
+    parser.add_argument(
+        "--embedded",
+        type=float,
+        default=0.5,
+        help="share of crossposts that come with their parent",
+    )
+    parser.add_argument("--replay", help="json lines file of recorded submissions")
+    parser.add_argument("--invites", type=int, default=0)
+    parser.add_argument("--ratelimit", type=int, default=600, help="per 10 minutes")
+    parser.add_argument("--workers", type=int, default=1, help="submission workers")
+    parser.add_argument("--duration", type=float, default=120, help="seconds")
+    parser.add_argument(
+        "--drain", type=float, default=30, help="seconds to wait for the last posts"
+    )
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--metrics", action="store_true", help="serve the metrics")
+    parser.add_argument("--json", help="also write the report to this file")
+    parser.add_argument("--keep", action="store_true", help="keep the workspace")
+    args = parser.parse_args()
+
+    blacklisted = ["blacklisted_%d" % x for x in range(args.blacklisted)]
+    reddit = FakeReddit(
+        ["sub_%d" % x for x in range(args.subs)],
+        blacklisted,
+        ratelimit=args.ratelimit,
+        invites=["invited_%d" % x for x in range(args.invites)],
+    )
+    generator = Generator(
+        reddit,
+        args.rate,
+        args.crossposts,
+        args.bad,
+        args.embedded,
+        replay=args.replay,
+        seed=args.seed,
+    )
+    server = serve(reddit)
+    api_url = "http://127.0.0.1:%d" % server.server_address[1]
+
+    workspace = p(tempfile.mkdtemp(prefix="loadtest."))
+    prepare(workspace, api_url, blacklisted, args)
+    print("Workspace %s, fake reddit on %s" % (workspace, api_url))
+
+    processes = start(workspace, args.workers)
+    started = time.monotonic()
+    generator.start()
+
+    try:
+        while time.monotonic() - started < args.duration:
+            time.sleep(10)
+            stats = reddit.stats()
+            print(
+                "%4ds: %d posted, %d seen, %d/%d bad posts removed"
+                % (
+                    time.monotonic() - started,
+                    stats["posted"],
+                    stats["seen"],
+                    sum(x["removed"] is not None for x in stats["bad"]),
+                    len(stats["bad"]),
+                )
+            )
+
+            for process in processes:
+                if process.poll() is not None:
+                    raise SystemExit(
+                        "%s exited with code %d, see %s"
+                        % (process.args[1], process.returncode, workspace / "logs")
+                    )
+
+        duration = time.monotonic() - started
+        generator.stop()
+        time.sleep(args.drain)
+    finally:
+        generator.stop()
+        stop(processes)
+
+    report = summarize(reddit.stats(), duration)
+    _print_report(report)
+
+    if args.json:
+        with open(args.json, "wt", encoding="utf-8") as f:
+            json.dump(report, f, indent=4)
+
+    if not args.keep:
+        shutil.rmtree(str(workspace), ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()